@@ -8,8 +8,36 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # Listener lệnh MongoDB phải đăng ký trước khi tạo MongoClient
+    from app.profiler import db_profiler
+    db_profiler.init_app(app)
+
     mongo.init_app(app)
 
+    from app.cache import reference_cache
+    reference_cache.init_app(app)
+
+    from app.stations import station_index
+    station_index.init_app(app)
+
+    from app.connections import connection_graph
+    connection_graph.init_app(app)
+
+    from app.http_cache import response_cache
+    response_cache.init_app(app)
+
+    from app.ids import id_allocator
+    id_allocator.init_app(app)
+
+    from app.seat_events import seat_events
+    seat_events.init_app(app)
+
+    from app.waitlist import waitlist_worker
+    waitlist_worker.init_app(app)
+
+    from app.archive import trip_archiver
+    trip_archiver.init_app(app)
+
     from app.routes.user import user_bp
     from app.routes.admin import admin_bp
     from app.routes.auth_new import auth_bp
@@ -18,4 +46,8 @@ def create_app(config_class=Config):
     app.register_blueprint(admin_bp, url_prefix='/admin')
     app.register_blueprint(auth_bp, url_prefix='/auth')
 
+    if app.config.get('ENSURE_INDEXES'):
+        from app.indexes import ensure_indexes_at_startup
+        ensure_indexes_at_startup(app)
+
     return app
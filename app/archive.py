@@ -0,0 +1,297 @@
+"""
+Lưu trữ nóng / lạnh cho chuyến đã kết thúc.
+
+Chuyến 'Đã hoàn thành' / 'Đã hủy' có ngày đi cũ hơn ARCHIVE_HORIZON_DAYS được
+chuyển, cùng ghế và vé của chuyến, sang LichTrinhLuuTru, GheLuuTru,
+VeXeLuuTru theo lô ARCHIVE_BATCH_SIZE chuyến. Mỗi chuyến để lại một dòng tổng
+kết trong TongKetChuyen (số vé, số vé hủy, doanh thu theo tháng đặt) cho báo
+cáo. Danh sách, bộ đếm và báo cáo trên collection nóng không còn quét toàn bộ
+lịch sử.
+
+Mỗi lô chép sang collection lưu trữ trước (giữ nguyên _id, bỏ qua bản đã có)
+rồi mới xóa khỏi collection nóng, nên bị ngắt giữa chừng thì lần chạy sau làm
+tiếp mà không mất hay nhân đôi dữ liệu.
+
+Truy vấn đọc kho lưu trữ khi cần bằng $unionWith (MongoDB 4.4+):
+    trip_source(...)                  - admin.trip_list khi bộ lọc ngày chạm vào vùng đã lưu trữ
+    ticket_history(..., archive=True) - lịch sử chuyến đi của khách
+
+Chạy theo lịch (cron) hoặc tay - thread nền chỉ chạy khi bật ARCHIVE_ENABLED (mặc định tắt):
+    python -m app.archive [--horizon-days 90] [--dry-run]
+"""
+
+import argparse
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from app.ticket_schema import CANCELLED, PAID, STATUS_FIELD, canonical_status
+
+ARCHIVABLE_STATUSES = ['Đã hoàn thành', 'Đã hủy']
+ARCHIVE_COLLECTIONS = {'LichTrinh': 'LichTrinhLuuTru', 'Ghe': 'GheLuuTru', 'VeXe': 'VeXeLuuTru'}
+SUMMARY_COLLECTION = 'TongKetChuyen'
+LEASE_COLLECTION = 'DiChuyenDuLieu'
+LEASE_ID = 'luuTruChuyen'
+DUPLICATE_KEY = 11000
+# Vé đã thanh toán không có ngày đặt: vẫn tính doanh thu, gom vào một dòng riêng
+UNDATED_MONTH = 'Không rõ'
+
+
+def cutoff(horizon_days, now=None):
+    """Chuyến có ngày đi trước mốc này (và đã kết thúc) thuộc kho lưu trữ"""
+    today = (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=horizon_days)
+
+
+def _copy(db, collection_name, docs):
+    """Chép sang collection lưu trữ, bỏ qua document đã chép ở lần chạy trước"""
+    if not docs:
+        return
+    try:
+        db[ARCHIVE_COLLECTIONS[collection_name]].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if any(error.get('code') != DUPLICATE_KEY for error in e.details.get('writeErrors', [])):
+            raise
+
+
+def fare_prices(db, tickets):
+    """{maGiaVe: giaVe} cho các vé - một $in"""
+    fare_codes = list({ticket.get('maGiaVe') for ticket in tickets if ticket.get('maGiaVe')})
+    return {fare['maGiaVe']: fare.get('giaVe', 0)
+            for fare in db.GiaVe.find({'maGiaVe': {'$in': fare_codes}}, {'maGiaVe': 1, 'giaVe': 1})}
+
+
+def revenue_by_month(tickets, prices):
+    """
+    Doanh thu vé đã thanh toán theo tháng đặt (ngayThem, không có thì ngayDat;
+    không có cả hai thì vào dòng UNDATED_MONTH). Dùng chung cho dòng tổng kết
+    khi lưu trữ và cho vé còn ở VeXe (admin.revenue) để báo cáo không đổi khi
+    chuyến được chuyển sang kho lưu trữ.
+    """
+    revenue = defaultdict(int)
+    for ticket in tickets:
+        if (ticket.get(STATUS_FIELD) or canonical_status(ticket)) != PAID:
+            continue
+        booked_at = ticket.get('ngayThem') or ticket.get('ngayDat')
+        month = booked_at.strftime('%Y-%m') if isinstance(booked_at, datetime) else UNDATED_MONTH
+        revenue[month] += prices.get(ticket.get('maGiaVe'), 0)
+    return dict(revenue)
+
+
+def _summary(trip, tickets, prices, archived_at):
+    """Dòng tổng kết của một chuyến: số vé và doanh thu (vé đã thanh toán) theo tháng đặt"""
+    cancelled = sum(1 for ticket in tickets if (ticket.get(STATUS_FIELD) or canonical_status(ticket)) == CANCELLED)
+    sold = len(tickets) - cancelled
+    revenue = revenue_by_month(tickets, prices)
+    return {
+        'maLichTrinh': trip['maLichTrinh'],
+        'maXe': trip.get('maXe'),
+        'diemDi': trip.get('diemDi'),
+        'diemDen': trip.get('diemDen'),
+        'ngayDi': trip.get('ngayDi'),
+        'tinhTrang': trip.get('tinhTrang'),
+        'tongGhe': trip.get('tongGhe', 0),
+        'soVe': sold,
+        'soVeHuy': cancelled,
+        'doanhThu': sum(revenue.values()),
+        'doanhThuTheoThang': revenue,
+        'ngayLuuTru': archived_at,
+    }
+
+
+def archive_batch(db, before, batch_size=50):
+    """Lưu trữ tối đa batch_size chuyến - trả về số chuyến đã chuyển"""
+    trips = list(db.LichTrinh.find(
+        {'tinhTrang': {'$in': ARCHIVABLE_STATUSES}, 'ngayDi': {'$lt': before}}
+    ).sort('ngayDi', 1).limit(batch_size))
+    if not trips:
+        return 0
+    codes = [trip['maLichTrinh'] for trip in trips]
+    archived_at = datetime.now()
+
+    # Chép trước, xóa sau: bị ngắt ở giữa thì lần sau chép lại (bỏ qua trùng) rồi xóa tiếp.
+    # Ghế / vé xóa theo _id của bản đã chép, đọc lại đến khi hết: bản ghi vào giữa
+    # lần đọc và lần xóa được chép ở vòng sau thay vì bị xóa mất
+    for trip in trips:
+        trip['ngayLuuTru'] = archived_at
+    _copy(db, 'LichTrinh', trips)
+    for collection_name in ('Ghe', 'VeXe'):
+        while True:
+            docs = list(db[collection_name].find({'maLichTrinh': {'$in': codes}}))
+            if not docs:
+                break
+            for doc in docs:
+                doc['ngayLuuTru'] = archived_at
+            _copy(db, collection_name, docs)
+            db[collection_name].delete_many({'_id': {'$in': [doc['_id'] for doc in docs]}})
+
+    # Tổng kết từ kho lưu trữ: đủ vé kể cả phần đã chuyển ở lần chạy bị ngắt trước
+    tickets = list(db[ARCHIVE_COLLECTIONS['VeXe']].find({'maLichTrinh': {'$in': codes}}))
+    prices = fare_prices(db, tickets)
+    tickets_by_trip = defaultdict(list)
+    for ticket in tickets:
+        tickets_by_trip[ticket['maLichTrinh']].append(ticket)
+    for trip in trips:
+        db[SUMMARY_COLLECTION].replace_one(
+            {'maLichTrinh': trip['maLichTrinh']},
+            _summary(trip, tickets_by_trip[trip['maLichTrinh']], prices, archived_at), upsert=True
+        )
+    db.LichTrinh.delete_many({'_id': {'$in': [trip['_id'] for trip in trips]}})
+    return len(trips)
+
+
+def archive_trips(db, horizon_days=90, batch_size=50, max_batches=None):
+    """Lưu trữ mọi chuyến đủ điều kiện, theo lô - trả về số chuyến đã chuyển"""
+    before = cutoff(horizon_days)
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(db, before, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+    return moved
+
+
+def pending(db, horizon_days=90):
+    return db.LichTrinh.count_documents(
+        {'tinhTrang': {'$in': ARCHIVABLE_STATUSES}, 'ngayDi': {'$lt': cutoff(horizon_days)}}
+    )
+
+
+def reaches_archive(date_from, date_to, horizon_days):
+    """Bộ lọc ngày có chạm vào vùng đã lưu trữ không (không lọc ngày: chỉ đọc collection nóng)"""
+    before = cutoff(horizon_days)
+    return any(value is not None and value < before for value in (date_from, date_to))
+
+
+def union_pipeline(collection_name, query):
+    """Các stage đầu của aggregation đọc cả collection nóng lẫn kho lưu trữ"""
+    return [
+        {'$match': query},
+        {'$unionWith': {'coll': ARCHIVE_COLLECTIONS[collection_name], 'pipeline': [{'$match': query}]}},
+    ]
+
+
+def trip_source(db, date_from, date_to, horizon_days):
+    """
+    (fetch, count) cho danh sách lịch trình: chỉ collection nóng, hoặc kèm kho
+    lưu trữ khi bộ lọc ngày chạm vào vùng đã lưu trữ. fetch theo chữ ký của
+    app/pagination.paginate.
+    """
+    if not reaches_archive(date_from, date_to, horizon_days):
+        def fetch(query, sort, limit):
+            return list(db.LichTrinh.find(query).sort(list(sort.items())).limit(limit))
+
+        def count(query):
+            return db.LichTrinh.count_documents(query)
+    else:
+        def fetch(query, sort, limit):
+            return list(db.LichTrinh.aggregate(union_pipeline('LichTrinh', query) + [
+                {'$sort': sort}, {'$limit': limit}
+            ]))
+
+        def count(query):
+            return db.LichTrinh.count_documents(query) + db[ARCHIVE_COLLECTIONS['LichTrinh']].count_documents(query)
+    return fetch, count
+
+
+def archived_status_counts(db):
+    """Số chuyến đã lưu trữ theo tinhTrang - từ bảng tổng kết"""
+    return {row['_id']: row['soChuyen'] for row in db[SUMMARY_COLLECTION].aggregate([
+        {'$group': {'_id': '$tinhTrang', 'soChuyen': {'$sum': 1}}}
+    ])}
+
+
+def archived_revenue_by_month(db):
+    """Doanh thu của các chuyến đã lưu trữ theo tháng đặt vé"""
+    revenue = defaultdict(int)
+    for summary in db[SUMMARY_COLLECTION].find({'doanhThu': {'$gt': 0}}, {'doanhThuTheoThang': 1}):
+        for month, amount in (summary.get('doanhThuTheoThang') or {}).items():
+            revenue[month] += amount
+    return dict(revenue)
+
+
+class TripArchiver:
+    """Thread nền chạy lưu trữ mỗi ARCHIVE_INTERVAL_HOURS; lease trong DiChuyenDuLieu để chỉ một process chạy"""
+
+    def __init__(self, horizon_days=90, batch_size=50, interval_hours=24):
+        self.horizon_days = horizon_days
+        self.batch_size = batch_size
+        self.interval_hours = interval_hours
+        self.enabled = False
+        self._thread = None
+        self._app = None
+        self.last_run = None
+        self.archived = 0
+
+    def init_app(self, app):
+        self.horizon_days = app.config.get('ARCHIVE_HORIZON_DAYS', self.horizon_days)
+        self.batch_size = app.config.get('ARCHIVE_BATCH_SIZE', self.batch_size)
+        self.interval_hours = app.config.get('ARCHIVE_INTERVAL_HOURS', self.interval_hours)
+        self.enabled = app.config.get('ARCHIVE_ENABLED', False)
+        self._app = app
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _acquire(self, db):
+        """Giành lượt chạy cho chu kỳ này - process khác đã chạy thì bỏ qua"""
+        now = datetime.now()
+        try:
+            return db[LEASE_COLLECTION].find_one_and_update(
+                {'_id': LEASE_ID, '$or': [{'chayTiep': {'$lte': now}}, {'chayTiep': {'$exists': False}}]},
+                {'$set': {'chayTiep': now + timedelta(hours=self.interval_hours), 'ngayCapNhat': now}},
+                upsert=True, return_document=ReturnDocument.AFTER
+            ) is not None
+        except DuplicateKeyError:
+            # Upsert trùng _id: lease còn hạn ở process khác
+            return False
+
+    def run_once(self, db):
+        from app.http_cache import response_cache
+
+        moved = archive_trips(db, self.horizon_days, self.batch_size)
+        if moved:
+            response_cache.invalidate('LichTrinh')
+        self.archived += moved
+        self.last_run = datetime.now()
+        return moved
+
+    def _run(self):
+        from app import mongo
+
+        with self._app.app_context():
+            while True:
+                try:
+                    if self._acquire(mongo.db):
+                        self.run_once(mongo.db)
+                except PyMongoError as e:
+                    print(f"Trip archival failed: {e}")
+                time.sleep(min(3600, self.interval_hours * 3600))
+
+
+trip_archiver = TripArchiver()
+
+
+if __name__ == '__main__':
+    from app import create_app, mongo
+
+    parser = argparse.ArgumentParser(description='Archive finished trips with their seats and tickets')
+    parser.add_argument('--horizon-days', type=int)
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--dry-run', action='store_true', help='chỉ đếm số chuyến sẽ lưu trữ')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        horizon = args.horizon_days or app.config.get('ARCHIVE_HORIZON_DAYS', 90)
+        if args.dry_run:
+            print(f"{pending(mongo.db, horizon)} trips older than {horizon} days ready to archive")
+        else:
+            moved = archive_trips(mongo.db, horizon, args.batch_size or app.config.get('ARCHIVE_BATCH_SIZE', 50))
+            print(f"Archived {moved} trips")
@@ -0,0 +1,121 @@
+"""
+Cache trong bộ nhớ cho dữ liệu tham chiếu ít thay đổi
+(TuyenDuong, XeKhach, GiaVe, SoDoGhe, LoaiXe).
+
+    from app.cache import reference_cache
+    xe = reference_cache.find_one('XeKhach', {'maXeKhach': ma_xe})
+
+Mỗi entry hết hạn sau REFERENCE_CACHE_TTL giây; khi vượt REFERENCE_CACHE_SIZE
+entry thì bỏ entry dùng lâu nhất (LRU). Các route admin ghi vào những collection
+này gọi `reference_cache.invalidate(collection_name)`. Cache nằm trong từng
+process nên TTL là giới hạn độ cũ khi chạy nhiều worker.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from bson import json_util
+
+REFERENCE_COLLECTIONS = ('TuyenDuong', 'XeKhach', 'GiaVe', 'SoDoGhe', 'LoaiXe')
+
+
+class ReferenceCache:
+    def __init__(self, ttl=300, maxsize=1000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get('REFERENCE_CACHE_TTL', self.ttl)
+        self.maxsize = app.config.get('REFERENCE_CACHE_SIZE', self.maxsize)
+        self.clear()
+
+    @staticmethod
+    def _key(kind, collection_name, query, extra=None):
+        return (collection_name, kind, json_util.dumps(query, sort_keys=True), repr(extra))
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # Trả bản sao để route có thể sửa document mà không làm bẩn cache
+            return True, copy.deepcopy(entry[1])
+
+    def _put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def find_one(self, collection_name, query, db=None):
+        """find_one qua cache (chỉ dùng cho REFERENCE_COLLECTIONS)"""
+        key = self._key('one', collection_name, query)
+        found, value = self._get(key)
+        if found:
+            return value
+        value = _db(db)[collection_name].find_one(query)
+        self._put(key, value)
+        return value
+
+    def find(self, collection_name, query=None, sort=None, db=None):
+        """find(...) trả về list qua cache"""
+        query = query or {}
+        key = self._key('many', collection_name, query, sort)
+        found, value = self._get(key)
+        if found:
+            return value
+        cursor = _db(db)[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        value = list(cursor)
+        self._put(key, value)
+        return value
+
+    def invalidate(self, collection_name=None):
+        """Xóa entry của một collection (hoặc toàn bộ khi không truyền tên)"""
+        with self._lock:
+            if collection_name is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == collection_name]:
+                del self._entries[key]
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl
+            }
+
+
+def _db(db):
+    if db is not None:
+        return db
+    from app import mongo
+    return mongo.db
+
+
+reference_cache = ReferenceCache()
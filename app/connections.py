@@ -0,0 +1,248 @@
+"""
+Tìm hành trình nối chuyến khi không có chuyến thẳng.
+
+Đồ thị tuyến trong bộ nhớ:
+    - đỉnh: địa điểm (khóa không dấu, xem app/normalize.py)
+    - cạnh: mỗi lịch trình đang mở bán là một chặng (giờ đi -> giờ đến ước tính)
+    - thời gian chạy của chặng lấy từ TuyenDuong.thoiGianDi (giờ), không có thì
+      ước theo doDai ở 60 km/h, mặc định DEFAULT_TRAVEL_HOURS
+
+Tìm kiếm là Dijkstra phụ thuộc thời gian (nhãn = giờ đến sớm nhất tại mỗi
+địa điểm, số chặng bị giới hạn): ở điểm nối chỉ đi tiếp các chuyến khởi hành
+sau giờ đến + CONNECTION_MIN_TRANSFER_MINUTES và không chờ quá
+CONNECTION_MAX_WAIT_HOURS.
+
+Admin tạo/sửa/xóa lịch trình gọi `connection_graph.trip_changed(before, after)`
+để cập nhật từng chặng; sửa TuyenDuong thì dựng lại. CONNECTION_GRAPH_TTL giới
+hạn độ cũ khi chạy nhiều worker.
+"""
+
+import bisect
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app.normalize import fold_text
+from app.search import ACTIVE_TRIP_STATUSES, search_trips
+
+DEFAULT_TRAVEL_HOURS = 8
+
+
+def _departure_time(trip):
+    """ngayDi + gioDi ('HH:MM') -> datetime; None nếu thiếu ngày"""
+    ngay_di = trip.get('ngayDi')
+    if isinstance(ngay_di, str):
+        try:
+            ngay_di = datetime.strptime(ngay_di[:10], '%Y-%m-%d')
+        except ValueError:
+            return None
+    if not isinstance(ngay_di, datetime):
+        return None
+    try:
+        hour, minute = (int(part) for part in str(trip.get('gioDi') or '').split(':')[:2])
+        return ngay_di.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    except ValueError:
+        return ngay_di
+
+
+class ConnectionGraph:
+    def __init__(self, ttl=600, min_transfer=30, max_wait=12, horizon=30):
+        self.ttl = ttl
+        self.min_transfer = timedelta(minutes=min_transfer)
+        self.max_wait = timedelta(hours=max_wait)
+        self.horizon = horizon
+        self._departures = {}  # khóa địa điểm -> [(giờ đi, mã lịch trình)] đã sắp xếp
+        self._legs = {}  # mã lịch trình -> chặng
+        self._durations = {}  # (khóa đi, khóa đến) -> số giờ chạy
+        self._names = {}  # khóa địa điểm -> tên hiển thị
+        self._built_at = None
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('CONNECTION_GRAPH_TTL', self.ttl)
+        self.min_transfer = timedelta(minutes=app.config.get('CONNECTION_MIN_TRANSFER_MINUTES', 30))
+        self.max_wait = timedelta(hours=app.config.get('CONNECTION_MAX_WAIT_HOURS', 12))
+        self.horizon = app.config.get('CONNECTION_HORIZON_DAYS', self.horizon)
+        self._built_at = None
+
+    # ----- Dựng đồ thị -----
+
+    def _travel_hours(self, from_key, to_key):
+        return self._durations.get((from_key, to_key)) or DEFAULT_TRAVEL_HOURS
+
+    def _add_trip(self, trip):
+        code = trip.get('maLichTrinh')
+        depart = _departure_time(trip)
+        if not code or not depart or trip.get('tinhTrang') not in ACTIVE_TRIP_STATUSES:
+            return
+        from_key = trip.get('diemDiKey') or fold_text(trip.get('diemDi'))
+        to_key = trip.get('diemDenKey') or fold_text(trip.get('diemDen'))
+        if not from_key or not to_key or from_key == to_key:
+            return
+        self._legs[code] = {
+            'maLichTrinh': code,
+            'from': from_key,
+            'to': to_key,
+            'diemDi': trip.get('diemDi'),
+            'diemDen': trip.get('diemDen'),
+            'depart': depart,
+            'arrive': depart + timedelta(hours=self._travel_hours(from_key, to_key))
+        }
+        self._names.setdefault(from_key, trip.get('diemDi'))
+        self._names.setdefault(to_key, trip.get('diemDen'))
+        bisect.insort(self._departures.setdefault(from_key, []), (depart, code))
+
+    def _remove_trip(self, code):
+        leg = self._legs.pop(code, None)
+        if leg:
+            departures = self._departures.get(leg['from'], [])
+            entry = (leg['depart'], code)
+            i = bisect.bisect_left(departures, entry)
+            if i < len(departures) and departures[i] == entry:
+                del departures[i]
+
+    def rebuild(self, db):
+        with self._lock:
+            self._departures, self._legs, self._durations, self._names = {}, {}, {}, {}
+            for tuyen in db.TuyenDuong.find({}, {'diemDau': 1, 'diemCuoi': 1, 'thoiGianDi': 1, 'doDai': 1}):
+                a, b = fold_text(tuyen.get('diemDau')), fold_text(tuyen.get('diemCuoi'))
+                try:
+                    hours = float(tuyen.get('thoiGianDi') or 0) or float(tuyen.get('doDai') or 0) / 60
+                except (TypeError, ValueError):
+                    hours = 0
+                if a and b and hours:
+                    self._durations[(a, b)] = self._durations[(b, a)] = hours
+
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            trips = db.LichTrinh.find({
+                'ngayDi': {'$gte': today, '$lt': today + timedelta(days=self.horizon)},
+                'tinhTrang': {'$in': ACTIVE_TRIP_STATUSES}
+            }, {'maLichTrinh': 1, 'diemDi': 1, 'diemDen': 1, 'diemDiKey': 1, 'diemDenKey': 1,
+                'ngayDi': 1, 'gioDi': 1, 'tinhTrang': 1})
+            for trip in trips:
+                self._add_trip(trip)
+            self._built_at = time.monotonic()
+
+    def _ensure_built(self, db):
+        if self._built_at is None or time.monotonic() - self._built_at > self.ttl:
+            self.rebuild(db)
+
+    def trip_changed(self, before=None, after=None):
+        """Cập nhật chặng khi tạo/sửa/xóa lịch trình"""
+        if self._built_at is None:
+            return
+        with self._lock:
+            for trip in (before, after):
+                if trip and trip.get('maLichTrinh'):
+                    self._remove_trip(trip['maLichTrinh'])
+            if after:
+                self._add_trip(after)
+
+    def invalidate(self):
+        """Thời gian chạy của tuyến thay đổi - dựng lại ở lần tìm kiếm sau"""
+        self._built_at = None
+
+    # ----- Tìm kiếm -----
+
+    def _earliest_arrival(self, start, ready, destination, max_legs):
+        """
+        Dijkstra phụ thuộc thời gian: chuỗi chặng đến destination sớm nhất khi
+        có mặt ở start lúc ready (đã tính thời gian chuyển xe).
+        """
+        best = {(start, 0): ready}
+        tie = itertools.count()  # tránh so sánh path khi trùng giờ
+        queue = [(ready, 0, next(tie), start, ())]
+        while queue:
+            arrive, legs_used, _, station, path = heapq.heappop(queue)
+            if station == destination and path:
+                return path
+            if legs_used >= max_legs or best.get((station, legs_used), arrive) < arrive:
+                continue
+            departures = self._departures.get(station, [])
+            i = bisect.bisect_left(departures, (arrive,))
+            latest = arrive + self.max_wait
+            for depart, code in departures[i:]:
+                if depart > latest:
+                    break
+                leg = self._legs[code]
+                if any(prev['from'] == leg['to'] for prev in path):
+                    continue  # Không quay lại địa điểm đã đi qua
+                state = (leg['to'], legs_used + 1)
+                ready_next = leg['arrive'] if leg['to'] == destination else leg['arrive'] + self.min_transfer
+                if ready_next < best.get(state, datetime.max):
+                    best[state] = ready_next
+                    heapq.heappush(queue, (ready_next, legs_used + 1, next(tie), leg['to'], path + (leg,)))
+        return None
+
+    def itineraries(self, db, diem_di, diem_den, depart_after, depart_before, max_legs=2, limit=5):
+        """
+        Hành trình có nối chuyến: với mỗi chuyến rời điểm đi trong
+        [depart_after, depart_before) đến một điểm nối, tìm đường đến sớm nhất.
+        Bỏ các hành trình bị trội (đi muộn hơn mà vẫn đến sớm hơn hoặc bằng).
+        """
+        self._ensure_built(db)
+        origin, destination = fold_text(diem_di), fold_text(diem_den)
+        if not origin or not destination or origin == destination:
+            return []
+
+        found = []
+        with self._lock:
+            departures = self._departures.get(origin, [])
+            i = bisect.bisect_left(departures, (depart_after,))
+            for depart, code in departures[i:]:
+                if depart >= depart_before:
+                    break
+                first = self._legs[code]
+                if first['to'] == destination:
+                    continue  # Chuyến thẳng - đã có trong kết quả chính
+                rest = self._earliest_arrival(
+                    first['to'], first['arrive'] + self.min_transfer, destination, max_legs - 1
+                )
+                if rest:
+                    found.append((first,) + rest)
+
+        # Giữ hành trình không bị trội, sắp theo giờ đến
+        found.sort(key=lambda legs: (legs[-1]['arrive'], -legs[0]['depart'].timestamp()))
+        result, latest_depart = [], None
+        for legs in found:
+            if latest_depart is None or legs[0]['depart'] > latest_depart:
+                result.append(legs)
+                latest_depart = legs[0]['depart']
+        return [{
+            'legs': [dict(leg) for leg in legs],
+            'transfers': [self._names.get(leg['to'], leg['diemDen']) for leg in legs[:-1]],
+            'depart': legs[0]['depart'],
+            'arrive': legs[-1]['arrive']
+        } for legs in result[:limit]]
+
+
+def connection_itineraries(db, diem_di, diem_den, depart_after, depart_before, limit=5):
+    """
+    Hành trình một điểm nối cho user.search, gắn số ghế trống và giá vé hiện
+    tại của từng chặng (một aggregation cho mọi chặng).
+    """
+    itineraries = connection_graph.itineraries(db, diem_di, diem_den, depart_after, depart_before, limit=limit)
+    codes = {leg['maLichTrinh'] for it in itineraries for leg in it['legs']}
+    if not codes:
+        return []
+    trips = {t['maLichTrinh']: t for t in search_trips(db, {'maLichTrinh': {'$in': list(codes)}})}
+
+    result = []
+    for it in itineraries:
+        legs = []
+        for leg in it['legs']:
+            trip = trips.get(leg['maLichTrinh'])
+            if not trip or trip.get('tinhTrang') not in ACTIVE_TRIP_STATUSES:
+                break
+            legs.append({**leg, 'trip': trip, 'gia_ve': trip.get('gia_ve') or 0, 'ghe_trong': trip.get('ghe_trong', 0)})
+        else:
+            it['legs'] = legs
+            it['tong_gia'] = sum(leg['gia_ve'] for leg in legs)
+            it['ghe_trong'] = min(leg['ghe_trong'] for leg in legs)
+            result.append(it)
+    return result
+
+
+connection_graph = ConnectionGraph()
@@ -0,0 +1,176 @@
+"""
+Lịch khởi hành theo ngày, tính sẵn cho /api/available-dates.
+
+Collection LichKhoiHanh có một document cho mỗi (điểm đi, điểm đến, ngày):
+    diemDiKey, diemDenKey, ngay      - khóa (khóa không dấu, xem app/normalize.py)
+    diemDi, diemDen                  - tên gốc để hiển thị
+    soChuyen, giaThapNhat, gioDiSomNhat
+    chuyen: [{maLichTrinh, gioDi, tinhTrang, giaVe}]
+
+Tạo/sửa/xóa lịch trình trong admin gọi `trip_changed` để tính lại đúng các
+ngày bị ảnh hưởng; đổi GiaVe/TuyenDuong thì tính lại toàn bộ. Cặp điểm chưa có
+ngày nào trong LichKhoiHanh (database có sẵn, chưa tính lịch) được tính từ
+LichTrinh ngay lần đầu được hỏi - xem `calendar_days`.
+
+Tính lại từ đầu, sau khi backfill khóa không dấu (chuyến chưa có
+diemDiKey/diemDenKey vẫn được khớp theo tên gốc):
+    python -m app.normalize
+    python -m app.departures
+"""
+
+from datetime import datetime, timedelta
+
+from pymongo import DeleteOne, UpdateOne
+
+from app.cache import reference_cache
+from app.normalize import fold_text
+from app.search import ACTIVE_TRIP_STATUSES, search_trips
+
+CALENDAR_COLLECTION = 'LichKhoiHanh'
+
+
+def _day(value):
+    """Ngày (00:00) của ngayDi - chấp nhận datetime hoặc chuỗi 'YYYY-MM-DD...'"""
+    if isinstance(value, datetime):
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if isinstance(value, str) and len(value) >= 10:
+        try:
+            return datetime.strptime(value[:10], '%Y-%m-%d')
+        except ValueError:
+            return None
+    return None
+
+
+def _fare_route(diem_di, diem_den):
+    """Mã tuyến dùng tra giá - giống cách user.search chọn tuyến"""
+    tuyen = reference_cache.find_one('TuyenDuong', {'$or': [
+        {'diemDau': diem_di, 'diemCuoi': diem_den},
+        {'diemDau': diem_den, 'diemCuoi': diem_di}
+    ]})
+    return tuyen.get('maTuyenDuong') if tuyen else None
+
+
+def _refresh(db, diem_di, diem_den, day_from, day_to=None):
+    """Tính lại các ngày của một cặp điểm trong khoảng [day_from, day_to)"""
+    if not diem_di or not diem_den:
+        return 0
+    di_key, den_key = fold_text(diem_di), fold_text(diem_den)
+    date_range = {'$gte': day_from}
+    if day_to:
+        date_range['$lt'] = day_to
+
+    trips = search_trips(db, {
+        # Tên gốc: chuyến chưa được backfill khóa (python -m app.normalize)
+        '$or': [{'diemDiKey': di_key, 'diemDenKey': den_key}, {'diemDi': diem_di, 'diemDen': diem_den}],
+        'ngayDi': date_range,
+        'tinhTrang': {'$in': ACTIVE_TRIP_STATUSES}
+    }, fare_route=_fare_route(diem_di, diem_den))
+
+    days = {}
+    for trip in trips:
+        day = _day(trip.get('ngayDi'))
+        if day:
+            days.setdefault(day, []).append(trip)
+
+    calendar = db[CALENDAR_COLLECTION]
+    key = {'diemDiKey': di_key, 'diemDenKey': den_key}
+    ops = []
+    for existing in calendar.find({**key, 'ngay': date_range}, {'ngay': 1}):
+        if existing['ngay'] not in days:
+            ops.append(DeleteOne({'_id': existing['_id']}))
+
+    for day, day_trips in days.items():
+        fares = [t['gia_ve'] for t in day_trips if t.get('gia_ve')]
+        departures = sorted(t.get('gioDi') or '' for t in day_trips)
+        ops.append(UpdateOne({**key, 'ngay': day}, {'$set': {
+            'diemDi': diem_di,
+            'diemDen': diem_den,
+            'soChuyen': len(day_trips),
+            'giaThapNhat': min(fares) if fares else None,
+            'gioDiSomNhat': departures[0] if departures else '',
+            'chuyen': [{
+                'maLichTrinh': t.get('maLichTrinh'),
+                'gioDi': t.get('gioDi', ''),
+                'tinhTrang': t.get('tinhTrang'),
+                'giaVe': t.get('gia_ve')
+            } for t in day_trips],
+            'ngayCapNhat': datetime.now()
+        }}, upsert=True))
+
+    if ops:
+        calendar.bulk_write(ops, ordered=False)
+    return len(days)
+
+
+def refresh_day(db, diem_di, diem_den, ngay):
+    day = _day(ngay)
+    if day:
+        _refresh(db, diem_di, diem_den, day, day + timedelta(days=1))
+
+
+def trip_changed(db, before=None, after=None):
+    """Tính lại các ngày bị ảnh hưởng khi tạo/sửa/xóa lịch trình"""
+    affected = set()
+    for trip in (before, after):
+        if trip:
+            affected.add((trip.get('diemDi'), trip.get('diemDen'), _day(trip.get('ngayDi'))))
+    for diem_di, diem_den, day in affected:
+        if day:
+            try:
+                refresh_day(db, diem_di, diem_den, day)
+            except Exception as e:
+                print(f"Error refreshing departure calendar {diem_di} → {diem_den} {day}: {e}")
+
+
+def rebuild_calendar(db, day_from=None):
+    """Tính lại toàn bộ lịch từ day_from (mặc định hôm nay)"""
+    day_from = day_from or _day(datetime.now())
+    db[CALENDAR_COLLECTION].delete_many({'ngay': {'$lt': day_from}})
+
+    pairs = db.LichTrinh.aggregate([
+        {'$match': {'ngayDi': {'$gte': day_from}, 'tinhTrang': {'$in': ACTIVE_TRIP_STATUSES}}},
+        {'$group': {'_id': {'diemDi': '$diemDi', 'diemDen': '$diemDen'}}}
+    ])
+    seen = set()
+    for pair in pairs:
+        diem_di, diem_den = pair['_id'].get('diemDi'), pair['_id'].get('diemDen')
+        seen.add((fold_text(diem_di), fold_text(diem_den)))
+        _refresh(db, diem_di, diem_den, day_from)
+
+    # Cặp điểm không còn chuyến nào
+    db[CALENDAR_COLLECTION].delete_many({
+        'ngay': {'$gte': day_from},
+        '$nor': [{'diemDiKey': di, 'diemDenKey': den} for di, den in seen] or [{'_id': None}]
+    })
+    return len(seen)
+
+
+def available_dates(db, key_pairs, day_from):
+    """Một truy vấn range trên index (diemDiKey, diemDenKey, ngay)"""
+    return list(db[CALENDAR_COLLECTION].find({
+        '$or': [{'diemDiKey': di, 'diemDenKey': den} for di, den in key_pairs],
+        'ngay': {'$gte': day_from}
+    }).sort('ngay', 1))
+
+
+def calendar_days(db, place_pairs, day_from):
+    """
+    Các ngày có chuyến cho những cặp (điểm đi, điểm đến) - tên gốc, truyền cả hai chiều.
+    Chưa có ngày nào trong LichKhoiHanh thì tính các cặp này từ LichTrinh rồi đọc
+    lại, nên database chưa chạy `python -m app.departures` vẫn trả về đúng ngày.
+    """
+    key_pairs = {(fold_text(diem_di), fold_text(diem_den)) for diem_di, diem_den in place_pairs}
+    days = available_dates(db, key_pairs, day_from)
+    if not days:
+        built = sum(_refresh(db, diem_di, diem_den, day_from) for diem_di, diem_den in place_pairs)
+        if built:
+            days = available_dates(db, key_pairs, day_from)
+    return days
+
+
+if __name__ == '__main__':
+    from app import create_app, mongo
+
+    app = create_app()
+    with app.app_context():
+        print(f"Rebuilt departure calendar for {rebuild_calendar(mongo.db)} routes")
@@ -0,0 +1,165 @@
+"""
+Giữ chỗ tạm thời trong lúc khách điền thông tin đặt vé.
+
+Collection GiuCho có tối đa một document cho mỗi (maLichTrinh, maGhe) (index
+unique):
+    nguoiGiu  - id khách hàng đang giữ ghế
+    hetHan    - thời điểm hết hạn; index TTL xóa document sau thời điểm này
+    ngayCapNhat - lần giữ / gia hạn gần nhất
+
+TTL monitor của MongoDB chạy khoảng 60 giây một lần nên mọi truy vấn đều lọc
+thêm `hetHan > now`: giữ chỗ đã hết hạn nhưng chưa bị xóa được coi như không
+tồn tại và có thể bị người khác chiếm lại (upsert điều kiện).
+
+Ghế đang giữ được bật bit trong LichTrinh.bitGheDangGiu (app/occupancy.py) để
+sơ đồ ghế bỏ qua truy vấn GiuCho khi chuyến không có giữ chỗ nào. Bit được tắt
+khi trả / chuyển giữ chỗ thành vé; giữ chỗ hết hạn để lại bit cho đến lần đó.
+
+Thống kê theo ngày (GiuChoThongKe) để xem độ "xoay vòng" giữ chỗ:
+    taoMoi, giaHan, huy, tuChoi, chuyenThanhVe
+Số giữ chỗ hết hạn = taoMoi - chuyenThanhVe - huy - số đang giữ.
+"""
+
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.occupancy import HELD_BITS, OCCUPANCY_FIELDS, booked_seats, mark_seats
+from app.seat_events import seat_events
+
+HOLD_COLLECTION = 'GiuCho'
+HOLD_STATS_COLLECTION = 'GiuChoThongKe'
+DEFAULT_HOLD_SECONDS = 600
+
+
+def _record(db, **counts):
+    counts = {field: value for field, value in counts.items() if value}
+    if counts:
+        db[HOLD_STATS_COLLECTION].update_one(
+            {'_id': datetime.now().strftime('%Y-%m-%d')}, {'$inc': counts}, upsert=True
+        )
+
+
+def active_holds(db, ma_lich_trinh):
+    """Ghế đang được giữ (chưa hết hạn) của một chuyến: {maGhe: document}"""
+    holds = db[HOLD_COLLECTION].find({'maLichTrinh': ma_lich_trinh, 'hetHan': {'$gt': datetime.now()}})
+    return {hold['maGhe']: hold for hold in holds}
+
+
+def hold_seats(db, ma_lich_trinh, seats, owner, seconds=DEFAULT_HOLD_SECONDS):
+    """
+    Giữ (hoặc gia hạn) đúng tập ghế `seats` cho owner - tất cả hoặc không ghế nào.
+    Ghế owner đang giữ mà không còn trong `seats` được trả lại.
+    Trả về (hetHan, danh sách ghế đã có vé hoặc người khác đang giữ).
+    """
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=seconds)
+    holds = db[HOLD_COLLECTION]
+
+    # Ghế đã có vé: đọc bitmap trên lịch trình thay cho quét VeXe
+    from app.seats import prepare_trip
+    trip = prepare_trip(db, db.LichTrinh.find_one({'maLichTrinh': ma_lich_trinh}, OCCUPANCY_FIELDS))
+    ticketed = booked_seats(trip) & set(seats)
+    if ticketed:
+        _record(db, tuChoi=len(ticketed))
+        return expires_at, sorted(ticketed)
+
+    acquired, renewed, taken = [], 0, []
+    for seat in seats:
+        try:
+            # Chiếm ghế nếu chưa ai giữ, do chính owner giữ, hoặc giữ chỗ cũ đã hết hạn
+            before = holds.find_one_and_update(
+                {'maLichTrinh': ma_lich_trinh, 'maGhe': seat,
+                 '$or': [{'nguoiGiu': owner}, {'hetHan': {'$lte': now}}]},
+                {'$set': {'nguoiGiu': owner, 'hetHan': expires_at, 'ngayCapNhat': now}},
+                upsert=True, return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            taken.append(seat)  # Người khác đang giữ
+            continue
+        if before is not None and before.get('nguoiGiu') == owner:
+            renewed += 1
+        else:
+            acquired.append(seat)
+
+    if taken:
+        # Không giữ một phần: trả lại các ghế vừa chiếm trong lần gọi này
+        if acquired:
+            holds.delete_many({'maLichTrinh': ma_lich_trinh, 'maGhe': {'$in': acquired}, 'nguoiGiu': owner})
+        _record(db, tuChoi=len(taken))
+        return expires_at, taken
+
+    mark_seats(db, ma_lich_trinh, seats, HELD_BITS, trip=trip)
+    seat_events.held(ma_lich_trinh, seats, owner, expires_at)
+    released = _delete_holds(db, ma_lich_trinh, {'nguoiGiu': owner, 'maGhe': {'$nin': seats}})
+    _record(db, taoMoi=len(acquired), giaHan=renewed, huy=released)
+    if released:
+        _seats_freed(ma_lich_trinh)
+    return expires_at, []
+
+
+def _delete_holds(db, ma_lich_trinh, query):
+    """Xóa giữ chỗ khớp `query` và tắt bit các ghế tương ứng"""
+    query = {'maLichTrinh': ma_lich_trinh, **query}
+    seats = [hold['maGhe'] for hold in db[HOLD_COLLECTION].find(query, {'maGhe': 1})]
+    if not seats:
+        return 0
+    deleted = db[HOLD_COLLECTION].delete_many({**query, 'maGhe': {'$in': seats}}).deleted_count
+    mark_seats(db, ma_lich_trinh, seats, HELD_BITS, set_bits=False)
+    seat_events.held(ma_lich_trinh, seats)
+    return deleted
+
+
+def _seats_freed(ma_lich_trinh):
+    """Giữ chỗ được trả trước hạn: báo danh sách chờ (giữ chỗ hết hạn do lần quét định kỳ xử lý)"""
+    from app.waitlist import waitlist_worker
+    waitlist_worker.seats_freed(ma_lich_trinh)
+
+
+def release_holds(db, ma_lich_trinh, owner, seats=None):
+    query = {'nguoiGiu': owner}
+    if seats is not None:
+        query['maGhe'] = {'$in': seats}
+    released = _delete_holds(db, ma_lich_trinh, query)
+    _record(db, huy=released)
+    if released:
+        _seats_freed(ma_lich_trinh)
+    return released
+
+
+def convert_holds(db, ma_lich_trinh, seats, owner):
+    """Vé đã được ghi - xóa giữ chỗ tương ứng"""
+    converted = _delete_holds(db, ma_lich_trinh, {'nguoiGiu': owner, 'maGhe': {'$in': seats}})
+    _record(db, chuyenThanhVe=converted)
+    return converted
+
+
+def hold_churn(db, days=14):
+    """Thống kê giữ chỗ theo ngày và các giữ chỗ đang hiệu lực theo chuyến"""
+    since = (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    daily = []
+    for row in db[HOLD_STATS_COLLECTION].find({'_id': {'$gte': since}}).sort('_id', -1):
+        created = row.get('taoMoi', 0)
+        daily.append({
+            'ngay': row['_id'],
+            'taoMoi': created,
+            'giaHan': row.get('giaHan', 0),
+            'huy': row.get('huy', 0),
+            'tuChoi': row.get('tuChoi', 0),
+            'chuyenThanhVe': row.get('chuyenThanhVe', 0),
+            'tyLeChuyenDoi': round(row.get('chuyenThanhVe', 0) / created, 4) if created else 0
+        })
+
+    active = list(db[HOLD_COLLECTION].aggregate([
+        {'$match': {'hetHan': {'$gt': datetime.now()}}},
+        {'$group': {
+            '_id': '$maLichTrinh',
+            'soGhe': {'$sum': 1},
+            'soKhach': {'$addToSet': '$nguoiGiu'},
+            'hetHanSomNhat': {'$min': '$hetHan'}
+        }},
+        {'$addFields': {'soKhach': {'$size': '$soKhach'}}},
+        {'$sort': {'soGhe': -1}}
+    ]))
+    return {'daily': daily, 'active': active, 'active_seats': sum(row['soGhe'] for row in active)}
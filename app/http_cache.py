@@ -0,0 +1,141 @@
+"""
+Cache response HTTP cho trang công khai và API JSON chỉ đọc.
+
+    @user_bp.route('/news')
+    @response_cache.cached(ttl=300, depends=('TinTuc',))
+    def news(): ...
+
+Khóa cache: endpoint + tham số URL + query string đã chuẩn hóa (sắp xếp, bỏ
+giá trị rỗng) + người dùng trong session (base.html hiển thị tên người đăng
+nhập) + phiên bản của các collection trong `depends`. Admin ghi vào một
+collection gọi `response_cache.invalidate(collection_name)` để tăng phiên bản:
+các entry cũ không còn được tra tới và tự rơi khỏi LRU.
+
+Response trả kèm ETag (md5 nội dung, giống nhau giữa các worker),
+Last-Modified và Cache-Control; request có If-None-Match/If-Modified-Since
+khớp nhận 304. Phiên bản nằm trong từng process nên `ttl` là giới hạn độ cũ
+khi chạy nhiều worker, và cũng là độ cũ chấp nhận được cho số ghế trống.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, request, session
+
+
+class ResponseCache:
+    def __init__(self, ttl=60, maxsize=500):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.enabled = True
+        self._entries = OrderedDict()  # key -> entry
+        self._versions = {}  # collection -> phiên bản
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', self.ttl)
+        self.maxsize = app.config.get('RESPONSE_CACHE_SIZE', self.maxsize)
+        self.enabled = app.config.get('RESPONSE_CACHE_ENABLED', True)
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self, collection_name):
+        """Tăng phiên bản collection - mọi response phụ thuộc vào nó hết hiệu lực"""
+        with self._lock:
+            self._versions[collection_name] = self._versions.get(collection_name, 0) + 1
+
+    def _key(self, depends):
+        args = tuple(sorted((k, v) for k, v in request.args.items(multi=True) if v != ''))
+        view_args = tuple(sorted((request.view_args or {}).items()))
+        viewer = (session.get('role'), session.get('user_id') or session.get('customer_id'))
+        with self._lock:
+            versions = tuple(self._versions.get(name, 0) for name in depends)
+        return (request.endpoint, view_args, args, viewer, versions)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['expires_at'] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def cached(self, ttl=None, depends=()):
+        """Decorator cho view GET chỉ đọc"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # Trang có flash message đang chờ hiển thị thì không dùng cache
+                if not self.enabled or request.method != 'GET' or session.get('_flashes'):
+                    return view(*args, **kwargs)
+
+                key = self._key(depends)
+                entry = self._get(key)
+                if entry is None:
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.direct_passthrough:
+                        return response
+                    body = response.get_data()
+                    entry = {
+                        'body': body,
+                        'content_type': response.content_type,
+                        'etag': hashlib.md5(body).hexdigest(),
+                        'last_modified': datetime.now(timezone.utc).replace(microsecond=0),
+                        'ttl': ttl or self.ttl,
+                        'expires_at': time.monotonic() + (ttl or self.ttl)
+                    }
+                    self._put(key, entry)
+
+                response = current_app.response_class(entry['body'], content_type=entry['content_type'])
+                response.set_etag(entry['etag'])
+                response.last_modified = entry['last_modified']
+                response.cache_control.max_age = entry['ttl']
+                # Trang của người đã đăng nhập chỉ được cache ở trình duyệt
+                if key[3][1]:
+                    response.cache_control.private = True
+                else:
+                    response.cache_control.public = True
+                response.vary.add('Cookie')
+
+                response = response.make_conditional(request)
+                if response.status_code == 304:
+                    with self._lock:
+                        self.not_modified += 1
+                return response
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_rate': round(self.hits / total, 4) if total else 0,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'versions': dict(self._versions)
+            }
+
+
+response_cache = ResponseCache()
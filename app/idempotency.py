@@ -0,0 +1,133 @@
+"""
+Khóa idempotency cho các POST đặt vé.
+
+Client gửi khóa trong header `Idempotency-Key` hoặc trường form
+`idempotency_key` (trang đặt vé sinh sẵn một khóa mỗi lần mở). Lần đầu, view
+chạy bình thường và response (status, header Location, body, flash message)
+được lưu vào collection KhoaIdempotency. Gửi lại cùng khóa nhận ngay response
+đã lưu, không chạy lại view và không đụng tới VeXe.
+
+    @user_bp.route('/booking/confirm', methods=['POST'])
+    @idempotent('booking', on_pending=...)
+    def confirm_booking(): ...
+
+Khóa được tính theo (scope, người dùng, khóa). Cùng khóa nhưng nội dung request
+khác trả 422. Yêu cầu đang xử lý (lần gửi đầu chưa xong) trả `on_pending()`,
+mặc định 409; khóa đang xử lý quá IDEMPOTENCY_PENDING_SECONDS (process chết giữa
+chừng) được lần gửi sau nhận lại. Index TTL trên hetHan xóa khóa sau IDEMPOTENCY_TTL.
+View ném exception thì khóa bị xóa để client thử lại được.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, flash, jsonify, request, session
+from pymongo.errors import DuplicateKeyError
+
+from app import mongo
+
+IDEMPOTENCY_COLLECTION = 'KhoaIdempotency'
+PENDING = 'dangXuLy'
+DONE = 'xong'
+
+
+def _request_key():
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    return key.strip()[:200] if key and key.strip() else None
+
+
+def _fingerprint():
+    """Băm nội dung request (bỏ chính khóa) để phát hiện dùng lại khóa cho request khác"""
+    form = sorted((k, v) for k, v in request.form.items(multi=True) if k != 'idempotency_key')
+    body = request.get_json(silent=True)
+    payload = json.dumps([request.path, form, body], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+def _begin(collection, doc_id, fingerprint, pending_seconds):
+    """Giành khóa - trả về None nếu giành được, hoặc document đang có"""
+    now = datetime.now()
+    try:
+        collection.insert_one({
+            '_id': doc_id, 'trangThai': PENDING, 'vanTay': fingerprint,
+            'ngayTao': now, 'hetHan': now + timedelta(seconds=pending_seconds)
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    # Lần xử lý trước bỏ dở (quá hạn mà chưa xong): nhận lại khóa
+    taken_over = collection.find_one_and_update(
+        {'_id': doc_id, 'trangThai': PENDING, 'hetHan': {'$lte': now}},
+        {'$set': {'vanTay': fingerprint, 'ngayTao': now, 'hetHan': now + timedelta(seconds=pending_seconds)}}
+    )
+    if taken_over:
+        return None
+    return collection.find_one({'_id': doc_id}) or {'trangThai': PENDING}
+
+
+def _replay(stored):
+    for category, message in stored.get('flashes', []):
+        flash(message, category)
+    response = current_app.response_class(stored.get('body', b''), status=stored['status'],
+                                          content_type=stored.get('content_type'))
+    if stored.get('location'):
+        response.headers['Location'] = stored['location']
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _default_pending():
+    return jsonify({'status': 'error', 'message': 'Yêu cầu với khóa này đang được xử lý'}), 409
+
+
+def idempotent(scope, on_pending=None):
+    """Decorator cho view POST - chỉ áp dụng khi request có khóa idempotency"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = _request_key()
+            if not key:
+                return view(*args, **kwargs)
+
+            owner = session.get('customer_id') or session.get('user_id') or 'anonymous'
+            doc_id = f'{scope}:{owner}:{key}'
+            fingerprint = _fingerprint()
+            collection = mongo.db[IDEMPOTENCY_COLLECTION]
+            pending_seconds = current_app.config.get('IDEMPOTENCY_PENDING_SECONDS', 60)
+
+            existing = _begin(collection, doc_id, fingerprint, pending_seconds)
+            if existing is not None:
+                if existing.get('vanTay') not in (None, fingerprint):
+                    return jsonify({'status': 'error',
+                                    'message': 'Khóa idempotency đã dùng cho một yêu cầu khác'}), 422
+                if existing.get('trangThai') == DONE:
+                    return _replay(existing['ketQua'])
+                return (on_pending or _default_pending)()
+
+            flashes_before = len(session.get('_flashes', []))
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except Exception:
+                collection.delete_one({'_id': doc_id, 'trangThai': PENDING})
+                raise
+
+            if response.status_code >= 500 or response.direct_passthrough:
+                # Lỗi server: không lưu, cho phép gửi lại
+                collection.delete_one({'_id': doc_id, 'trangThai': PENDING})
+                return response
+            collection.update_one({'_id': doc_id}, {'$set': {
+                'trangThai': DONE,
+                'hetHan': datetime.now() + timedelta(seconds=current_app.config.get('IDEMPOTENCY_TTL', 86400)),
+                'ketQua': {
+                    'status': response.status_code,
+                    'content_type': response.content_type,
+                    'location': response.headers.get('Location'),
+                    'body': response.get_data(),
+                    'flashes': [list(item) for item in session.get('_flashes', [])[flashes_before:]]
+                }
+            }})
+            return response
+        return wrapper
+    return decorator
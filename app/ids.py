@@ -0,0 +1,91 @@
+"""
+Cấp mã (maVe, maDatVe, maLichTrinh, maKhach) từ collection bộ đếm BoDem.
+
+Mỗi dãy mã có một document {_id: tên dãy, giaTri: số lớn nhất đã cấp}. Mỗi
+process lấy cả một khối ID_BLOCK_SIZE số bằng một find_one_and_update $inc rồi
+cấp dần trong bộ nhớ, nên document bộ đếm chỉ bị ghi một lần cho mỗi khối thay
+vì mỗi mã. Mã giữ tiền tố cũ: VX000123, DV000045, LT0051, KH0007. Khối chưa
+dùng hết khi process dừng để lại khoảng trống trong dãy số - mã vẫn không trùng.
+
+Lần đầu dùng một dãy, bộ đếm được khởi tạo bằng số lớn nhất trong các mã đã có
+dạng <tiền tố><số> (ví dụ KH0042), để mã mới không trùng dữ liệu cũ.
+"""
+
+import re
+import threading
+
+from pymongo import ReturnDocument
+
+COUNTER_COLLECTION = 'BoDem'
+
+# Tên dãy -> (collection chứa mã, tiền tố, số chữ số tối thiểu)
+SEQUENCES = {
+    'maVe': ('VeXe', 'VX', 6),
+    'maDatVe': ('VeXe', 'DV', 6),
+    'maLichTrinh': ('LichTrinh', 'LT', 4),
+    'maKhach': ('KhachHang', 'KH', 4),
+}
+
+
+class IdAllocator:
+    def __init__(self, block_size=100):
+        self.block_size = block_size
+        self._blocks = {}  # tên dãy -> [số kế tiếp, số cuối của khối]
+        self._seeded = set()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.block_size = app.config.get('ID_BLOCK_SIZE', self.block_size)
+        with self._lock:
+            self._blocks.clear()
+
+    def _seed(self, db, sequence):
+        """Khởi tạo bộ đếm từ mã lớn nhất đang có (chỉ chạy khi chưa có document bộ đếm)"""
+        counters = db[COUNTER_COLLECTION]
+        if sequence in self._seeded or counters.find_one({'_id': sequence}, {'_id': 1}):
+            self._seeded.add(sequence)
+            return
+        collection_name, prefix, _ = SEQUENCES[sequence]
+        pattern = re.compile(rf'^{prefix}(\d+)$')
+        highest = 0
+        for doc in db[collection_name].find({sequence: {'$regex': f'^{prefix}[0-9]+$'}}, {sequence: 1}):
+            match = pattern.match(doc.get(sequence) or '')
+            if match:
+                highest = max(highest, int(match.group(1)))
+        # $max: nhiều process cùng khởi tạo vẫn cho cùng kết quả, không lùi bộ đếm
+        counters.update_one({'_id': sequence}, {'$max': {'giaTri': highest}}, upsert=True)
+        self._seeded.add(sequence)
+
+    def _reserve(self, db, sequence, count):
+        """Lấy `count` số liên tiếp từ bộ đếm - trả về số đầu tiên"""
+        self._seed(db, sequence)
+        counter = db[COUNTER_COLLECTION].find_one_and_update(
+            {'_id': sequence}, {'$inc': {'giaTri': count}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return counter['giaTri'] - count + 1
+
+    def next_numbers(self, db, sequence, count=1):
+        numbers = []
+        with self._lock:
+            block = self._blocks.get(sequence)
+            while len(numbers) < count:
+                if block is None or block[0] > block[1]:
+                    # Lô lớn hơn một khối thì lấy một lần đủ cho cả lô
+                    size = max(self.block_size, count - len(numbers))
+                    start = self._reserve(db, sequence, size)
+                    block = self._blocks[sequence] = [start, start + size - 1]
+                take = min(count - len(numbers), block[1] - block[0] + 1)
+                numbers.extend(range(block[0], block[0] + take))
+                block[0] += take
+        return numbers
+
+    def next_ids(self, db, sequence, count=1):
+        _, prefix, width = SEQUENCES[sequence]
+        return [f'{prefix}{number:0{width}d}' for number in self.next_numbers(db, sequence, count)]
+
+    def next_id(self, db, sequence):
+        return self.next_ids(db, sequence)[0]
+
+
+id_allocator = IdAllocator()
@@ -0,0 +1,226 @@
+"""
+Danh mục index MongoDB cho các collection truy vấn nhiều.
+
+Mỗi collection khai báo danh sách index (tên, khóa, tùy chọn). `ensure_indexes`
+được gọi khi khởi động app và có thể chạy lại nhiều lần mà không đổi gì. Lúc
+khởi động chỉ chờ mongod tối đa ENSURE_INDEXES_TIMEOUT_MS: không kết nối được
+thì in cảnh báo và chạy tiếp, không treo ~30 giây ở mỗi process / lệnh CLI.
+
+Kiểm tra index thiếu / không dùng trên database thật:
+    python -m app.indexes            # in báo cáo
+    python -m app.indexes --create   # tạo index còn thiếu rồi in báo cáo
+"""
+
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+INDEX_REGISTRY = {
+    'LichTrinh': [
+        # user.search, /api/available-dates: điểm đi/đến + khoảng ngày, lọc trạng thái
+        {'name': 'lt_route_date_status',
+         'keys': [('diemDi', ASCENDING), ('diemDen', ASCENDING), ('ngayDi', ASCENDING), ('tinhTrang', ASCENDING)]},
+        # Như trên, theo khóa không dấu diemDiKey/diemDenKey (app/normalize.py)
+        {'name': 'lt_routeKey_date_status',
+         'keys': [('diemDiKey', ASCENDING), ('diemDenKey', ASCENDING), ('ngayDi', ASCENDING), ('tinhTrang', ASCENDING)]},
+        # user.routes: mọi chuyến sắp chạy từ hôm nay, lọc trạng thái
+        {'name': 'lt_date_status', 'keys': [('ngayDi', ASCENDING), ('tinhTrang', ASCENDING)]},
+        # Phân trang keyset (app/pagination.py): sắp xếp (ngayDi, _id), hai chiều
+        {'name': 'lt_date_id', 'keys': [('ngayDi', ASCENDING), ('_id', ASCENDING)]},
+        # admin.trip_list: lọc trạng thái, sắp xếp ngày giảm dần + thống kê theo trạng thái
+        {'name': 'lt_status_date', 'keys': [('tinhTrang', ASCENDING), ('ngayDi', DESCENDING)]},
+        {'name': 'lt_maLichTrinh', 'keys': [('maLichTrinh', ASCENDING)], 'unique': True},
+        # admin.seat_map / get_seat_data: lịch trình theo xe
+        {'name': 'lt_maXe', 'keys': [('maXe', ASCENDING)]},
+    ],
+    'VeXe': [
+        # booking, get_seats_api, confirm_booking: vé theo chuyến + ghế
+        {'name': 've_trip_seat', 'keys': [('maLichTrinh', ASCENDING), ('maGhe', ASCENDING)]},
+        # Một vé còn hiệu lực cho mỗi ghế của chuyến (app/seats.py: giuGhe) - chống bán trùng
+        {'name': 've_trip_seat_claim',
+         'keys': [('maLichTrinh', ASCENDING), ('maGhe', ASCENDING), ('giuGhe', ASCENDING)],
+         'unique': True, 'partialFilterExpression': {'giuGhe': True}},
+        {'name': 've_maVe', 'keys': [('maVe', ASCENDING)]},
+        # my_tickets / trip_history (app/ticket_history.py): vé theo khách chuẩn (app/ticket_schema.py),
+        # phân trang (ngayDat, _id)
+        {'name': 've_khachHang_ngayDat',
+         'keys': [('khachHang', ASCENDING), ('ngayDat', DESCENDING), ('_id', DESCENDING)]},
+        # Dual-read trong lúc backfill: vé theo maKhach / maKhachHang cũ
+        {'name': 've_maKhach_ngayDat', 'keys': [('maKhach', ASCENDING), ('ngayDat', DESCENDING), ('_id', DESCENDING)]},
+        {'name': 've_maKhachHang_ngayDat',
+         'keys': [('maKhachHang', ASCENDING), ('ngayDat', DESCENDING), ('_id', DESCENDING)]},
+        {'name': 've_tinhTrang', 'keys': [('tinhTrang', ASCENDING)]},
+    ],
+    'GiuCho': [
+        # app/holds.py: một giữ chỗ cho mỗi ghế của chuyến, TTL xóa giữ chỗ hết hạn
+        {'name': 'gc_trip_seat', 'keys': [('maLichTrinh', ASCENDING), ('maGhe', ASCENDING)], 'unique': True},
+        {'name': 'gc_hetHan_ttl', 'keys': [('hetHan', ASCENDING)], 'expireAfterSeconds': 0},
+        {'name': 'gc_trip_owner', 'keys': [('maLichTrinh', ASCENDING), ('nguoiGiu', ASCENDING)]},
+    ],
+    'KhoaIdempotency': [
+        # app/idempotency.py: TTL xóa khóa (và response đã lưu) sau hetHan
+        {'name': 'kid_hetHan_ttl', 'keys': [('hetHan', ASCENDING)], 'expireAfterSeconds': 0},
+    ],
+    'DanhSachCho': [
+        # app/waitlist.py: người đứng đầu hàng của chuyến (sắp theo viTri)
+        {'name': 'dsc_trip_status_pos', 'keys': [('maLichTrinh', ASCENDING), ('trangThai', ASCENDING), ('viTri', ASCENDING)]},
+        # Mỗi khách chờ một chuyến tối đa một lượt
+        {'name': 'dsc_trip_owner_waiting', 'keys': [('maLichTrinh', ASCENDING), ('nguoiCho', ASCENDING)],
+         'unique': True, 'partialFilterExpression': {'trangThai': 'cho'}},
+        {'name': 'dsc_owner_status', 'keys': [('nguoiCho', ASCENDING), ('trangThai', ASCENDING)]},
+    ],
+    'Ghe': [
+        # create_seats_for_trip, booking, search: ghế theo chuyến
+        {'name': 'ghe_trip_seat', 'keys': [('maLichTrinh', ASCENDING), ('soGhe', ASCENDING)]},
+        {'name': 'ghe_maGhe', 'keys': [('maGhe', ASCENDING)]},
+    ],
+    'KhachHang': [
+        # auth_new.login / register: đăng nhập bằng email hoặc số điện thoại.
+        # Chỉ ràng buộc unique khi giá trị khác rỗng (khách tạo từ admin có thể để trống).
+        {'name': 'kh_email', 'keys': [('email', ASCENDING)], 'unique': True,
+         'partialFilterExpression': {'email': {'$gt': ''}}},
+        {'name': 'kh_dienThoai', 'keys': [('dienThoai', ASCENDING)], 'unique': True,
+         'partialFilterExpression': {'dienThoai': {'$gt': ''}}},
+        {'name': 'kh_maKhach', 'keys': [('maKhach', ASCENDING)]},
+    ],
+    'TaiKhoan': [
+        {'name': 'tk_ten', 'keys': [('ten', ASCENDING)]},
+    ],
+    'TuyenDuong': [
+        {'name': 'td_diemDau_diemCuoi', 'keys': [('diemDau', ASCENDING), ('diemCuoi', ASCENDING)]},
+        {'name': 'td_maTuyenDuong', 'keys': [('maTuyenDuong', ASCENDING)]},
+        {'name': 'td_diemDauKey_diemCuoiKey', 'keys': [('diemDauKey', ASCENDING), ('diemCuoiKey', ASCENDING)]},
+    ],
+    'DiaDiem': [
+        {'name': 'dd_tenDiaDiemKey', 'keys': [('tenDiaDiemKey', ASCENDING)]},
+    ],
+    'XeKhach': [
+        {'name': 'xk_maXeKhach', 'keys': [('maXeKhach', ASCENDING)]},
+    ],
+    'GiaVe': [
+        # booking(): giá theo tuyến + loại xe
+        {'name': 'gv_tuyen_loaiXe', 'keys': [('tuyen', ASCENDING), ('maLoaiXe', ASCENDING)]},
+        {'name': 'gv_maGiaVe', 'keys': [('maGiaVe', ASCENDING)]},
+        {'name': 'gv_maLoaiXe', 'keys': [('maLoaiXe', ASCENDING)]},
+    ],
+    'SoDoGhe': [
+        {'name': 'sdg_maLoaiXe', 'keys': [('maLoaiXe', ASCENDING)]},
+        {'name': 'sdg_maSoDo', 'keys': [('maSoDo', ASCENDING)]},
+    ],
+    'LoaiXe': [
+        {'name': 'lx_maLoaiXe', 'keys': [('maLoaiXe', ASCENDING)]},
+    ],
+    'LichKhoiHanh': [
+        # /api/available-dates: một range read theo cặp điểm + ngày (app/departures.py)
+        {'name': 'lkh_route_day', 'keys': [('diemDiKey', ASCENDING), ('diemDenKey', ASCENDING), ('ngay', ASCENDING)],
+         'unique': True},
+    ],
+    'TinTuc': [
+        {'name': 'tt_ngayDang', 'keys': [('ngayDang', DESCENDING)]},
+    ],
+    # Kho lưu trữ chuyến đã kết thúc (app/archive.py)
+    'LichTrinhLuuTru': [
+        # admin.trip_list khi lọc ngày cũ: $unionWith cùng điều kiện + sắp xếp (ngayDi, _id)
+        {'name': 'ltlt_date_id', 'keys': [('ngayDi', ASCENDING), ('_id', ASCENDING)]},
+        {'name': 'ltlt_maLichTrinh', 'keys': [('maLichTrinh', ASCENDING)]},
+    ],
+    'VeXeLuuTru': [
+        # trip_history: vé theo khách, cùng khóa phân trang với VeXe
+        {'name': 'velt_khachHang_ngayDat',
+         'keys': [('khachHang', ASCENDING), ('ngayDat', DESCENDING), ('_id', DESCENDING)]},
+        {'name': 'velt_maKhach_ngayDat', 'keys': [('maKhach', ASCENDING), ('ngayDat', DESCENDING), ('_id', DESCENDING)]},
+        {'name': 'velt_maKhachHang_ngayDat',
+         'keys': [('maKhachHang', ASCENDING), ('ngayDat', DESCENDING), ('_id', DESCENDING)]},
+        {'name': 'velt_maLichTrinh', 'keys': [('maLichTrinh', ASCENDING)]},
+    ],
+    'GheLuuTru': [
+        {'name': 'ghelt_maGhe', 'keys': [('maGhe', ASCENDING)]},
+    ],
+    'TongKetChuyen': [
+        {'name': 'tkc_maLichTrinh', 'keys': [('maLichTrinh', ASCENDING)], 'unique': True},
+        {'name': 'tkc_tinhTrang', 'keys': [('tinhTrang', ASCENDING)]},
+    ],
+}
+
+
+def _index_options(spec):
+    """Tách tùy chọn create_index từ khai báo (bỏ 'keys')"""
+    return {k: v for k, v in spec.items() if k != 'keys'}
+
+
+def ensure_indexes(db, registry=None):
+    """Tạo các index đã khai báo - idempotent, lỗi từng index không chặn các index khác"""
+    registry = registry or INDEX_REGISTRY
+    created = 0
+    for collection_name, specs in registry.items():
+        for spec in specs:
+            try:
+                db[collection_name].create_index(spec['keys'], **_index_options(spec))
+                created += 1
+            except OperationFailure as e:
+                # VD: trùng dữ liệu với index unique, hoặc index cùng khóa khác tên/tùy chọn
+                print(f"Index {collection_name}.{spec['name']} not created: {e}")
+            except PyMongoError as e:
+                print(f"Error ensuring indexes for {collection_name}: {e}")
+                return created
+    return created
+
+
+def ensure_indexes_at_startup(app):
+    """ensure_indexes qua một client riêng có thời gian chờ chọn server ngắn"""
+    client = MongoClient(app.config['MONGO_URI'],
+                         serverSelectionTimeoutMS=app.config.get('ENSURE_INDEXES_TIMEOUT_MS', 2000))
+    try:
+        return ensure_indexes(client.get_default_database())
+    finally:
+        client.close()
+
+
+def index_report(db, registry=None):
+    """So sánh index khai báo với index thực tế: thiếu, không khai báo, không được dùng"""
+    registry = registry or INDEX_REGISTRY
+    report = {}
+    for collection_name, specs in registry.items():
+        existing = db[collection_name].index_information()
+        declared = {spec['name'] for spec in specs}
+
+        # $indexStats: số lần index được dùng kể từ lần khởi động mongod
+        usage = {}
+        try:
+            for stat in db[collection_name].aggregate([{'$indexStats': {}}]):
+                usage[stat['name']] = stat.get('accesses', {}).get('ops', 0)
+        except OperationFailure:
+            pass
+
+        report[collection_name] = {
+            'missing': sorted(declared - set(existing)),
+            'undeclared': sorted(name for name in existing if name != '_id_' and name not in declared),
+            'unused': sorted(name for name, ops in usage.items() if ops == 0 and name != '_id_'),
+        }
+    return report
+
+
+def print_index_report(report):
+    for collection_name, info in report.items():
+        if not any(info.values()):
+            print(f"✅ {collection_name}: OK")
+            continue
+        print(f"⚠️ {collection_name}:")
+        for label, key in [('Thiếu', 'missing'), ('Không khai báo', 'undeclared'), ('Không dùng', 'unused')]:
+            if info[key]:
+                print(f"   - {label}: {', '.join(info[key])}")
+
+
+if __name__ == '__main__':
+    import sys
+    from app import create_app, mongo
+    from config import Config
+
+    class ReportConfig(Config):
+        # Không tự tạo index khi khởi động để báo cáo đúng index còn thiếu
+        ENSURE_INDEXES = False
+
+    app = create_app(ReportConfig)
+    with app.app_context():
+        if '--create' in sys.argv:
+            print(f"Ensured {ensure_indexes(mongo.db)} indexes")
+        print_index_report(index_report(mongo.db))
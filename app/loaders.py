@@ -0,0 +1,119 @@
+"""
+Loader gom khóa theo request (kiểu DataLoader) thay cho find_one trong vòng lặp.
+
+    customers = ticket_customers(tickets)        # một $in cho mỗi loại khóa
+    for ticket in tickets:
+        customer = customers.get(ticket)
+
+    trips = loader('LichTrinh', 'maLichTrinh')
+    trips.prime(t.get('maLichTrinh') for t in tickets)
+    trips.load(ticket.get('maLichTrinh'))        # lần load đầu gửi một $in cho mọi khóa đã prime
+
+Mỗi (collection, trường, projection) có một loader sống trong `flask.g`, nên cùng một khóa
+chỉ được truy vấn một lần trong request và không dùng lại dữ liệu giữa các request.
+"""
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import g
+
+from app import mongo
+from app.ticket_schema import OWNER_FIELD
+
+
+class BatchLoader:
+    def __init__(self, fetch):
+        self._fetch = fetch  # fetch(list khóa) -> {khóa: document}
+        self._cache = {}
+        self._pending = set()
+        self.queries = 0
+
+    def prime(self, keys):
+        """Ghi nhận khóa sẽ cần - chưa truy vấn"""
+        self._pending.update(key for key in keys if key is not None and key not in self._cache)
+
+    def _dispatch(self):
+        if not self._pending:
+            return
+        keys = list(self._pending)
+        self._pending.clear()
+        found = self._fetch(keys)
+        self.queries += 1
+        for key in keys:
+            self._cache[key] = found.get(key)
+
+    def load(self, key):
+        if key is None:
+            return None
+        if key not in self._cache:
+            self._pending.add(key)
+            self._dispatch()
+        return self._cache.get(key)
+
+    def load_many(self, keys):
+        keys = list(keys)
+        self.prime(keys)
+        self._dispatch()
+        return {key: self._cache.get(key) for key in keys if key is not None}
+
+
+def _projection_key(projection):
+    """Dạng hashable của projection (dict hoặc list tên trường)"""
+    if not projection:
+        return ()
+    if isinstance(projection, dict):
+        return tuple(sorted((key, repr(value)) for key, value in projection.items()))
+    return tuple(sorted(projection))
+
+
+def loader(collection_name, field, projection=None):
+    """Loader theo request: document đầu tiên của `collection_name` có `field` = khóa"""
+    loaders = g.setdefault('_batch_loaders', {})
+    # Projection là một phần của khóa: loader chọn ít trường không trả document thiếu trường cho loader khác
+    name = (collection_name, field, _projection_key(projection))
+    if name not in loaders:
+        def fetch(keys):
+            docs = {}
+            for doc in mongo.db[collection_name].find({field: {'$in': keys}}, projection):
+                docs.setdefault(doc.get(field), doc)
+            return docs
+        loaders[name] = BatchLoader(fetch)
+    return loaders[name]
+
+
+def _object_id(value):
+    if isinstance(value, ObjectId):
+        return value
+    try:
+        return ObjectId(str(value))
+    except (InvalidId, TypeError):
+        return None
+
+
+class TicketCustomers:
+    """
+    Khách hàng của vé: khachHang (schema chuẩn, app/ticket_schema.py), vé chưa
+    backfill theo maKhach (mã KH) hoặc maKhachHang (_id)
+    """
+
+    def __init__(self, tickets):
+        self._by_code = loader('KhachHang', 'maKhach')
+        self._by_id = loader('KhachHang', '_id')
+        self._by_id.prime(_object_id(ticket[OWNER_FIELD]) for ticket in tickets if ticket.get(OWNER_FIELD))
+        self._by_code.prime(ticket.get('maKhach') for ticket in tickets
+                            if not ticket.get(OWNER_FIELD) and ticket.get('maKhach'))
+        self._by_id.prime(_object_id(ticket.get('maKhachHang')) for ticket in tickets
+                          if not ticket.get(OWNER_FIELD) and not ticket.get('maKhach') and ticket.get('maKhachHang'))
+
+    def get(self, ticket):
+        if ticket.get(OWNER_FIELD):
+            return self._by_id.load(_object_id(ticket[OWNER_FIELD]))
+        if ticket.get('maKhach'):
+            return self._by_code.load(ticket['maKhach'])
+        if ticket.get('maKhachHang'):
+            return self._by_id.load(_object_id(ticket['maKhachHang']))
+        return None
+
+
+def ticket_customers(tickets):
+    return TicketCustomers(list(tickets))
@@ -0,0 +1,128 @@
+"""
+Migration dữ liệu chạy theo lô, dừng giữa chừng rồi chạy tiếp được.
+
+Mỗi migration duyệt các document cần sửa của một collection theo thứ tự _id,
+mỗi lô một bulk_write. Sau mỗi lô, _id cuối cùng được ghi vào collection
+DiChuyenDuLieu ({_id: tên migration, viTriCuoi, soDaCapNhat, trangThai}), nên
+chạy lại (sau khi bị ngắt, hoặc chia nhỏ bằng --max-batches) sẽ tiếp tục từ lô
+kế tiếp thay vì quét lại từ đầu. Điều kiện `query` chỉ chọn document chưa được
+sửa nên chạy lại từ đầu (--restart) cũng không ghi trùng.
+
+    python -m app.migrations                           # trạng thái các migration
+    python -m app.migrations ve_xe_schema_chuan        # chạy (hoặc chạy tiếp)
+    python -m app.migrations ve_xe_schema_chuan --batch-size 1000 --max-batches 10
+    python -m app.migrations ve_xe_schema_chuan --restart
+"""
+
+import argparse
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from app.ticket_schema import OWNER_FIELD, STATUS_FIELD, canonical_fields, resolve_owners
+
+MIGRATION_COLLECTION = 'DiChuyenDuLieu'
+RUNNING = 'dangChay'
+DONE = 'xong'
+
+
+class Migration(ABC):
+    """
+    name, collection, description; query: điều kiện chọn document cần sửa;
+    projection: trường cần đọc. transform(db, docs) -> [(_id, $set)] cho cả lô.
+    """
+
+    name = None
+    collection = None
+    description = ''
+    query = {}
+    projection = None
+
+    @abstractmethod
+    def transform(self, db, docs):
+        """[(_id, $set)] cho các document của lô"""
+
+
+class TicketSchemaMigration(Migration):
+    name = 've_xe_schema_chuan'
+    collection = 'VeXe'
+    description = 'Ghi khachHang / trangThaiVe cho vé theo schema cũ (app/ticket_schema.py)'
+    query = {'$or': [{OWNER_FIELD: {'$exists': False}}, {STATUS_FIELD: {'$exists': False}}]}
+    projection = {'maKhach': 1, 'maKhachHang': 1, 'tinhTrang': 1, 'trangThai': 1}
+
+    def transform(self, db, docs):
+        owners = resolve_owners(db, docs)
+        return [(doc['_id'], canonical_fields(doc, owners)) for doc in docs]
+
+
+MIGRATIONS = {migration.name: migration for migration in (TicketSchemaMigration(),)}
+
+
+def state(db, name):
+    return db[MIGRATION_COLLECTION].find_one({'_id': name}) or {'_id': name}
+
+
+def run(db, name, batch_size=500, max_batches=None, restart=False, progress=None):
+    """Chạy (tiếp) migration `name` - trả về document trạng thái sau khi dừng"""
+    migration = MIGRATIONS[name]
+    states = db[MIGRATION_COLLECTION]
+    if restart:
+        states.delete_one({'_id': name})
+    current = state(db, name)
+    if current.get('trangThai') == DONE and not restart:
+        return current
+    states.update_one({'_id': name}, {
+        '$set': {'trangThai': RUNNING, 'ngayCapNhat': datetime.now()},
+        '$setOnInsert': {'soDaCapNhat': 0, 'ngayBatDau': datetime.now()}
+    }, upsert=True)
+
+    last_id = current.get('viTriCuoi')
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        query = migration.query
+        if last_id is not None:
+            query = {'$and': [query, {'_id': {'$gt': last_id}}]}
+        docs = list(db[migration.collection].find(query, migration.projection).sort('_id', 1).limit(batch_size))
+        if not docs:
+            states.update_one({'_id': name}, {'$set': {'trangThai': DONE, 'ngayXong': datetime.now(),
+                                                      'ngayCapNhat': datetime.now()}})
+            break
+        updates = [UpdateOne({'_id': doc_id}, {'$set': fields}) for doc_id, fields in migration.transform(db, docs)]
+        modified = db[migration.collection].bulk_write(updates, ordered=False).modified_count if updates else 0
+        last_id = docs[-1]['_id']
+        # Ghi mốc sau mỗi lô: bị ngắt thì lần chạy sau bắt đầu từ lô kế tiếp
+        states.update_one({'_id': name}, {'$set': {'viTriCuoi': last_id, 'ngayCapNhat': datetime.now()},
+                                          '$inc': {'soDaCapNhat': modified, 'soLo': 1}})
+        batches += 1
+        if progress:
+            progress(batches, modified)
+    return state(db, name)
+
+
+def is_done(db, name):
+    return state(db, name).get('trangThai') == DONE
+
+
+if __name__ == '__main__':
+    from app import create_app, mongo
+
+    parser = argparse.ArgumentParser(description='Run resumable batched data migrations')
+    parser.add_argument('name', nargs='?', choices=sorted(MIGRATIONS))
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--max-batches', type=int)
+    parser.add_argument('--restart', action='store_true', help='bỏ mốc đã lưu, quét lại từ đầu')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.name:
+            result = run(mongo.db, args.name, args.batch_size, args.max_batches, args.restart,
+                         progress=lambda batch, modified: print(f"batch {batch}: updated {modified}"))
+            print(f"{args.name}: {result.get('trangThai')} - updated {result.get('soDaCapNhat', 0)} documents")
+        else:
+            for name, migration in MIGRATIONS.items():
+                current = state(mongo.db, name)
+                remaining = mongo.db[migration.collection].count_documents(migration.query)
+                print(f"{name} ({migration.collection}): {current.get('trangThai', 'chưa chạy')}, "
+                      f"{remaining} documents remaining - {migration.description}")
@@ -0,0 +1,101 @@
+"""
+Chuẩn hóa tên địa điểm tiếng Việt để tìm kiếm bằng index.
+
+`fold_text` bỏ dấu (bảng translate dựng sẵn), chuyển chữ thường và gom ký tự
+không phải chữ/số thành một khoảng trắng: "TP. Hồ Chí Minh" -> "tp ho chi minh".
+
+Các khóa đã chuẩn hóa được lưu cạnh trường gốc (PLACE_KEY_FIELDS) và được đánh
+index, nên tìm kiếm dùng so khớp chính xác hoặc tiền tố có neo (^) thay cho
+$regex không neo, không phân biệt hoa thường.
+
+Backfill cho dữ liệu có sẵn:
+    python -m app.normalize
+"""
+
+import re
+
+from pymongo import UpdateOne
+
+_VIETNAMESE_BASE = {
+    'a': 'àáạảãâầấậẩẫăằắặẳẵ',
+    'e': 'èéẹẻẽêềếệểễ',
+    'i': 'ìíịỉĩ',
+    'o': 'òóọỏõôồốộổỗơờớợởỡ',
+    'u': 'ùúụủũưừứựửữ',
+    'y': 'ỳýỵỷỹ',
+    'd': 'đ',
+}
+
+# Ký tự có dấu (dạng dựng sẵn, cả chữ hoa) -> ký tự gốc; dấu kết hợp (U+0300..U+036F) bị xóa
+VIETNAMESE_FOLD_TABLE = {}
+for _base, _chars in _VIETNAMESE_BASE.items():
+    for _char in _chars:
+        VIETNAMESE_FOLD_TABLE[ord(_char)] = _base
+        VIETNAMESE_FOLD_TABLE[ord(_char.upper())] = _base.upper()
+VIETNAMESE_FOLD_TABLE.update({code: None for code in range(0x300, 0x370)})
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+# Trường gốc -> trường khóa đã chuẩn hóa, theo collection
+PLACE_KEY_FIELDS = {
+    'TuyenDuong': {'diemDau': 'diemDauKey', 'diemCuoi': 'diemCuoiKey', 'tenTuyenDuong': 'tenTuyenDuongKey'},
+    'LichTrinh': {'diemDi': 'diemDiKey', 'diemDen': 'diemDenKey'},
+    'DiaDiem': {'tenDiaDiem': 'tenDiaDiemKey'},
+}
+
+
+def fold_text(text):
+    """Bỏ dấu tiếng Việt, chữ thường, chỉ giữ chữ/số cách nhau một khoảng trắng"""
+    if not text:
+        return ''
+    folded = str(text).translate(VIETNAMESE_FOLD_TABLE).lower()
+    return _NON_ALNUM.sub(' ', folded).strip()
+
+
+def prefix_match(text):
+    """Điều kiện tiền tố có neo trên khóa đã chuẩn hóa (dùng được index)"""
+    folded = fold_text(text)
+    if not folded:
+        # Chuỗi rỗng sau chuẩn hóa: không cho khớp mọi document
+        return {'$in': []}
+    return {'$regex': '^' + re.escape(folded)}
+
+
+def place_keys(collection_name, data):
+    """Các khóa chuẩn hóa cần $set cùng dữ liệu ghi vào collection"""
+    keys = {}
+    for field, key_field in PLACE_KEY_FIELDS.get(collection_name, {}).items():
+        if field in data:
+            keys[key_field] = fold_text(data.get(field))
+    return keys
+
+
+def backfill_place_keys(db, batch_size=500):
+    """Ghi khóa chuẩn hóa cho toàn bộ document có sẵn, theo lô"""
+    updated = {}
+    for collection_name, fields in PLACE_KEY_FIELDS.items():
+        projection = {field: 1 for field in fields}
+        projection.update({key_field: 1 for key_field in fields.values()})
+
+        batch = []
+        count = 0
+        for doc in db[collection_name].find({}, projection):
+            keys = place_keys(collection_name, doc)
+            if any(doc.get(key_field) != value for key_field, value in keys.items()):
+                batch.append(UpdateOne({'_id': doc['_id']}, {'$set': keys}))
+            if len(batch) >= batch_size:
+                count += db[collection_name].bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            count += db[collection_name].bulk_write(batch, ordered=False).modified_count
+        updated[collection_name] = count
+    return updated
+
+
+if __name__ == '__main__':
+    from app import create_app, mongo
+
+    app = create_app()
+    with app.app_context():
+        for collection_name, count in backfill_place_keys(mongo.db).items():
+            print(f"{collection_name}: updated {count} documents")
@@ -0,0 +1,127 @@
+"""
+Bitmap ghế theo chuyến, lưu trực tiếp trên LichTrinh.
+
+    viTriGhe       - danh sách mã ghế; vị trí trong danh sách là số thứ tự bit
+                     (chỉ thêm vào cuối bằng $addToSet nên vị trí không đổi)
+    bitGheDaDat    - ghế có vé còn hiệu lực: {'0': word, '1': word, ...}
+    bitGheDangGiu  - ghế đang có giữ chỗ (app/holds.py)
+    bitmapSanSang  - True khi bitmap đã tính cả vé có từ trước (app/seats.py: prepare_trip)
+
+Mỗi word giữ WORD_BITS ghế và được cập nhật bằng $bit (or / and) nên đặt vé,
+hủy vé, giữ chỗ không cần đọc lại Ghe / VeXe. Sơ đồ ghế và kiểm tra ghế trống
+chỉ cần đọc document lịch trình.
+
+bitGheDangGiu chỉ là gợi ý: TTL của GiuCho xóa giữ chỗ hết hạn mà không xóa bit,
+nên khi có bit bật vẫn phải đọc GiuCho (active_holds); bitmap rỗng nghĩa là
+không cần truy vấn GiuCho.
+
+Dựng lại bitmap từ VeXe (backfill / sửa sai lệch):
+    python -m app.seats
+"""
+
+POSITIONS_FIELD = 'viTriGhe'
+BOOKED_BITS = 'bitGheDaDat'
+HELD_BITS = 'bitGheDangGiu'
+BITMAP_READY = 'bitmapSanSang'
+WORD_BITS = 32
+WORD_MASK = (1 << WORD_BITS) - 1
+
+# Projection đủ để giải mã bitmap
+OCCUPANCY_FIELDS = {'maLichTrinh': 1, POSITIONS_FIELD: 1, BOOKED_BITS: 1, HELD_BITS: 1, BITMAP_READY: 1}
+
+
+def bitmap_ready(trip):
+    """False với lịch trình có từ trước bitmap: vé cũ chưa có bit, chưa tin được bitGheDaDat"""
+    return bool((trip or {}).get(BITMAP_READY))
+
+
+def register_seats(db, ma_lich_trinh, seats):
+    """Cấp vị trí bit cho các ghế chưa có (giữ nguyên vị trí ghế cũ)"""
+    if ma_lich_trinh and seats:
+        db.LichTrinh.update_one(
+            {'maLichTrinh': ma_lich_trinh},
+            {'$addToSet': {POSITIONS_FIELD: {'$each': list(seats)}}}
+        )
+
+
+def seat_positions(db, ma_lich_trinh, seats, trip=None):
+    """{maGhe: vị trí bit} cho `seats`, cấp vị trí mới nếu cần"""
+    if trip is None or POSITIONS_FIELD not in trip:
+        trip = db.LichTrinh.find_one({'maLichTrinh': ma_lich_trinh}, {POSITIONS_FIELD: 1}) or {}
+    positions = trip.get(POSITIONS_FIELD) or []
+    if any(seat not in positions for seat in seats):
+        register_seats(db, ma_lich_trinh, seats)
+        trip = db.LichTrinh.find_one({'maLichTrinh': ma_lich_trinh}, {POSITIONS_FIELD: 1}) or {}
+        positions = trip.get(POSITIONS_FIELD) or []
+    index = {seat: i for i, seat in enumerate(positions)}
+    return {seat: index[seat] for seat in seats if seat in index}
+
+
+def _masks(positions):
+    masks = {}
+    for position in positions:
+        word, bit = divmod(position, WORD_BITS)
+        masks[str(word)] = masks.get(str(word), 0) | (1 << bit)
+    return masks
+
+
+def bit_update(field, positions, set_bits=True):
+    """Toán tử $bit bật (set_bits) hoặc tắt các bit `positions` của `field`"""
+    if set_bits:
+        ops = {f'{field}.{word}': {'or': mask} for word, mask in _masks(positions).items()}
+    else:
+        ops = {f'{field}.{word}': {'and': WORD_MASK & ~mask} for word, mask in _masks(positions).items()}
+    return {'$bit': ops} if ops else {}
+
+
+def to_words(positions):
+    """Bitmap đầy đủ (dùng cho $set khi dựng lại)"""
+    return _masks(positions)
+
+
+def seats_in(trip, field):
+    """Tập mã ghế có bit bật trong `field` của lịch trình"""
+    words = (trip or {}).get(field) or {}
+    positions = (trip or {}).get(POSITIONS_FIELD) or []
+    seats = set()
+    for word, value in words.items():
+        value = int(value or 0)
+        base = int(word) * WORD_BITS
+        while value:
+            low = value & -value
+            position = base + low.bit_length() - 1
+            if position < len(positions):
+                seats.add(positions[position])
+            value ^= low
+    return seats
+
+
+def invalid_seats(trip, seats):
+    """Ghế không có trong sơ đồ của chuyến (chuyến chưa có sơ đồ: không kiểm tra được)"""
+    positions = (trip or {}).get(POSITIONS_FIELD)
+    if not positions:
+        return []
+    return [seat for seat in seats if seat not in positions]
+
+
+def booked_seats(trip):
+    return seats_in(trip, BOOKED_BITS)
+
+
+def booked_count(trip):
+    return sum(bin(int(value or 0)).count('1') for value in ((trip or {}).get(BOOKED_BITS) or {}).values())
+
+
+def may_have_holds(trip):
+    """False khi chắc chắn không có giữ chỗ - bỏ qua truy vấn GiuCho"""
+    return any(int(value or 0) for value in ((trip or {}).get(HELD_BITS) or {}).values())
+
+
+def mark_seats(db, ma_lich_trinh, seats, field, set_bits=True, trip=None):
+    """Bật / tắt bit của các ghế bằng một update $bit"""
+    if not ma_lich_trinh or not seats:
+        return
+    positions = seat_positions(db, ma_lich_trinh, seats, trip).values()
+    update = bit_update(field, positions, set_bits)
+    if update:
+        db.LichTrinh.update_one({'maLichTrinh': ma_lich_trinh}, update)
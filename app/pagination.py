@@ -0,0 +1,91 @@
+"""
+Phân trang keyset (cursor) thay cho skip/limit.
+
+Trang sau được lấy bằng điều kiện "lớn hơn khóa cuối của trang trước" trên
+các trường sắp xếp, nên mỗi trang là một range scan trên index dù đang ở
+trang thứ mấy. Token gửi cho client là khóa cuối đã mã hóa (base64 của
+Extended JSON), client chỉ việc gửi lại nguyên vẹn qua tham số `cursor`.
+
+    page = find_page(mongo.db.LichTrinh, query, TRIP_PAGE_KEYS, request.args.get('cursor'))
+    page['items'], page['next_cursor'], page['has_more']
+
+Các trường khóa nên cùng kiểu BSON trong mọi document của truy vấn (VD:
+ngayDi là datetime) và trường cuối phải duy nhất (_id).
+"""
+
+import base64
+import binascii
+
+from bson import json_util
+
+# Khóa phân trang lịch trình: ngày đi tăng dần, _id để phân định cùng ngày
+TRIP_PAGE_KEYS = (('ngayDi', 1), ('_id', 1))
+# Danh sách admin: chuyến mới nhất trước
+TRIP_PAGE_KEYS_DESC = (('ngayDi', -1), ('_id', -1))
+# Collection bất kỳ: theo thứ tự thêm vào
+ID_PAGE_KEYS = (('_id', 1),)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token, keys):
+    """Giá trị khóa trong token; None nếu không có hoặc token không hợp lệ"""
+    if not token:
+        return None
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != len(keys):
+        return None
+    # Không nhận dict/list: tránh chèn toán tử ($ne, $gt...) vào truy vấn
+    if any(isinstance(value, (dict, list)) for value in values):
+        return None
+    return values
+
+
+def sort_spec(keys):
+    return {field: direction for field, direction in keys}
+
+
+def after_filter(keys, values):
+    """Điều kiện "đứng sau" bộ khóa values theo thứ tự sắp xếp keys"""
+    branches = []
+    for i, (field, direction) in enumerate(keys):
+        branch = {prev_field: values[j] for j, (prev_field, _) in enumerate(keys[:i])}
+        branch[field] = {'$gt' if direction > 0 else '$lt': values[i]}
+        branches.append(branch)
+    return branches[0] if len(branches) == 1 else {'$or': branches}
+
+
+def _key_values(doc, keys):
+    return [doc.get(field) for field, _ in keys]
+
+
+def paginate(fetch, query, keys, cursor=None, per_page=20):
+    """
+    fetch(query, sort, limit) -> list: hàm chạy truy vấn (find hoặc aggregate).
+    Lấy per_page + 1 document để biết còn trang sau hay không.
+    """
+    values = decode_cursor(cursor, keys)
+    if values is not None:
+        query = {'$and': [query, after_filter(keys, values)]} if query else after_filter(keys, values)
+
+    items = fetch(query, sort_spec(keys), per_page + 1)
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    return {
+        'items': items,
+        'has_more': has_more,
+        'next_cursor': encode_cursor(_key_values(items[-1], keys)) if has_more else None,
+        'cursor': cursor if values is not None else None
+    }
+
+
+def find_page(collection, query, keys, cursor=None, per_page=20, projection=None):
+    """paginate cho find() trên một collection"""
+    def fetch(page_query, sort, limit):
+        return list(collection.find(page_query, projection).sort(list(sort.items())).limit(limit))
+    return paginate(fetch, query, keys, cursor, per_page)
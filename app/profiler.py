@@ -0,0 +1,232 @@
+"""
+Đo lệnh MongoDB theo request và phát hiện mẫu N+1.
+
+`db_profiler` là một pymongo CommandListener đăng ký trước khi tạo MongoClient
+(create_app gọi init_app trước mongo.init_app). Lệnh chạy trong lúc xử lý một
+request được ghi vào bản ghi của request đó (thread-local - pymongo gọi
+listener trên chính thread gửi lệnh): số lệnh, tổng thời gian và "dạng" truy
+vấn - tên lệnh + collection + cấu trúc điều kiện với giá trị thay bằng "?":
+
+    find VeXe {"maLichTrinh": "?"}
+    aggregate LichTrinh ["$match", "$group"] {"tinhTrang": "?"}
+
+Cùng một dạng đọc lặp từ DB_PROFILER_N_PLUS_ONE lần trở lên trong một request
+(find_one trong vòng lặp) bị đánh dấu N+1 và in ra log. Response có header
+Server-Timing (db, app) để xem trong DevTools. Thống kê cuộn theo endpoint
+(DB_PROFILER_WINDOW request gần nhất) ở /admin/api/perf.
+
+Đếm lệnh của một đoạn code ngoài request (test, script) bằng `track()`:
+
+    with db_profiler.track() as record:
+        search_trips(db, query)
+    record.commands, record.shapes
+"""
+
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+from flask import request
+from pymongo import monitoring
+
+# Lệnh đọc - lặp nhiều lần cùng dạng là dấu hiệu N+1
+READ_COMMANDS = {'find', 'aggregate', 'count', 'distinct', 'findAndModify'}
+# Lệnh ghi: điều kiện nằm trong danh sách con
+WRITE_FILTERS = {'update': ('updates', 'q'), 'delete': ('deletes', 'q')}
+IGNORED_COMMANDS = {'hello', 'isMaster', 'ismaster', 'ping', 'endSessions', 'saslStart', 'saslContinue',
+                    'buildInfo', 'getLastError', 'killCursors'}
+
+
+def _shape(value):
+    """Cấu trúc điều kiện: giữ tên trường / toán tử, thay giá trị bằng '?'"""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            if isinstance(item, dict):
+                shape = _shape(item)
+                if shape not in shapes:
+                    shapes.append(shape)
+        return shapes or '?'
+    return '?'
+
+
+def query_shape(command_name, command):
+    """Dạng truy vấn của một lệnh: 'tên collection {điều kiện}'"""
+    if command_name == 'getMore':
+        return f"getMore {command.get('collection')}"
+    collection = command.get(command_name)
+    if command_name == 'find':
+        detail = json.dumps(_shape(command.get('filter', {})), sort_keys=True)
+    elif command_name == 'aggregate':
+        stages = [next(iter(stage), '?') for stage in command.get('pipeline', [])]
+        match = next((stage['$match'] for stage in command.get('pipeline', []) if '$match' in stage), {})
+        detail = f"{json.dumps(stages)} {json.dumps(_shape(match), sort_keys=True)}"
+    elif command_name in WRITE_FILTERS:
+        items_field, filter_field = WRITE_FILTERS[command_name]
+        items = command.get(items_field) or [{}]
+        detail = json.dumps(_shape(items[0].get(filter_field, {})), sort_keys=True)
+    elif command_name in ('count', 'findAndModify'):
+        detail = json.dumps(_shape(command.get('query', {})), sort_keys=True)
+    elif command_name == 'distinct':
+        detail = f"{command.get('key')} {json.dumps(_shape(command.get('query', {})), sort_keys=True)}"
+    else:
+        detail = ''
+    return f"{command_name} {collection} {detail}".rstrip()
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+class RequestRecord:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.commands = 0
+        self.db_micros = 0
+        self.shapes = Counter()
+        self._pending = {}  # request_id -> dạng truy vấn
+
+    def n_plus_one(self, threshold):
+        return {shape: count for shape, count in self.shapes.items()
+                if count >= threshold and shape.split(' ', 1)[0] in READ_COMMANDS}
+
+
+class QueryProfiler(monitoring.CommandListener):
+    def __init__(self, n_plus_one=5, window=200):
+        self.n_plus_one_threshold = n_plus_one
+        self.window = window
+        self.enabled = False
+        self.server_timing = True
+        self._local = threading.local()
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))  # endpoint -> deque
+        self._lock = threading.Lock()
+        self._registered = False
+
+    def init_app(self, app):
+        """Gọi trước mongo.init_app: listener chỉ áp dụng cho MongoClient tạo sau khi đăng ký"""
+        self.n_plus_one_threshold = app.config.get('DB_PROFILER_N_PLUS_ONE', self.n_plus_one_threshold)
+        self.window = app.config.get('DB_PROFILER_WINDOW', self.window)
+        self.server_timing = app.config.get('DB_PROFILER_SERVER_TIMING', True)
+        self.enabled = app.config.get('DB_PROFILER_ENABLED', False)
+        if not self.enabled:
+            return
+        if not self._registered:
+            monitoring.register(self)
+            self._registered = True
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._clear)
+
+    # --- CommandListener ---
+
+    def _record(self):
+        return getattr(self._local, 'record', None)
+
+    def started(self, event):
+        record = self._record()
+        if record is None or event.command_name in IGNORED_COMMANDS:
+            return
+        record.commands += 1
+        try:
+            shape = query_shape(event.command_name, event.command)
+        except Exception:
+            shape = event.command_name
+        record.shapes[shape] += 1
+        record._pending[event.request_id] = shape
+
+    def succeeded(self, event):
+        record = self._record()
+        if record is not None and record._pending.pop(event.request_id, None) is not None:
+            record.db_micros += event.duration_micros
+
+    def failed(self, event):
+        self.succeeded(event)
+
+    # --- Vòng đời request ---
+
+    def _start(self):
+        self._local.record = RequestRecord()
+
+    def _finish(self, response):
+        record = self._record()
+        if record is None:
+            return response
+        self._local.record = None
+        total_ms = (time.perf_counter() - record.started) * 1000
+        db_ms = record.db_micros / 1000
+        endpoint = request.endpoint or request.path
+        suspects = record.n_plus_one(self.n_plus_one_threshold)
+        for shape, count in suspects.items():
+            print(f"Possible N+1 in {endpoint}: {count}x {shape}")
+        # Request vừa xong trên thread này (test client chạy request ngay trên thread gọi)
+        self._local.last = {'endpoint': endpoint, 'commands': record.commands, 'db_ms': db_ms,
+                            'shapes': dict(record.shapes), 'n_plus_one': suspects}
+
+        with self._lock:
+            self._samples[endpoint].append({
+                'time': time.time(), 'commands': record.commands, 'db_ms': db_ms,
+                'total_ms': total_ms, 'n_plus_one': suspects,
+            })
+        if self.server_timing:
+            response.headers.add('Server-Timing', f'db;dur={db_ms:.1f};desc="{record.commands} commands"')
+            response.headers.add('Server-Timing', f'app;dur={max(0.0, total_ms - db_ms):.1f}')
+        return response
+
+    def _clear(self, exc=None):
+        self._local.record = None
+
+    def last_request(self):
+        return getattr(self._local, 'last', None)
+
+    @contextmanager
+    def track(self):
+        """Ghi lệnh MongoDB gửi trên thread này trong khối with vào một RequestRecord riêng"""
+        previous = self._record()
+        record = self._local.record = RequestRecord()
+        try:
+            yield record
+        finally:
+            self._local.record = previous
+
+    # --- Thống kê ---
+
+    def stats(self):
+        with self._lock:
+            samples = {endpoint: list(items) for endpoint, items in self._samples.items()}
+        endpoints = {}
+        for endpoint, items in samples.items():
+            commands = [item['commands'] for item in items]
+            suspects = Counter()
+            for item in items:
+                suspects.update(item['n_plus_one'])
+            endpoints[endpoint] = {
+                'requests': len(items),
+                'commands_avg': round(sum(commands) / len(commands), 1),
+                'commands_p95': _percentile(commands, 95),
+                'commands_max': max(commands),
+                'db_ms_avg': round(sum(item['db_ms'] for item in items) / len(items), 2),
+                'total_ms_p95': round(_percentile([item['total_ms'] for item in items], 95), 2),
+                'n_plus_one_requests': sum(1 for item in items if item['n_plus_one']),
+                'n_plus_one_shapes': [{'shape': shape, 'commands': count}
+                                      for shape, count in suspects.most_common(5)],
+            }
+        return {
+            'enabled': self.enabled,
+            'window': self.window,
+            'n_plus_one_threshold': self.n_plus_one_threshold,
+            'endpoints': dict(sorted(endpoints.items(), key=lambda item: -item[1]['commands_avg'])),
+        }
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+db_profiler = QueryProfiler()
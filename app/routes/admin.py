@@ -1,12 +1,32 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app
 from app import mongo
 from app.utils import get_object_id, vietnamese_to_css_class
+from app.seats import book_bulk, prepare_trips, seat_claim, set_total_seats, ticket_changed
+from app.normalize import place_keys
+from app.cache import reference_cache, REFERENCE_COLLECTIONS
+from app.stations import station_index
+from app.connections import connection_graph
+from app.holds import hold_churn
+from app.occupancy import OCCUPANCY_FIELDS, booked_seats
+from app.seat_events import seat_events
+from app.profiler import db_profiler
+from app.ids import id_allocator
+from app.loaders import ticket_customers
+from app.ticket_schema import PAID, STATUS_FIELD, status_filter, with_canonical_fields
+from app.idempotency import idempotent
+from app.http_cache import response_cache
+from app.pagination import ID_PAGE_KEYS, TRIP_PAGE_KEYS_DESC, find_page, paginate
+from app.archive import archived_revenue_by_month, archived_status_counts, fare_prices, revenue_by_month, trip_source
+from app import departures
 from app.permissions import (
     require_role, require_crud_permission, has_permission, has_crud_permission,
     get_user_role, get_accessible_menu_items, ROLES_PERMISSIONS, SAMPLE_USERS
 )
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
+from collections import defaultdict
+import re
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -31,10 +51,11 @@ def create_seats_for_trip(trip_id, vehicle_id):
         existing_seats = mongo.db.Ghe.count_documents({'maLichTrinh': trip_id})
         if existing_seats > 0:
             print(f"Trip {trip_id} already has {existing_seats} seats")
+            set_total_seats(mongo.db, trip_id, existing_seats)
             return existing_seats
         
         # 2. Lấy thông tin xe để xác định layout ghế
-        vehicle = mongo.db.XeKhach.find_one({'maXeKhach': vehicle_id})
+        vehicle = reference_cache.find_one('XeKhach', {'maXeKhach': vehicle_id})
         if not vehicle:
             print(f"Vehicle {vehicle_id} not found")
             return 0
@@ -64,6 +85,7 @@ def create_seats_for_trip(trip_id, vehicle_id):
             result = mongo.db.Ghe.insert_many(seats_data)
             created_count = len(result.inserted_ids)
             print(f"Created {created_count} seats for trip {trip_id}")
+            set_total_seats(mongo.db, trip_id, created_count, [seat['soGhe'] for seat in seats_data])
             return created_count
         
         return 0
@@ -168,15 +190,17 @@ SCHEMAS = {
 def inject_sidebar_stats():
     """Inject sidebar statistics for admin panel"""
     try:
+        # Số liệu từ metadata collection (không quét) - LichTrinh/VeXe chỉ còn dữ liệu nóng (app/archive.py)
+        trip_count = mongo.db.LichTrinh.estimated_document_count()
         return {
-            'tuyen_count': mongo.db.TuyenDuong.count_documents({}),
-            'lich_count': mongo.db.LichTrinh.count_documents({}),
-            'trip_count': mongo.db.LichTrinh.count_documents({}),
-            'xe_count': mongo.db.XeKhach.count_documents({}),
-            've_count': mongo.db.VeXe.count_documents({}),
-            'khach_count': mongo.db.KhachHang.count_documents({}),
-            'tin_count': mongo.db.TinTuc.count_documents({}),
-            'gia_count': mongo.db.GiaVe.count_documents({})
+            'tuyen_count': mongo.db.TuyenDuong.estimated_document_count(),
+            'lich_count': trip_count,
+            'trip_count': trip_count,
+            'xe_count': mongo.db.XeKhach.estimated_document_count(),
+            've_count': mongo.db.VeXe.estimated_document_count(),
+            'khach_count': mongo.db.KhachHang.estimated_document_count(),
+            'tin_count': mongo.db.TinTuc.estimated_document_count(),
+            'gia_count': mongo.db.GiaVe.estimated_document_count()
         }
     except Exception as e:
         return {
@@ -350,6 +374,26 @@ def api_stats():
     }
     return jsonify(stats)
 
+@admin_bp.route('/api/cache-stats')
+def api_cache_stats():
+    """Thống kê cache dữ liệu tham chiếu (hit/miss)"""
+    return jsonify(reference_cache.stats())
+
+@admin_bp.route('/api/response-cache-stats')
+def api_response_cache_stats():
+    """Thống kê cache response HTTP (hit/miss/304, phiên bản collection)"""
+    return jsonify(response_cache.stats())
+
+@admin_bp.route('/api/seat-events-stats')
+def api_seat_events_stats():
+    """Số chuyến / kết nối SSE đang mở, số sự kiện đã đẩy, change stream có chạy không"""
+    return jsonify(seat_events.stats())
+
+@admin_bp.route('/api/perf')
+def api_perf():
+    """Số lệnh MongoDB / thời gian DB theo endpoint và các dạng truy vấn nghi N+1 (app/profiler.py)"""
+    return jsonify(db_profiler.stats())
+
 @admin_bp.route('/api/route-info/<route_id>')
 def get_route_info(route_id):
     """API để lấy thông tin tuyến đường cho auto-fill"""
@@ -361,7 +405,7 @@ def get_route_info(route_id):
             return jsonify({'error': 'Route ID is required'}), 400
             
         # Tìm tuyến đường theo ID
-        route = mongo.db.TuyenDuong.find_one({'maTuyenDuong': route_id})
+        route = reference_cache.find_one('TuyenDuong', {'maTuyenDuong': route_id})
         print(f"Found route: {route}")  # Debug log
         
         if not route:
@@ -379,7 +423,7 @@ def get_route_info(route_id):
         
         # Tìm xe phù hợp với tuyến này - LOGIC CẢI TIẾN
         matching_vehicles = []
-        vehicles = list(mongo.db.XeKhach.find())
+        vehicles = reference_cache.find('XeKhach')
         
         route_name = route.get('tenTuyenDuong', '').lower()
         
@@ -489,7 +533,7 @@ def get_vehicle_info(vehicle_id):
     """API để lấy thông tin xe khách"""
     try:
         # Tìm xe theo ID
-        vehicle = mongo.db.XeKhach.find_one({'maXeKhach': vehicle_id})
+        vehicle = reference_cache.find_one('XeKhach', {'maXeKhach': vehicle_id})
         
         if not vehicle:
             return jsonify({'error': 'Không tìm thấy xe khách'}), 404
@@ -499,7 +543,7 @@ def get_vehicle_info(vehicle_id):
         matching_routes = []
         
         if vehicle_route:
-            routes = list(mongo.db.TuyenDuong.find())
+            routes = reference_cache.find('TuyenDuong')
             
             for route in routes:
                 route_name = route.get('tenTuyenDuong', '').lower()
@@ -574,6 +618,22 @@ def extract_route_codes(route_text):
 # Subroute matching function removed - no longer needed
 # All vehicles are now returned without filtering
 
+# Số document mỗi trang trong danh sách CRUD chung
+LIST_PAGE_SIZE = 50
+
+def departures_changed(collection_name, before, after):
+    """Giữ lịch khởi hành (LichKhoiHanh) và đồ thị nối chuyến khớp với lịch trình / giá vé / tuyến đường"""
+    try:
+        if collection_name == 'LichTrinh':
+            departures.trip_changed(mongo.db, before, after)
+            connection_graph.trip_changed(before, after)
+        elif collection_name in ('GiaVe', 'TuyenDuong'):
+            departures.rebuild_calendar(mongo.db)
+            if collection_name == 'TuyenDuong':
+                connection_graph.invalidate()
+    except Exception as e:
+        print(f"Error updating departure calendar: {e}")
+
 @admin_bp.route('/<collection_name>')
 def list_items(collection_name):
     if collection_name not in SCHEMAS:
@@ -597,9 +657,17 @@ def list_items(collection_name):
     if required_permission and not has_permission(required_permission):
         return redirect(url_for('admin.access_denied'))
         
-    items = list(mongo.db[collection_name].find())
+    # Phân trang keyset theo _id thay cho tải cả collection
+    page = find_page(mongo.db[collection_name], {}, ID_PAGE_KEYS, request.args.get('cursor'), LIST_PAGE_SIZE)
+    items = page['items']
     schema = SCHEMAS[collection_name]
-    return render_template('admin/crud_list.html', items=items, schema=schema, collection_name=collection_name)
+    total_items = mongo.db[collection_name].estimated_document_count()
+    active_items = None
+    if 'tinhTrang' in schema['fields']:
+        active_items = mongo.db[collection_name].count_documents({'tinhTrang': 'Hoạt động'})
+    return render_template('admin/crud_list.html', items=items, schema=schema, collection_name=collection_name,
+                           total_items=total_items, active_items=active_items,
+                           next_cursor=page['next_cursor'], is_first_page=page['cursor'] is None)
 
 @admin_bp.route('/<collection_name>/add', methods=['GET', 'POST'])
 def add_item(collection_name):
@@ -649,8 +717,28 @@ def add_item(collection_name):
             data['ngayThem'] = datetime.now()  # Add creation date
             if not data.get('matKhau'):
                 data['matKhau'] = 'khach123'  # Default password for customers
+        
+        # Khóa địa điểm không dấu cho tìm kiếm (TuyenDuong, LichTrinh, DiaDiem)
+        data.update(place_keys(collection_name, data))
+        if collection_name == 'VeXe':
+            data.update(seat_claim(data))
+            data.update(with_canonical_fields(mongo.db, data))
+            # Lịch sử vé của khách phân trang theo ngayDat (app/ticket_history.py)
+            data.setdefault('ngayDat', datetime.now())
                 
-        mongo.db[collection_name].insert_one(data)
+        try:
+            mongo.db[collection_name].insert_one(data)
+        except DuplicateKeyError:
+            flash('Ghế này đã có vé còn hiệu lực trên chuyến!' if collection_name == 'VeXe'
+                  else f'{schema["label"]} bị trùng dữ liệu', 'error')
+            return render_template('admin/crud_form.html', schema=schema, collection_name=collection_name, item=data)
+        if collection_name == 'VeXe':
+            ticket_changed(mongo.db, None, data)
+        if collection_name in REFERENCE_COLLECTIONS:
+            reference_cache.invalidate(collection_name)
+        response_cache.invalidate(collection_name)
+        station_index.replace(collection_name, None, data)
+        departures_changed(collection_name, None, data)
         flash(f'Added {schema["label"]} successfully')
         return redirect(url_for('admin.list_items', collection_name=collection_name))
         
@@ -742,11 +830,30 @@ def edit_item(collection_name, item_id):
                 if 'matKhau' in data:
                     del data['matKhau']
         
+        data.update(place_keys(collection_name, data))
+        if collection_name == 'VeXe':
+            data.update(seat_claim({**item, **data}))
+            data.update(with_canonical_fields(mongo.db, {**item, **data}))
+        
         # Update using the same search criteria
-        if collection_name == 'LichTrinh':
-            mongo.db[collection_name].update_one({'maLichTrinh': item_id}, {'$set': data})
-        else:
-            mongo.db[collection_name].update_one({'_id': get_object_id(item_id)}, {'$set': data})
+        try:
+            if collection_name == 'LichTrinh':
+                mongo.db[collection_name].update_one({'maLichTrinh': item_id}, {'$set': data})
+            else:
+                mongo.db[collection_name].update_one({'_id': get_object_id(item_id)}, {'$set': data})
+        except DuplicateKeyError:
+            flash('Ghế này đã có vé còn hiệu lực trên chuyến!' if collection_name == 'VeXe'
+                  else f'{schema["label"]} bị trùng dữ liệu', 'error')
+            return render_template('admin/crud_form.html', schema=schema, collection_name=collection_name, item=item)
+        
+        # Vé đổi trạng thái (VD: hủy) hoặc đổi chuyến - cập nhật bộ đếm ghế
+        if collection_name == 'VeXe':
+            ticket_changed(mongo.db, item, {**item, **data})
+        if collection_name in REFERENCE_COLLECTIONS:
+            reference_cache.invalidate(collection_name)
+        response_cache.invalidate(collection_name)
+        station_index.replace(collection_name, item, {**item, **data})
+        departures_changed(collection_name, item, {**item, **data})
             
         flash(f'Updated {schema["label"]} successfully')
         return redirect(url_for('admin.list_items', collection_name=collection_name))
@@ -776,16 +883,25 @@ def delete_item(collection_name, item_id):
         if not has_crud_permission('delete'):
             return redirect(url_for('admin.access_denied'))
         # Special handling for LichTrinh - delete by maLichTrinh first
+        deleted = None
         if collection_name == 'LichTrinh':
-            result = mongo.db[collection_name].delete_one({'maLichTrinh': item_id})
-            if result.deleted_count == 0:
+            deleted = mongo.db[collection_name].find_one_and_delete({'maLichTrinh': item_id})
+            if not deleted:
                 # Try by ObjectId if not found by maLichTrinh
                 try:
-                    mongo.db[collection_name].delete_one({'_id': get_object_id(item_id)})
+                    deleted = mongo.db[collection_name].find_one_and_delete({'_id': get_object_id(item_id)})
                 except:
                     pass
+        elif collection_name == 'VeXe':
+            deleted = mongo.db.VeXe.find_one_and_delete({'_id': get_object_id(item_id)})
+            ticket_changed(mongo.db, deleted, None)
         else:
-            mongo.db[collection_name].delete_one({'_id': get_object_id(item_id)})
+            deleted = mongo.db[collection_name].find_one_and_delete({'_id': get_object_id(item_id)})
+        if collection_name in REFERENCE_COLLECTIONS:
+            reference_cache.invalidate(collection_name)
+        response_cache.invalidate(collection_name)
+        station_index.replace(collection_name, deleted, None)
+        departures_changed(collection_name, deleted, None)
         flash('Deleted successfully')
     return redirect(url_for('admin.list_items', collection_name=collection_name))
 
@@ -809,17 +925,19 @@ def trip_detail(trip_id):
             return redirect(url_for('admin.trip_list'))
         
         # Lấy thông tin xe
-        vehicle = mongo.db.XeKhach.find_one({'maXeKhach': trip.get('maXe')})
+        vehicle = reference_cache.find_one('XeKhach', {'maXeKhach': trip.get('maXe')})
         
         # Lấy thông tin vé đã đặt
         bookings = list(mongo.db.VeXe.find({'maLichTrinh': trip.get('maLichTrinh')}))
         
-        # Lấy thông tin khách hàng
-        customer_ids = [booking.get('maKhach') for booking in bookings if booking.get('maKhach')]
+        # Lấy thông tin khách hàng (cả vé theo maKhachHang) - app/loaders.py
+        ticket_customer = ticket_customers(bookings)
         customers = {}
-        if customer_ids:
-            customer_list = list(mongo.db.KhachHang.find({'maKhach': {'$in': customer_ids}}))
-            customers = {c.get('maKhach'): c for c in customer_list}
+        for booking in bookings:
+            customer = ticket_customer.get(booking)
+            if customer:
+                booking.setdefault('maKhach', customer.get('maKhach'))
+                customers[booking.get('maKhach')] = customer
         
         # Thống kê
         stats = {
@@ -854,13 +972,25 @@ def seat_map():
         selected_vehicle_id = request.args.get('vehicle', '')
         
         # Get all vehicles with seat information (accept multiple status values)
-        vehicles = list(mongo.db.XeKhach.find({
+        vehicles = reference_cache.find('XeKhach', {
             'tinhTrang': {'$in': ['Hoạt động', 'Sẵn sàng', 'Đang vận hành']}
-        }))
+        })
         
         # If no vehicles with those status, get all vehicles
         if not vehicles:
-            vehicles = list(mongo.db.XeKhach.find({}))
+            vehicles = reference_cache.find('XeKhach')
+        
+        # Lịch trình và ghế của mọi xe: hai truy vấn $in thay cho hai truy vấn mỗi xe
+        schedules_by_vehicle, seats_by_vehicle = defaultdict(list), defaultdict(list)
+        vehicle_of_trip = {}
+        for schedule in prepare_trips(mongo.db, list(mongo.db.LichTrinh.find(
+                {'maXe': {'$in': [vehicle.get('maXeKhach') for vehicle in vehicles]}},
+                {**OCCUPANCY_FIELDS, 'maXe': 1}))):
+            schedules_by_vehicle[schedule.get('maXe')].append(schedule)
+            vehicle_of_trip[schedule.get('maLichTrinh')] = schedule.get('maXe')
+        if vehicle_of_trip:
+            for seat in mongo.db.Ghe.find({'maLichTrinh': {'$in': list(vehicle_of_trip)}}):
+                seats_by_vehicle[vehicle_of_trip.get(seat.get('maLichTrinh'))].append(seat)
         
         # Enhanced seat map data with pricing and booking information
         seat_maps = []
@@ -885,22 +1015,16 @@ def seat_map():
                 layout = '2x2'
             
             # Get pricing information for this vehicle type
-            gia_ve_info = mongo.db.GiaVe.find_one({'maLoaiXe': loai_xe})
+            gia_ve_info = reference_cache.find_one('GiaVe', {'maLoaiXe': loai_xe})
             if not gia_ve_info:
                 # Fallback to any price for this vehicle type
-                gia_ve_info = mongo.db.GiaVe.find_one({'maLoaiXe': {'$regex': loai_xe[:2]}})
+                gia_ve_info = reference_cache.find_one('GiaVe', {'maLoaiXe': {'$regex': loai_xe[:2]}})
             
             # Get real seat data for this vehicle
-            # First, find schedules for this vehicle
-            vehicle_schedules = list(mongo.db.LichTrinh.find({'maXe': vehicle.get('maXeKhach')}))
-            
-            # Get all seats for all schedules of this vehicle
-            schedule_codes = [schedule.get('maLichTrinh') for schedule in vehicle_schedules]
-            
-            if schedule_codes:
-                vehicle_seats = list(mongo.db.Ghe.find({'maLichTrinh': {'$in': schedule_codes}}))
-            else:
-                vehicle_seats = []
+            vehicle_schedules = schedules_by_vehicle.get(vehicle.get('maXeKhach'), [])
+            # Ghế đã có vé theo từng chuyến, đọc từ bitmap trên lịch trình
+            booked_by_trip = {schedule.get('maLichTrinh'): booked_seats(schedule) for schedule in vehicle_schedules}
+            vehicle_seats = seats_by_vehicle.get(vehicle.get('maXeKhach'), [])
             
             # Create seat layout with real data
             bookings = []
@@ -911,6 +1035,8 @@ def seat_map():
             for seat in vehicle_seats:
                 seat_number = seat.get('soGhe', '')
                 status = seat.get('tinhTrang', 'Trống')
+                if seat_number in booked_by_trip.get(seat.get('maLichTrinh'), ()):
+                    status = 'Đã bán'
                 description = seat.get('moTa', '')
                 
                 # Extract customer info from description if available
@@ -1017,6 +1143,8 @@ def seat_map_add_vehicle():
             flash('Mã xe khách đã tồn tại!', 'error')
         else:
             mongo.db.XeKhach.insert_one(vehicle_data)
+            reference_cache.invalidate('XeKhach')
+            response_cache.invalidate('XeKhach')
             flash('Thêm xe khách thành công!', 'success')
         
     except Exception as e:
@@ -1040,6 +1168,8 @@ def seat_map_edit_vehicle():
             {'maXeKhach': ma_xe}, 
             {'$set': update_data}
         )
+        reference_cache.invalidate('XeKhach')
+        response_cache.invalidate('XeKhach')
         
         if result.matched_count > 0:
             flash('Cập nhật xe khách thành công!', 'success')
@@ -1056,6 +1186,8 @@ def seat_map_delete_vehicle(ma_xe):
     """Xóa xe khách"""
     try:
         result = mongo.db.XeKhach.delete_one({'maXeKhach': ma_xe})
+        reference_cache.invalidate('XeKhach')
+        response_cache.invalidate('XeKhach')
         
         if result.deleted_count > 0:
             return jsonify({'success': True, 'message': 'Xóa xe khách thành công'})
@@ -1093,12 +1225,18 @@ def revenue_report():
         total_tickets = mongo.db.VeXe.count_documents({})
         
         # Revenue by route (estimate)
-        routes = list(mongo.db.TuyenDuong.find())
+        routes = reference_cache.find('TuyenDuong')
         revenue_by_route = []
         
+        # Số vé theo lịch trình - một $group thay cho count_documents $regex mỗi tuyến
+        tickets_by_trip = {row['_id']: row['count'] for row in mongo.db.VeXe.aggregate([
+            {'$group': {'_id': '$maLichTrinh', 'count': {'$sum': 1}}}
+        ]) if isinstance(row['_id'], str)}
+        
         for route in routes:
-            # Estimate tickets for this route
-            tickets_count = mongo.db.VeXe.count_documents({'maLichTrinh': {'$regex': route.get('maTuyenDuong', '')}})
+            # Estimate tickets for this route (mã lịch trình chứa mã tuyến)
+            route_pattern = re.compile(route.get('maTuyenDuong', ''))
+            tickets_count = sum(count for code, count in tickets_by_trip.items() if route_pattern.search(code))
             avg_price = route.get('doDai', 100) * 3000  # 3k per km estimate
             
             revenue_by_route.append({
@@ -1143,8 +1281,9 @@ def get_seat_data(vehicle_id):
     """API để lấy dữ liệu ghế thực tế cho xe với thông tin khách hàng đầy đủ"""
     try:
         # Find schedules for this vehicle
-        vehicle_schedules = list(mongo.db.LichTrinh.find({'maXe': vehicle_id}))
+        vehicle_schedules = prepare_trips(mongo.db, list(mongo.db.LichTrinh.find({'maXe': vehicle_id}, OCCUPANCY_FIELDS)))
         schedule_codes = [schedule.get('maLichTrinh') for schedule in vehicle_schedules]
+        booked_by_trip = {schedule.get('maLichTrinh'): booked_seats(schedule) for schedule in vehicle_schedules}
         
         if schedule_codes:
             vehicle_seats = list(mongo.db.Ghe.find({'maLichTrinh': {'$in': schedule_codes}}))
@@ -1158,30 +1297,24 @@ def get_seat_data(vehicle_id):
                 'maLichTrinh': {'$in': schedule_codes}
             }))
             
+            # Khách của mọi vé (maKhach hoặc maKhachHang): một $in cho mỗi schema
+            ticket_customer = ticket_customers(ve_xe_list)
+            
             # Create booking lookup by seat number
             for ve in ve_xe_list:
                 seat_num = ve.get('maGhe', '')
+                customer = ticket_customer.get(ve) or {}
                 bookings[seat_num] = {
-                    'maKhach': ve.get('maKhach'),
+                    'maKhach': ve.get('maKhach') or customer.get('maKhach'),
                     'ngayDat': ve.get('ngayThem'),
                     'tinhTrang': ve.get('tinhTrang'),
-                    'maVe': ve.get('maVe')
-                }
-        
-        # Get customer information
-        customer_data = {}
-        if bookings:
-            customer_codes = [booking['maKhach'] for booking in bookings.values() if booking.get('maKhach')]
-            customers = list(mongo.db.KhachHang.find({
-                'maKhach': {'$in': customer_codes}
-            }))
-            
-            for customer in customers:
-                customer_data[customer.get('maKhach')] = {
-                    'ten': customer.get('ten', ''),
-                    'dienThoai': customer.get('dienThoai', ''),
-                    'email': customer.get('email', ''),
-                    'diaChi': customer.get('diaChi', '')
+                    'maVe': ve.get('maVe'),
+                    'customer': {
+                        'ten': customer.get('ten', ''),
+                        'dienThoai': customer.get('dienThoai', ''),
+                        'email': customer.get('email', ''),
+                        'diaChi': customer.get('diaChi', '')
+                    } if customer else {}
                 }
         
         # Format seat data for frontend
@@ -1189,10 +1322,13 @@ def get_seat_data(vehicle_id):
         for seat in vehicle_seats:
             seat_number = seat.get('soGhe', '')
             status = seat.get('tinhTrang', 'Trống')
+            # Ghế có vé còn hiệu lực theo bitmap của chuyến
+            if seat_number in booked_by_trip.get(seat.get('maLichTrinh'), ()):
+                status = 'Đã bán'
             
             # Get booking info if exists
             booking_info = bookings.get(seat_number, {})
-            customer_info = customer_data.get(booking_info.get('maKhach'), {})
+            customer_info = booking_info.get('customer', {})
             
             # Convert status to frontend format
             if status == 'Đã bán':
@@ -1265,8 +1401,12 @@ def create_trip():
                     'tenPhuXe': request.form.get('tenPhuXe'),
                     'tinhTrang': request.form.get('tinhTrang', 'Sắp chạy'),
                     'moTa': request.form.get('moTa', ''),
-                    'ngayThem': datetime.now()
+                    'ngayThem': datetime.now(),
+                    # Bộ đếm ghế - tongGhe được đặt bởi create_seats_for_trip
+                    'tongGhe': 0,
+                    'soGheDaDat': 0
                 }
+                trip_data.update(place_keys('LichTrinh', trip_data))
             except ValueError as ve:
                 error_msg = f'Lỗi dữ liệu: {str(ve)}'
                 
@@ -1283,7 +1423,7 @@ def create_trip():
                 return redirect(url_for('admin.create_trip'))
             
             # Validate required fields
-            required_fields = ['maLichTrinh', 'maXe', 'diemDi', 'diemDen', 'gioDi', 'ngayDi']
+            required_fields = ['maXe', 'diemDi', 'diemDen', 'gioDi', 'ngayDi']
             missing_fields = []
             for field in required_fields:
                 if not trip_data.get(field):
@@ -1306,6 +1446,10 @@ def create_trip():
                 flash(error_msg, 'error')
                 return redirect(url_for('admin.create_trip'))
             
+            # Mã lịch trình lấy từ bộ đếm (app/ids.py) khi lưu - xem form không tốn mã
+            if not trip_data['maLichTrinh']:
+                trip_data['maLichTrinh'] = id_allocator.next_id(mongo.db, 'maLichTrinh')
+            
             # Check if trip ID already exists
             if mongo.db.LichTrinh.find_one({'maLichTrinh': trip_data['maLichTrinh']}):
                 error_msg = 'Mã lịch trình đã tồn tại!'
@@ -1348,6 +1492,10 @@ def create_trip():
             # Tạo ghế thông minh cho trip mới (tránh duplicate)
             seat_count = create_seats_for_trip(trip_data['maLichTrinh'], trip_data['maXe'])
             
+            # Cập nhật lịch khởi hành cho ngày của chuyến mới
+            departures_changed('LichTrinh', None, trip_data)
+            response_cache.invalidate('LichTrinh')
+            
             if seat_count > 0:
                 flash(f'✅ Tạo chuyến xe thành công với {seat_count} ghế!', 'success')
             else:
@@ -1373,7 +1521,7 @@ def create_trip():
         # GET request - show form with enhanced error handling
         try:
             # 1. Get available routes (TuyenDuong) - ENHANCED with error handling
-            routes = list(mongo.db.TuyenDuong.find())
+            routes = reference_cache.find('TuyenDuong')
             if not routes:
                 flash('⚠️ Không tìm thấy tuyến đường. Vui lòng kiểm tra dữ liệu!', 'warning')
                 routes = []
@@ -1381,7 +1529,7 @@ def create_trip():
             routes = sorted(routes, key=lambda x: x.get('tenTuyenDuong', ''))
             
             # 2. Get available vehicles (XeKhach) with enhanced route mapping
-            vehicles = list(mongo.db.XeKhach.find())
+            vehicles = reference_cache.find('XeKhach')
             if not vehicles:
                 flash('⚠️ Không tìm thấy xe khách. Vui lòng kiểm tra dữ liệu!', 'warning')
                 vehicles = []
@@ -1394,10 +1542,10 @@ def create_trip():
         
         try:
             # 3. Get pricing information (GiaVe) - with route context
-            pricing = list(mongo.db.GiaVe.find())
+            pricing = reference_cache.find('GiaVe')
             
             # 4. Get seat layouts (SoDoGhe) - with vehicle type mapping
-            seat_layouts = list(mongo.db.SoDoGhe.find())
+            seat_layouts = reference_cache.find('SoDoGhe')
             
             # 5. Get stops/stations (TramDung) - organized by province
             stops = list(mongo.db.TramDung.find())
@@ -1516,36 +1664,6 @@ def create_trip():
         else:
             print("WARNING: No drivers loaded - form may have issues")
         
-        # Generate next trip ID with better error handling
-        try:
-            last_trip = mongo.db.LichTrinh.find().sort('maLichTrinh', -1).limit(1)
-            next_id = 'LT0001'
-            last_trip_list = list(last_trip)
-            if last_trip_list:
-                last_id = last_trip_list[0]['maLichTrinh']
-                # Extract number and increment
-                try:
-                    # Better ID parsing
-                    import re
-                    numbers = re.findall(r'\d+', last_id)
-                    if numbers:
-                        num = int(numbers[-1]) + 1  # Get last number and increment
-                        next_id = f'LT{num:04d}'
-                    else:
-                        next_id = 'LT0051'  # Fallback if no numbers found
-                except Exception as id_error:
-                    print(f"Trip ID generation error: {id_error}")
-                    # Generate based on timestamp as fallback
-                    import time
-                    timestamp = int(time.time()) % 10000
-                    next_id = f'LT{timestamp:04d}'
-        except Exception as trip_query_error:
-            print(f"Trip query error: {trip_query_error}")
-            # Generate based on timestamp as ultimate fallback
-            import time
-            timestamp = int(time.time()) % 10000
-            next_id = f'LT{timestamp:04d}'
-        
         # Final safety check before rendering
         template_data = {
             'routes': routes or [],
@@ -1555,7 +1673,8 @@ def create_trip():
             'stops': stops or [],
             'locations': locations or [],
             'drivers': drivers or [],
-            'next_trip_id': next_id or 'LT0001',
+            # Mã lịch trình được cấp khi lưu (POST)
+            'next_trip_id': '',
             'today': datetime.now().strftime('%Y-%m-%d')
         }
         
@@ -1579,7 +1698,7 @@ def trip_list():
         route_filter = request.args.get('route', '')
         date_from = request.args.get('date_from', '')
         date_to = request.args.get('date_to', '')
-        page = int(request.args.get('page', 1))
+        cursor = request.args.get('cursor')
         per_page = 20
         
         # Build MongoDB query
@@ -1607,36 +1726,39 @@ def trip_list():
                 query['diemDen'] = route_parts[1]
         
         # Filter by date range
+        parsed_from = parsed_to = None
         if date_from or date_to:
             date_query = {}
             if date_from:
                 try:
-                    from datetime import datetime
-                    date_query['$gte'] = datetime.strptime(date_from, '%Y-%m-%d')
+                    parsed_from = datetime.strptime(date_from, '%Y-%m-%d')
+                    date_query['$gte'] = parsed_from
                 except:
                     pass
             if date_to:
                 try:
-                    from datetime import datetime
-                    date_query['$lte'] = datetime.strptime(date_to, '%Y-%m-%d')
+                    parsed_to = datetime.strptime(date_to, '%Y-%m-%d')
+                    date_query['$lte'] = parsed_to
                 except:
                     pass
             if date_query:
                 query['ngayDi'] = date_query
         
-        # Get trips with filters
-        trips = list(mongo.db.LichTrinh.find(query)
-                    .sort('ngayDi', -1)
-                    .skip((page - 1) * per_page)
-                    .limit(per_page))
+        # Chỉ đọc kho lưu trữ khi bộ lọc ngày chạm vào vùng đã lưu trữ (app/archive.py)
+        fetch, count = trip_source(mongo.db, parsed_from, parsed_to,
+                                   current_app.config.get('ARCHIVE_HORIZON_DAYS', 90))
+        
+        # Get trips with filters - phân trang keyset (ngayDi, _id) giảm dần, không skip
+        page = paginate(fetch, query, TRIP_PAGE_KEYS_DESC, cursor, per_page)
+        trips = prepare_trips(mongo.db, page['items'])
         
         # Get total count for pagination
-        total_filtered = mongo.db.LichTrinh.count_documents(query)
+        total_filtered = count(query)
         
         # Enrich trips with vehicle and route info
         for trip in trips:
             # Get vehicle info
-            vehicle = mongo.db.XeKhach.find_one({'maXeKhach': trip.get('maXe')})
+            vehicle = reference_cache.find_one('XeKhach', {'maXeKhach': trip.get('maXe')})
             if vehicle:
                 trip['vehicle_info'] = {
                     'ten': vehicle.get('ten'),
@@ -1644,20 +1766,23 @@ def trip_list():
                     'tuyen': vehicle.get('tuyen')
                 }
             
-            # Count bookings for this trip
-            booking_count = mongo.db.VeXe.count_documents({'maLichTrinh': trip.get('maLichTrinh')})
-            trip['booking_count'] = booking_count
+            # Số vé đã đặt - đọc từ bộ đếm trên lịch trình
+            trip['booking_count'] = trip.get('soGheDaDat', 0)
         
-        # Calculate statistics for all trips (not just current page)
-        total_trips = mongo.db.LichTrinh.count_documents({})
+        # Thống kê theo trạng thái: một $group trên collection nóng + bảng tổng kết chuyến đã lưu trữ
+        status_counts = {row['_id']: row['count'] for row in mongo.db.LichTrinh.aggregate([
+            {'$group': {'_id': '$tinhTrang', 'count': {'$sum': 1}}}
+        ])}
+        for status, archived in archived_status_counts(mongo.db).items():
+            status_counts[status] = status_counts.get(status, 0) + archived
+        total_trips = sum(status_counts.values())
         
-        # Get status statistics from database
         stats = {
             'total': total_trips,
-            'da_hoan_thanh': mongo.db.LichTrinh.count_documents({'tinhTrang': 'Đã hoàn thành'}),
-            'dang_chay': mongo.db.LichTrinh.count_documents({'tinhTrang': 'Đang chạy'}),
-            'sap_chay': mongo.db.LichTrinh.count_documents({'tinhTrang': 'Sắp chạy'}),
-            'da_huy': mongo.db.LichTrinh.count_documents({'tinhTrang': 'Đã hủy'})
+            'da_hoan_thanh': status_counts.get('Đã hoàn thành', 0),
+            'dang_chay': status_counts.get('Đang chạy', 0),
+            'sap_chay': status_counts.get('Sắp chạy', 0),
+            'da_huy': status_counts.get('Đã hủy', 0)
         }
         
         # Get filter options for dropdowns
@@ -1676,9 +1801,17 @@ def trip_list():
             route_str = f"{route['_id']['diemDi']} -> {route['_id']['diemDen']}"
             all_routes.append(route_str)
         
+        # Bộ lọc hiện tại - giữ lại khi chuyển trang
+        filter_args = {key: value for key, value in {
+            'search': search_query, 'status': status_filter, 'route': route_filter,
+            'date_from': date_from, 'date_to': date_to
+        }.items() if value}
+        
         return render_template('admin/trip_list.html', 
                              trips=trips, 
-                             page=page, 
+                             next_cursor=page['next_cursor'],
+                             is_first_page=page['cursor'] is None,
+                             filter_args=filter_args,
                              per_page=per_page,
                              total_trips=total_trips,
                              total_filtered=total_filtered,
@@ -1867,20 +2000,16 @@ def revenue():
         total_revenue = 0
         monthly_revenue = {}
         
-        # Get all paid tickets
-        tickets = list(mongo.db.VeXe.find({'tinhTrang': 'Đã thanh toán'}))
-        
-        for ticket in tickets:
-            # Get price from GiaVe collection
-            price_info = mongo.db.GiaVe.find_one({'maGiaVe': ticket.get('maGiaVe')})
-            if price_info:
-                price = price_info.get('giaVe', 0)
-                total_revenue += price
-                
-                # Group by month if ngayThem exists
-                if ticket.get('ngayThem'):
-                    month_key = ticket['ngayThem'].strftime('%Y-%m')
-                    monthly_revenue[month_key] = monthly_revenue.get(month_key, 0) + price
+        # Vé đã thanh toán còn ở collection nóng; chuyến đã lưu trữ lấy từ bảng tổng kết.
+        # Hai phía cùng quy tắc trạng thái / tháng (app/archive.py: revenue_by_month)
+        tickets = list(mongo.db.VeXe.find(status_filter([PAID]), {
+            'maGiaVe': 1, 'ngayThem': 1, 'ngayDat': 1, 'tinhTrang': 1, 'trangThai': 1, STATUS_FIELD: 1
+        }))
+        hot_revenue = revenue_by_month(tickets, fare_prices(mongo.db, tickets))
+        for revenue_rows in (archived_revenue_by_month(mongo.db), hot_revenue):
+            for month_key, amount in revenue_rows.items():
+                total_revenue += amount
+                monthly_revenue[month_key] = monthly_revenue.get(month_key, 0) + amount
         
         return render_template('admin/revenue.html',
                              total_revenue=total_revenue,
@@ -1913,3 +2042,107 @@ def statistics():
     except Exception as e:
         flash(f'Lỗi tải thống kê: {str(e)}', 'error')
         return redirect(url_for('admin.dashboard'))
+
+# Seat Hold Churn - giữ chỗ khi chọn ghế (app/holds.py)
+@admin_bp.route('/seat-holds')
+@require_role('thong_ke')
+def seat_holds():
+    """Thống kê giữ chỗ: tạo mới, gia hạn, hủy, bị từ chối, chuyển thành vé"""
+    try:
+        churn = hold_churn(mongo.db, days=request.args.get('days', 14, type=int) or 14)
+        
+        # Gắn thông tin chuyến cho các giữ chỗ đang hiệu lực - một truy vấn
+        trip_codes = [row['_id'] for row in churn['active']]
+        trips = {t['maLichTrinh']: t for t in mongo.db.LichTrinh.find(
+            {'maLichTrinh': {'$in': trip_codes}},
+            {'maLichTrinh': 1, 'diemDi': 1, 'diemDen': 1, 'ngayDi': 1, 'gioDi': 1}
+        )}
+        for row in churn['active']:
+            row['trip'] = trips.get(row['_id'], {})
+        
+        return render_template('admin/seat_holds.html',
+                             churn=churn,
+                             accessible_menu=get_accessible_menu_items())
+                             
+    except Exception as e:
+        flash(f'Lỗi tải thống kê giữ chỗ: {str(e)}', 'error')
+        return redirect(url_for('admin.dashboard'))
+
+@admin_bp.route('/api/seat-holds')
+@require_role('thong_ke')
+def api_seat_holds():
+    """Thống kê giữ chỗ dạng JSON"""
+    churn = hold_churn(mongo.db, days=request.args.get('days', 14, type=int) or 14)
+    return jsonify(churn)
+
+@admin_bp.route('/api/agency-bookings', methods=['POST'])
+@idempotent('agency-booking')
+def api_agency_bookings():
+    """
+    Đại lý (DaiLy) đặt nhiều ghế trên nhiều chuyến trong một yêu cầu:
+        {"maDaiLy": "<_id DaiLy>", "atomic": false,
+         "items": [{"maLichTrinh": "LT0001", "maGhe": "A01"}, ...]}
+    Trả về kết quả từng ghế theo thứ tự gửi lên (app/seats.py: book_bulk).
+    Gửi kèm header Idempotency-Key để gửi lại an toàn (app/idempotency.py).
+    """
+    if not has_permission('ve_xe') or not has_crud_permission('create'):
+        return jsonify({'status': 'error', 'message': 'Không có quyền đặt vé'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'status': 'error', 'message': 'Danh sách ghế (items) trống'}), 400
+    max_items = current_app.config.get('AGENCY_BOOKING_MAX_ITEMS', 500)
+    if len(items) > max_items:
+        return jsonify({'status': 'error', 'message': f'Tối đa {max_items} ghế mỗi yêu cầu'}), 400
+    
+    try:
+        agency = mongo.db.DaiLy.find_one({'_id': get_object_id(data.get('maDaiLy'))})
+    except Exception:
+        agency = None
+    if not agency:
+        return jsonify({'status': 'error', 'message': 'Không tìm thấy đại lý'}), 404
+    
+    # Mã đặt vé chung cho cả yêu cầu, mỗi ghế một mã vé (app/ids.py)
+    batch_id = id_allocator.next_id(mongo.db, 'maDatVe')
+    ticket_ids = id_allocator.next_ids(mongo.db, 'maVe', len(items))
+    now = datetime.now()
+    tickets = []
+    for item, ma_ve in zip(items, ticket_ids):
+        item = item if isinstance(item, dict) else {}
+        tickets.append({
+            'maVe': ma_ve,
+            'maLichTrinh': str(item.get('maLichTrinh') or '').strip(),
+            'maGhe': str(item.get('maGhe') or '').strip(),
+            'maDaiLy': str(agency['_id']),
+            'maDatVe': batch_id,
+            'ngayThem': now,
+            'ngayDat': now,
+            'nguoiThem': session.get('user_id'),
+            'tinhTrang': 'Chờ thanh toán',  # Old schema
+            'trangThai': 'DaDat'  # New schema
+        })
+    
+    def add_price(ticket, trip):
+        gia_ve = reference_cache.find_one('GiaVe', {'tuyen': f"{trip.get('diemDi')}-{trip.get('diemDen')}"})
+        ticket['maGiaVe'] = gia_ve.get('maGiaVe') if gia_ve else None
+    
+    try:
+        statuses = book_bulk(mongo.db, tickets, atomic=bool(data.get('atomic')), prepare=add_price)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    
+    results = []
+    for ticket, status in zip(tickets, statuses):
+        result = {'maLichTrinh': ticket['maLichTrinh'], 'maGhe': ticket['maGhe'], 'status': status}
+        if status == 'booked':
+            result['maVe'] = ticket['maVe']
+        results.append(result)
+    booked = statuses.count('booked')
+    return jsonify({
+        'status': 'success' if booked == len(items) else 'partial' if booked else 'failed',
+        'maDatVe': batch_id if booked else None,
+        'booked': booked,
+        'failed': len(items) - booked,
+        'results': results
+    })
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
 from app import mongo
 from datetime import datetime
+from app.ids import id_allocator
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -70,21 +71,8 @@ def register():
                 flash('Email đã được đăng ký')
                 return render_template('auth/register.html')
         
-        # Generate new customer code
-        last_customer = mongo.db.KhachHang.find_one(
-            {'maKhach': {'$regex': '^KH[0-9]+$'}},
-            sort=[('maKhach', -1)]
-        )
-        
-        if last_customer and last_customer.get('maKhach'):
-            try:
-                last_num = int(last_customer['maKhach'].replace('KH', ''))
-                new_code = f'KH{str(last_num + 1).zfill(4)}'
-            except (ValueError, TypeError):
-                # Fallback if parsing fails
-                new_code = f'KH{str(mongo.db.KhachHang.count_documents({}) + 1).zfill(4)}'
-        else:
-            new_code = 'KH0001'
+        # Generate new customer code (app/ids.py)
+        new_code = id_allocator.next_id(mongo.db, 'maKhach')
         
         # Create new customer account - đúng cấu trúc KhachHang
         customer_data = {
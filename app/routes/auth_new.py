@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
 from app import mongo
 from datetime import datetime
+from app.ids import id_allocator
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -78,24 +79,8 @@ def register():
             flash('Số điện thoại đã được sử dụng')
             return render_template('auth/register.html')
         
-        # Tạo mã khách hàng mới
-        last_customer = mongo.db.KhachHang.find_one(
-            {'maKhach': {'$regex': '^KH[0-9]+$'}},
-            sort=[('maKhach', -1)]
-        )
-        
-        if last_customer and last_customer.get('maKhach'):
-            try:
-                # Extract number from KH0001 format
-                last_num = int(last_customer['maKhach'].replace('KH', ''))
-                new_num = last_num + 1
-            except (ValueError, TypeError):
-                # Fallback if parsing fails
-                new_num = mongo.db.KhachHang.count_documents({}) + 1
-        else:
-            new_num = 1
-            
-        new_ma_khach = f'KH{new_num:04d}'  # Format as KH0001
+        # Tạo mã khách hàng mới (KH0001, ...) từ bộ đếm - app/ids.py
+        new_ma_khach = id_allocator.next_id(mongo.db, 'maKhach')
         
         # Create new customer - lưu vào bảng KhachHang
         customer_data = {
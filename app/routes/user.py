@@ -1,12 +1,34 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app, Response
 from app import mongo
 from app.utils import parse_json, get_object_id
+from app.search import ACTIVE_TRIP_STATUSES, find_route, route_match, route_query, search_trips
+from app.departures import calendar_days
+from app.seats import active_ticket_filter, book_seats, cancel_ticket, prepare_trip
+from app.cache import reference_cache
+from app.stations import station_index
+from app.pagination import TRIP_PAGE_KEYS, paginate
+from app.http_cache import response_cache
+from app.connections import connection_itineraries
+from app.holds import active_holds, convert_holds, hold_seats, release_holds
+from app.occupancy import OCCUPANCY_FIELDS, booked_count, booked_seats, invalid_seats, may_have_holds
+from app.seat_events import seat_events
+from app.ids import id_allocator
+from app.loaders import loader, ticket_customers
+from app.idempotency import idempotent
+from app.ticket_history import ticket_history
+from app.ticket_schema import HISTORY_STATES, owner_filter, status_filter
+from app import waitlist
 from datetime import datetime, timedelta
-from bson import ObjectId
+from uuid import uuid4
 
 user_bp = Blueprint('user', __name__)
 
+# Số chuyến mỗi trang (phân trang keyset, app/pagination.py)
+SEARCH_PAGE_SIZE = 20
+ROUTES_PAGE_SIZE = 50
+
 @user_bp.route('/')
+@response_cache.cached(ttl=60, depends=('TuyenDuong', 'TinTuc'))
 def index():
     # Chỉ lấy các trường cần thiết và giới hạn số lượng để tăng tốc độ
     tuyen_duong = list(mongo.db.TuyenDuong.find(
@@ -19,20 +41,27 @@ def index():
         {'maTinTuc': 1, 'tieuDe': 1, 'noiDung': 1, 'ngayDang': 1}
     ).sort('ngayDang', -1).limit(3))  # 3 tin mới nhất
     
-    # Lấy danh sách các trạm để hiển thị trong dropdown
-    stations = set()
-    for td in tuyen_duong:
-        stations.add(td.get('diemDau'))
-        stations.add(td.get('diemCuoi'))
-    
-    stations_list = sorted(list(stations))
-    
+    # Không nạp toàn bộ danh sách trạm: gợi ý theo tiền tố qua /api/stations
     return render_template('user/index.html', 
                           tuyen_duong=tuyen_duong, 
-                          tin_tuc=tin_tuc,
-                          stations=stations_list)
+                          tin_tuc=tin_tuc)
+
+@user_bp.route('/api/stations')
+def get_stations():
+    """API gợi ý tên trạm theo tiền tố (không phân biệt dấu)"""
+    try:
+        query = request.args.get('q', '')
+        limit = min(request.args.get('limit', 10, type=int) or 10, 50)
+        return jsonify({
+            'status': 'success',
+            'stations': station_index.suggest(mongo.db, query, limit)
+        })
+    except Exception as e:
+        print(f"Error in get_stations: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @user_bp.route('/api/available-dates')
+@response_cache.cached(ttl=120, depends=('LichTrinh', 'GiaVe', 'TuyenDuong'))
 def get_available_dates():
     """API để lấy ngày có chuyến đi và giá vé cho Flatpickr"""
     try:
@@ -43,69 +72,48 @@ def get_available_dates():
         
         # Nếu có specific route request
         if diem_di and diem_den:
-            # Tìm tuyến đường phù hợp - hỗ trợ cả mã điểm và tên thành phố
-            tuyen_duong = mongo.db.TuyenDuong.find_one({
-                '$or': [
-                    {'diemDau': diem_di, 'diemCuoi': diem_den},
-                    {'diemDau': diem_den, 'diemCuoi': diem_di},
-                    {'tenTuyenDuong': {'$regex': diem_di, '$options': 'i'}},
-                    {'tenTuyenDuong': {'$regex': diem_den, '$options': 'i'}}
-                ]
-            })
-            
-            # Tìm lịch trình - đơn giản hóa query
-            lich_trinh_query = {
-                'ngayDi': {'$gte': today},
-                'tinhTrang': {'$in': ['Sắp chạy', 'Đang chạy', 'Chưa khởi hành', 'Đang chờ']}
-            }
-            
-            # Match điểm đi/đến
-            if tuyen_duong:
-                lich_trinh_query['$or'] = [
-                    {'diemDi': tuyen_duong.get('diemDau'), 'diemDen': tuyen_duong.get('diemCuoi')},
-                    {'diemDi': tuyen_duong.get('diemCuoi'), 'diemDen': tuyen_duong.get('diemDau')},
-                    {'diemDi': diem_di, 'diemDen': diem_den},
-                    {'diemDi': diem_den, 'diemDen': diem_di}
-                ]
-            else:
-                lich_trinh_query['$or'] = [
-                    {'diemDi': diem_di, 'diemDen': diem_den},
-                    {'diemDi': diem_den, 'diemDen': diem_di},
-                    {'diemDi': {'$regex': diem_di, '$options': 'i'}, 'diemDen': {'$regex': diem_den, '$options': 'i'}},
-                    {'diemDi': {'$regex': diem_den, '$options': 'i'}, 'diemDen': {'$regex': diem_di, '$options': 'i'}}
-                ]
+            # Tìm tuyến đường phù hợp (qua cache) - chỉ dùng cho tên tuyến và khóa chiều ngược
+            tuyen_duong = reference_cache.find_one('TuyenDuong', route_query(diem_di, diem_den))
             
-            lich_trinh_list = list(mongo.db.LichTrinh.find(lich_trinh_query).sort('ngayDi', 1))
+            # Lịch khởi hành tính sẵn theo (điểm đi, điểm đến, ngày) - cả hai chiều
+            place_pairs = {(diem_di, diem_den), (diem_den, diem_di)}
+            if tuyen_duong and tuyen_duong.get('diemDau') and tuyen_duong.get('diemCuoi'):
+                dau, cuoi = tuyen_duong['diemDau'], tuyen_duong['diemCuoi']
+                place_pairs |= {(dau, cuoi), (cuoi, dau)}
+            route_days = calendar_days(mongo.db, place_pairs, today)
             
-            # Tìm giá vé
-            gia_ve = mongo.db.GiaVe.find_one({
-                'tinhTrang': {'$in': ['Hoạt động', 'Đang áp dụng']}
-            })
-            base_price = gia_ve.get('giaVe', 350000) if gia_ve else 350000
+            # Giá cơ bản: giá thấp nhất trong các ngày
+            fares = [d['giaThapNhat'] for d in route_days if d.get('giaThapNhat')]
+            base_price = min(fares) if fares else 350000
             
-            # Format dữ liệu cho Flatpickr - group by date
+            # Format dữ liệu cho Flatpickr - gộp hai chiều cùng ngày
             dates_dict = {}
-            for lt in lich_trinh_list:
-                date_str = lt['ngayDi'].strftime('%Y-%m-%d')
+            total_trips = 0
+            for day in route_days:
+                date_str = day['ngay'].strftime('%Y-%m-%d')
+                day_price = day.get('giaThapNhat') or base_price
                 if date_str not in dates_dict:
                     dates_dict[date_str] = {
                         'date': date_str,
-                        'price': base_price,
+                        'price': day_price,
                         'trips': []
                     }
-                dates_dict[date_str]['trips'].append({
-                    'time': lt.get('gioDi', ''),
-                    'trip_id': lt.get('maLichTrinh'),
-                    'status': lt.get('tinhTrang')
-                })
+                dates_dict[date_str]['price'] = min(dates_dict[date_str]['price'], day_price)
+                for trip in day.get('chuyen', []):
+                    dates_dict[date_str]['trips'].append({
+                        'time': trip.get('gioDi', ''),
+                        'trip_id': trip.get('maLichTrinh'),
+                        'status': trip.get('tinhTrang')
+                    })
+                total_trips += day.get('soChuyen', 0)
             
-            available_dates = list(dates_dict.values())
+            dates = list(dates_dict.values())
             
             return jsonify({
-                'dates': available_dates,
+                'dates': dates,
                 'route': tuyen_duong.get('tenTuyenDuong') if tuyen_duong else f"{diem_di} → {diem_den}",
                 'base_price': base_price,
-                'total_trips': len(lich_trinh_list)
+                'total_trips': total_trips
             })
             
         else:
@@ -139,36 +147,14 @@ def search():
     # Base query - tìm theo điểm và trạng thái khả dụng
     query = {
         'ngayDi': {'$gte': today},
-        'tinhTrang': {'$in': ['Sắp chạy', 'Đang chạy', 'Chưa khởi hành', 'Đang chờ']}
+        'tinhTrang': {'$in': ACTIVE_TRIP_STATUSES}
     }
     
     # Tìm theo tuyến đường - hỗ trợ cả mã điểm và tên thành phố
-    tuyen_duong = mongo.db.TuyenDuong.find_one({
-        '$or': [
-            {'diemDau': diem_di, 'diemCuoi': diem_den},
-            {'diemDau': diem_den, 'diemCuoi': diem_di},
-            {'tenTuyenDuong': {'$regex': diem_di, '$options': 'i'}},
-            {'tenTuyenDuong': {'$regex': diem_den, '$options': 'i'}}
-        ]
-    })
+    tuyen_duong = find_route(mongo.db, diem_di, diem_den)
     
     # Match điểm đi/đến - hỗ trợ cả chiều đi và chiều về
-    if tuyen_duong:
-        query['$or'] = [
-            {'diemDi': tuyen_duong.get('diemDau'), 'diemDen': tuyen_duong.get('diemCuoi')},
-            {'diemDi': tuyen_duong.get('diemCuoi'), 'diemDen': tuyen_duong.get('diemDau')},
-            {'diemDi': diem_di, 'diemDen': diem_den},
-            {'diemDi': diem_den, 'diemDen': diem_di}
-        ]
-    else:
-        # Không tìm thấy trong TuyenDuong, search trực tiếp
-        query['$or'] = [
-            {'diemDi': diem_di, 'diemDen': diem_den},
-            {'diemDi': diem_den, 'diemDen': diem_di},
-            # Hỗ trợ tìm theo tên thành phố
-            {'diemDi': {'$regex': diem_di, '$options': 'i'}, 'diemDen': {'$regex': diem_den, '$options': 'i'}},
-            {'diemDi': {'$regex': diem_den, '$options': 'i'}, 'diemDen': {'$regex': diem_di, '$options': 'i'}}
-        ]
+    query['$or'] = route_match(diem_di, diem_den, tuyen_duong)
     
     # Filter theo ngày nếu có
     if ngay_di:
@@ -182,45 +168,43 @@ def search():
         except:
             pass
     
-    # Execute query
-    lich_trinh = list(mongo.db.LichTrinh.find(query).sort('ngayDi', 1))
+    # Execute query - một aggregation gắn sẵn xe, giá vé, ghế trống, phân trang keyset
+    fare_route = tuyen_duong.get('maTuyenDuong') if tuyen_duong else f"{diem_di}-{diem_den}"
+    page = paginate(
+        lambda page_query, sort, limit: search_trips(mongo.db, page_query, fare_route, sort, limit),
+        query, TRIP_PAGE_KEYS, request.args.get('cursor'), per_page=SEARCH_PAGE_SIZE
+    )
+    lich_trinh = page['items']
     
     # Debug log
     print(f"DEBUG Search: {diem_di} → {diem_den}, found {len(lich_trinh)} trips")
     if tuyen_duong:
         print(f"  Matched route: {tuyen_duong.get('tenTuyenDuong')}")
     
-    # Enrich data với thông tin xe và giá vé
+    # Tuyến đường
     for lt in lich_trinh:
-        # Thông tin xe
-        xe = mongo.db.XeKhach.find_one({'maXeKhach': lt.get('maXe')})
-        lt['xe_info'] = xe if xe else {}
-        
-        # Tuyến đường
         if tuyen_duong:
             lt['tuyen_duong'] = tuyen_duong
             lt['tenTuyenDuong'] = tuyen_duong.get('tenTuyenDuong')
         else:
             lt['tenTuyenDuong'] = f"{lt.get('diemDi')} → {lt.get('diemDen')}"
-            
-        # Giá vé
-        gia_ve = mongo.db.GiaVe.find_one({
-            'tuyen': tuyen_duong.get('maTuyenDuong') if tuyen_duong else f"{diem_di}-{diem_den}",
-            'tinhTrang': 'Hoạt động'
-        })
-        lt['gia_ve'] = gia_ve.get('giaVe', 0) if gia_ve else 0
-        
-        # Số ghế còn trống - FIXED: dùng maLichTrinh thay vì maXe
-        booked_seats = mongo.db.VeXe.count_documents({'maLichTrinh': lt.get('maLichTrinh')})
-        total_seats = mongo.db.Ghe.count_documents({'maLichTrinh': lt.get('maLichTrinh')})  # FIX: theo trip, không phải xe
-        lt['ghe_trong'] = max(0, total_seats - booked_seats)
+        lt['gia_ve'] = lt.get('gia_ve') or 0
         
-        # Debug log
-        if lt.get('maLichTrinh', '').startswith('TEST_TRIP'):
-            print(f"Trip {lt.get('maLichTrinh')}: {total_seats} total seats, {booked_seats} booked, {lt['ghe_trong']} available")
+    # Hành trình có một điểm nối (đồ thị trong bộ nhớ) - chỉ ở trang đầu
+    itineraries = []
+    if page['cursor'] is None:
+        try:
+            depart_after = max(current_time, query['ngayDi']['$gte'])
+            depart_before = query['ngayDi'].get('$lte') or today + timedelta(days=2)
+            itineraries = connection_itineraries(mongo.db, diem_di, diem_den, depart_after, depart_before)
+        except Exception as e:
+            print(f"Error finding connections {diem_di} → {diem_den}: {e}")
         
     return render_template('user/search_results.html', 
                           lich_trinh=lich_trinh,
+                          itineraries=itineraries,
+                          next_cursor=page['next_cursor'],
+                          is_first_page=page['cursor'] is None,
                           search_params={
                               'diem_di': diem_di,
                               'diem_den': diem_den, 
@@ -262,35 +246,24 @@ def booking(lich_trinh_id):
     if not lt:
         flash('Lịch trình không tồn tại')
         return redirect(url_for('user.index'))
+    lt = prepare_trip(mongo.db, lt)
         
-    xe = mongo.db.XeKhach.find_one({'maXeKhach': lt.get('maXe')})
+    xe = reference_cache.find_one('XeKhach', {'maXeKhach': lt.get('maXe')})
     if not xe:
         flash('Không tìm thấy thông tin xe')
         return redirect(url_for('user.index'))
     
     # Find route information
-    tuyen_duong = mongo.db.TuyenDuong.find_one({'_id': ObjectId(lt.get('maTuyen'))})
+    tuyen_duong = None
+    if lt.get('maTuyen'):
+        tuyen_duong = reference_cache.find_one('TuyenDuong', {'_id': get_object_id(lt.get('maTuyen'))})
     
-    # Find seats for this trip using maLichTrinh - FIXED SCHEMA
-    ghe_list = list(mongo.db.Ghe.find({'maLichTrinh': lt['maLichTrinh']}))
-    
-    # Find booked seats for this lich trinh
-    booked_tickets = list(mongo.db.VeXe.find({'maLichTrinh': lt['maLichTrinh']}))
-    
-    # Debug log
-    print(f"Booking for trip {lt['maLichTrinh']}: Found {len(ghe_list)} seats, {len(booked_tickets)} bookings")
-    booked_seat_ids = [t.get('maGhe') for t in booked_tickets]
-
-    for ghe in ghe_list:
-        ghe['is_booked'] = ghe.get('maGhe') in booked_seat_ids
-    
-    # Calculate available seats
-    total_seats = len(ghe_list)
-    booked_seats_count = len(booked_tickets)
-    available_seats = total_seats - booked_seats_count
+    # Số ghế trống đọc từ bitmap trên lịch trình (app/occupancy.py) thay cho quét Ghe/VeXe
+    total_seats = lt.get('tongGhe') or 0
+    available_seats = max(0, total_seats - booked_count(lt))
     
     # Get vehicle type info
-    loai_xe = mongo.db.LoaiXe.find_one({'maLoaiXe': xe.get('maLoai', xe.get('loaiXe'))})
+    loai_xe = reference_cache.find_one('LoaiXe', {'maLoaiXe': xe.get('maLoai', xe.get('loaiXe'))})
     
     # Get price information from GiaVe table
     gia_ve = None
@@ -303,7 +276,7 @@ def booking(lich_trinh_id):
         route_patterns = [route_code, f"{lt.get('diemDi')}-{lt.get('diemDen')}", 'VPQ1-VPDL']
         
         for pattern in route_patterns:
-            gia_ve = mongo.db.GiaVe.find_one({
+            gia_ve = reference_cache.find_one('GiaVe', {
                 'tuyen': pattern,
                 'maLoaiXe': vehicle_type
             })
@@ -314,14 +287,14 @@ def booking(lich_trinh_id):
     if not gia_ve:
         if vehicle_type == 'VIP30':
             # For VIP30, prefer 450,000 price
-            gia_ve = mongo.db.GiaVe.find_one({
+            gia_ve = reference_cache.find_one('GiaVe', {
                 'maLoaiXe': vehicle_type,
                 'giaVe': 450000
             })
         
         # If still no specific price found, get any price for this vehicle type
         if not gia_ve:
-            gia_ve = mongo.db.GiaVe.find_one({
+            gia_ve = reference_cache.find_one('GiaVe', {
                 'maLoaiXe': vehicle_type
             })
     
@@ -346,10 +319,10 @@ def booking(lich_trinh_id):
     return render_template('user/booking.html', 
                           lich_trinh=lt, 
                           xe=xe, 
-                          ghe_list=ghe_list,
                           tuyen_duong=tuyen_duong,
                           available_seats=available_seats,
-                          total_seats=total_seats)
+                          total_seats=total_seats,
+                          idempotency_key=uuid4().hex)
 
 @user_bp.route('/profile')
 def profile():
@@ -378,39 +351,24 @@ def my_tickets():
         flash('Không tìm thấy thông tin khách hàng', 'error')
         return redirect(url_for('user.index'))
     
-    # Lấy danh sách vé đã đặt - support cả schema cũ và mới
+    # Một trang vé kèm chuyến, xe, ghế, giá - một aggregation (app/ticket_history.py)
     customer_id_str = str(session['customer_id'])
-    customer_ma_khach = customer.get('maKhach')
-    
-    # Tìm vé theo cả 2 cách: maKhach (string) và maKhachHang (ObjectId)
-    query = {'$or': []}
-    if customer_ma_khach:
-        query['$or'].append({'maKhach': customer_ma_khach})
-    query['$or'].append({'maKhachHang': customer_id_str})
-    query['$or'].append({'maKhachHang': get_object_id(customer_id_str)})
-    
-    tickets = list(mongo.db.VeXe.find(query).sort([('ngayThem', -1), ('ngayDat', -1)]))
-    
-    # Enrich với thông tin lịch trình và xe
-    for ticket in tickets:
-        # Thông tin lịch trình
-        lt = mongo.db.LichTrinh.find_one({'maLichTrinh': ticket.get('maLichTrinh')})
-        if lt:
-            ticket['lich_trinh'] = lt
-            
-            # Thông tin xe
-            xe = mongo.db.XeKhach.find_one({'maXeKhach': lt.get('maXe')})
-            ticket['xe_info'] = xe if xe else {}
-        
-        # Thông tin ghế
-        ghe = mongo.db.Ghe.find_one({'maGhe': ticket.get('maGhe')})
-        ticket['ghe_info'] = ghe if ghe else {}
-        
-        # Thông tin giá vé
-        gia_ve = mongo.db.GiaVe.find_one({'maGiaVe': ticket.get('maGiaVe')})
-        ticket['gia_ve_info'] = gia_ve if gia_ve else {}
-    
-    return render_template('user/my_tickets.html', tickets=tickets, customer=customer)
+    page = ticket_history(mongo.db, owner_filter(customer_id_str, customer.get('maKhach')),
+                          request.args.get('cursor'))
+    tickets = page['items']
+    
+    # Chuyến của các lượt chờ: một $in (app/loaders.py)
+    trips = loader('LichTrinh', 'maLichTrinh')
+    waitlist_entries = waitlist.customer_entries(mongo.db, customer_id_str)
+    if waitlist_entries:
+        trips.prime(entry['maLichTrinh'] for entry in waitlist_entries)
+        for entry in waitlist_entries:
+            entry['lich_trinh'] = trips.load(entry['maLichTrinh']) or {}
+    
+    return render_template('user/my_tickets.html', tickets=tickets, customer=customer,
+                           waitlist_entries=waitlist_entries,
+                           next_cursor=page['next_cursor'],
+                           is_first_page=page['cursor'] is None)
 
 @user_bp.route('/trip-history')
 def trip_history():
@@ -424,40 +382,18 @@ def trip_history():
         flash('Không tìm thấy thông tin khách hàng', 'error')
         return redirect(url_for('user.index'))
     
-    # Lấy lịch sử chuyến đi (vé đã hoàn thành) - support cả schema cũ và mới
-    customer_id_str = str(session['customer_id'])
-    customer_ma_khach = customer.get('maKhach')
-    
-    # Tìm vé hoàn thành theo cả 2 schema
-    customer_query = []
-    if customer_ma_khach:
-        customer_query.append({'maKhach': customer_ma_khach})
-    customer_query.append({'maKhachHang': customer_id_str})
-    
-    query = {
-        '$and': [
-            {'$or': customer_query},
-            {'$or': [
-                {'tinhTrang': {'$in': ['Đã thanh toán', 'Đã hoàn thành']}},
-                {'trangThai': {'$in': ['DaDat', 'DaThanhToan']}}
-            ]}
-        ]
-    }
-    
-    history_tickets = list(mongo.db.VeXe.find(query).sort([('ngayThem', -1), ('ngayDat', -1)]))
-    
-    # Enrich với thông tin chi tiết
-    for ticket in history_tickets:
-        lt = mongo.db.LichTrinh.find_one({'maLichTrinh': ticket.get('maLichTrinh')})
-        if lt:
-            ticket['lich_trinh'] = lt
-            xe = mongo.db.XeKhach.find_one({'maXeKhach': lt.get('maXe')})
-            ticket['xe_info'] = xe if xe else {}
-        
-        ghe = mongo.db.Ghe.find_one({'maGhe': ticket.get('maGhe')})
-        ticket['ghe_info'] = ghe if ghe else {}
-    
-    return render_template('user/trip_history.html', history_tickets=history_tickets, customer=customer)
+    # Vé đã đặt / thanh toán / hoàn thành, cùng read model với my_tickets
+    query = {'$and': [
+        owner_filter(session['customer_id'], customer.get('maKhach')),
+        status_filter(HISTORY_STATES)
+    ]}
+    # Lịch sử gồm cả vé của chuyến đã lưu trữ (app/archive.py)
+    page = ticket_history(mongo.db, query, request.args.get('cursor'), archive=True)
+    history_tickets = page['items']
+    
+    return render_template('user/trip_history.html', history_tickets=history_tickets, customer=customer,
+                           next_cursor=page['next_cursor'],
+                           is_first_page=page['cursor'] is None)
 
 @user_bp.route('/profile/update', methods=['POST'])
 def update_profile():
@@ -495,42 +431,48 @@ def get_seats_api(lich_trinh_id):
     """API để lấy thông tin ghế cho seat map - sử dụng sơ đồ từ SoDoGhe"""
     try:
         # Tìm lịch trình
-        lt = mongo.db.LichTrinh.find_one({'_id': get_object_id(lich_trinh_id)})
+        lt = prepare_trip(mongo.db, mongo.db.LichTrinh.find_one({'_id': get_object_id(lich_trinh_id)}))
         if not lt:
             return jsonify({'error': 'Lịch trình không tồn tại'}), 404
         
         # Tìm thông tin xe (optional)
-        xe = mongo.db.XeKhach.find_one({'maXeKhach': lt.get('maXe')})
+        xe = reference_cache.find_one('XeKhach', {'maXeKhach': lt.get('maXe')})
         
         # Tìm sơ đồ ghế theo loại xe hoặc default
         if xe and xe.get('maLoai'):
             loai_xe = xe.get('maLoai')
-            seat_layout = mongo.db.SoDoGhe.find_one({'maLoaiXe': loai_xe})
+            seat_layout = reference_cache.find_one('SoDoGhe', {'maLoaiXe': loai_xe})
         else:
             # Nếu không tìm thấy xe hoặc loại xe, dùng layout mặc định
             seat_layout = None
         
         if not seat_layout or not seat_layout.get('danhSachGhe'):
             # Fallback to 40-seat layout
-            seat_layout = mongo.db.SoDoGhe.find_one({'maSoDo': 'SD_LT40'})
+            seat_layout = reference_cache.find_one('SoDoGhe', {'maSoDo': 'SD_LT40'})
         
         if not seat_layout:
             return jsonify({'error': 'Không tìm thấy sơ đồ ghế'}), 404
         
-        # Lấy danh sách vé đã đặt
-        booked_tickets = list(mongo.db.VeXe.find({'maLichTrinh': lt['maLichTrinh']}))
-        booked_seat_numbers = [t.get('maGhe') for t in booked_tickets]
-        
-        # Lấy thông tin khách hàng đã đặt
+        # Ghế đã đặt đọc từ bitmap trên lịch trình; vé chỉ cần cho thông tin khách
+        booked_seat_numbers = booked_seats(lt)
+        booked_tickets = []
+        if booked_seat_numbers:
+            booked_tickets = list(mongo.db.VeXe.find(
+                {**active_ticket_filter(lt['maLichTrinh']), 'maGhe': {'$in': list(booked_seat_numbers)}}
+            ))
+        
+        # Ghế khách khác đang giữ chỗ (ghế mình đang giữ vẫn hiện là trống để chọn lại)
+        owner = str(session.get('customer_id', ''))
+        held_seat_numbers = {}
+        if may_have_holds(lt):
+            held_seat_numbers = {seat: hold for seat, hold in active_holds(mongo.db, lt['maLichTrinh']).items()
+                                 if hold.get('nguoiGiu') != owner}
+        
+        # Lấy thông tin khách hàng đã đặt - một $in cho mỗi schema (maKhach / maKhachHang)
         customer_info = {}
+        customers = ticket_customers(booked_tickets)
         for ticket in booked_tickets:
-            # Support both old and new customer schemas
-            customer = None
-            if ticket.get('maKhach'):
-                customer = mongo.db.KhachHang.find_one({'maKhach': ticket.get('maKhach')})
-            elif ticket.get('maKhachHang'):
-                customer = mongo.db.KhachHang.find_one({'_id': get_object_id(ticket.get('maKhachHang'))})
-            
+            customer = customers.get(ticket)
             if customer:
                 customer_info[ticket.get('maGhe')] = {
                     'customerName': customer.get('ten', 'N/A'),
@@ -555,6 +497,13 @@ def get_seats_api(lich_trinh_id):
                     'floor': seat_floor,
                     **customer_info.get(seat_number, {})
                 }
+            elif seat_number in held_seat_numbers:
+                seat_map[seat_number] = {
+                    'status': 'held',
+                    'seatType': seat_type,
+                    'floor': seat_floor,
+                    'heldUntil': held_seat_numbers[seat_number]['hetHan'].strftime('%H:%M:%S')
+                }
             else:
                 seat_map[seat_number] = {
                     'status': 'available',
@@ -583,7 +532,68 @@ def get_seats_api(lich_trinh_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@user_bp.route('/api/seats/<lich_trinh_id>/hold', methods=['POST'])
+def hold_seats_api(lich_trinh_id):
+    """Giữ chỗ các ghế đang chọn trong lúc điền thông tin (gửi danh sách rỗng để trả ghế)"""
+    if 'customer_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Vui lòng đăng nhập để giữ chỗ'}), 401
+    try:
+        lt = prepare_trip(mongo.db, mongo.db.LichTrinh.find_one({'_id': get_object_id(lich_trinh_id)}, OCCUPANCY_FIELDS))
+        if not lt:
+            return jsonify({'status': 'error', 'message': 'Lịch trình không tồn tại'}), 404
+        
+        data = request.get_json(silent=True) or {}
+        seats = list(dict.fromkeys(str(seat).strip() for seat in data.get('seats', []) if str(seat).strip()))
+        if len(seats) > 5:
+            return jsonify({'status': 'error', 'message': 'Chỉ được giữ tối đa 5 ghế'}), 400
+        unknown = invalid_seats(lt, seats)
+        if unknown:
+            return jsonify({'status': 'error', 'message': f'Ghế {", ".join(unknown)} không có trên xe'}), 400
+        
+        owner = str(session['customer_id'])
+        if not seats:
+            release_holds(mongo.db, lt['maLichTrinh'], owner)
+            return jsonify({'status': 'success', 'seats': []})
+        
+        seconds = current_app.config.get('SEAT_HOLD_SECONDS', 600)
+        expires_at, taken = hold_seats(mongo.db, lt['maLichTrinh'], seats, owner, seconds)
+        if taken:
+            return jsonify({
+                'status': 'conflict',
+                'message': f'Ghế {", ".join(taken)} vừa có người khác chọn',
+                'taken': taken
+            }), 409
+        return jsonify({
+            'status': 'success',
+            'seats': seats,
+            'expires_at': expires_at.isoformat(),
+            'seconds': seconds
+        })
+    except Exception as e:
+        print(f"Error in hold_seats_api: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@user_bp.route('/api/seats/<lich_trinh_id>/stream')
+def seat_stream(lich_trinh_id):
+    """SSE: đẩy thay đổi trạng thái ghế của chuyến thay cho việc gọi lại /api/seats"""
+    lt = prepare_trip(mongo.db, mongo.db.LichTrinh.find_one({'_id': get_object_id(lich_trinh_id)}, OCCUPANCY_FIELDS))
+    if not lt:
+        return jsonify({'error': 'Lịch trình không tồn tại'}), 404
+    
+    holds = active_holds(mongo.db, lt['maLichTrinh']) if may_have_holds(lt) else {}
+    owner = str(session['customer_id']) if 'customer_id' in session else None
+    subscription = seat_events.subscribe(mongo.db, lt, holds, owner)
+    return Response(seat_events.stream(subscription), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # nginx: không gom buffer, gửi sự kiện ngay
+    })
+
+def _booking_pending():
+    flash('Đơn đặt vé của bạn đang được xử lý, vui lòng kiểm tra lại danh sách vé', 'info')
+    return redirect(url_for('user.my_tickets'))
+
 @user_bp.route('/booking/confirm', methods=['POST'])
+@idempotent('booking', on_pending=_booking_pending)
 def confirm_booking():
     # Check if customer logged in
     if 'customer_id' not in session:
@@ -598,8 +608,8 @@ def confirm_booking():
         flash('Vui lòng chọn ít nhất 1 ghế!', 'error')
         return redirect(request.referrer or url_for('user.index'))
     
-    # Parse selected seats
-    seat_list = [seat.strip() for seat in selected_seats.split(',') if seat.strip()]
+    # Parse selected seats (bỏ ghế chọn trùng)
+    seat_list = list(dict.fromkeys(seat.strip() for seat in selected_seats.split(',') if seat.strip()))
     
     # Check seat limit
     if len(seat_list) > 5:
@@ -613,82 +623,146 @@ def confirm_booking():
         return redirect(url_for('user.index'))
     
     # Get lich trinh info  
-    lt = mongo.db.LichTrinh.find_one({'_id': get_object_id(lich_trinh_id)})
+    lt = prepare_trip(mongo.db, mongo.db.LichTrinh.find_one({'_id': get_object_id(lich_trinh_id)}))
     if not lt:
         flash('Không tìm thấy lịch trình', 'error')
         return redirect(url_for('user.index'))
     
-    # Check if any seat is already booked
-    for seat in seat_list:
-        existing_ticket = mongo.db.VeXe.find_one({
-            'maLichTrinh': lt['maLichTrinh'],
-            'maGhe': seat
-        })
-        if existing_ticket:
-            flash(f'Ghế {seat} đã được đặt, vui lòng chọn ghế khác!', 'error')
-            return redirect(request.referrer or url_for('user.index'))
+    # Chỉ nhận ghế có trong sơ đồ của chuyến
+    unknown = invalid_seats(lt, seat_list)
+    if unknown:
+        flash(f'Ghế {", ".join(unknown)} không có trên xe này!', 'error')
+        return redirect(request.referrer or url_for('user.index'))
     
     # Get pricing info
-    gia_ve = mongo.db.GiaVe.find_one({
+    gia_ve = reference_cache.find_one('GiaVe', {
         'tuyen': f"{lt.get('diemDi')}-{lt.get('diemDen')}"
     })
     
-    # Generate booking batch ID
-    import time
-    batch_id = f"DV{int(time.time())}"
+    # Mã đặt vé và mã vé lấy từ bộ đếm (app/ids.py) - không trùng khi đặt cùng lúc
+    batch_id = id_allocator.next_id(mongo.db, 'maDatVe')
+    ticket_ids = id_allocator.next_ids(mongo.db, 'maVe', len(seat_list))
+    
+    # Tạo cả lô vé - ghế đã có người đặt bị index unique (maLichTrinh, maGhe) từ chối
+    tickets = []
+    for i, seat in enumerate(seat_list):
+        tickets.append({
+            'maVe': ticket_ids[i],
+            'maLichTrinh': lt['maLichTrinh'],
+            'maGhe': seat,
+            'maGiaVe': gia_ve.get('maGiaVe') if gia_ve else None,
+            'maKhach': customer.get('maKhach'),  # Old schema compatibility
+            'maKhachHang': str(session['customer_id']),  # New schema
+            'maDatVe': batch_id,  # Same batch ID for all tickets in this booking
+            'ngayThem': datetime.now(),
+            'ngayDat': datetime.now(),
+            'nguoiThem': customer.get('maKhach'),
+            'tinhTrang': 'Chờ thanh toán',  # Old schema
+            'trangThai': 'DaDat'  # New schema
+        })
     
-    # Create multiple tickets
-    tickets_created = []
+    # Chốt giữ chỗ trước khi ghi vé: gia hạn giữ chỗ của mình, từ chối ghế người khác đang giữ
+    owner = str(session['customer_id'])
     try:
-        for i, seat in enumerate(seat_list):
-            ticket_id = f"VX{int(time.time())}_{i+1}"
-            
-            ve_data = {
-                'maVe': ticket_id,
-                'maLichTrinh': lt['maLichTrinh'],
-                'maGhe': seat,
-                'maGiaVe': gia_ve.get('maGiaVe') if gia_ve else None,
-                'maKhach': customer.get('maKhach'),  # Old schema compatibility
-                'maKhachHang': str(session['customer_id']),  # New schema
-                'maDatVe': batch_id,  # Same batch ID for all tickets in this booking
-                'ngayThem': datetime.now(),
-                'ngayDat': datetime.now(),
-                'nguoiThem': customer.get('maKhach'),
-                'tinhTrang': 'Chờ thanh toán',  # Old schema
-                'trangThai': 'DaDat'  # New schema
-            }
-            
-            result = mongo.db.VeXe.insert_one(ve_data)
-            if result.inserted_id:
-                tickets_created.append(ticket_id)
-            else:
-                raise Exception(f"Không thể tạo vé cho ghế {seat}")
-        
-        # Success message
-        seat_text = ', '.join(seat_list)
-        flash(f'Đặt vé thành công! {len(tickets_created)} vé cho các ghế: {seat_text}', 'success')
-        return redirect(url_for('user.my_tickets'))
-        
+        _, taken_seats = hold_seats(mongo.db, lt['maLichTrinh'], seat_list, owner,
+                                    current_app.config.get('SEAT_HOLD_SECONDS', 600))
+        if not taken_seats:
+            taken_seats = book_seats(mongo.db, tickets)
+            if taken_seats:
+                release_holds(mongo.db, lt['maLichTrinh'], owner, seat_list)
     except Exception as e:
-        # If there's an error, try to clean up any created tickets
-        if tickets_created:
-            mongo.db.VeXe.delete_many({'maVe': {'$in': tickets_created}})
-        
         flash(f'Lỗi đặt vé: {str(e)}', 'error')
         return redirect(request.referrer or url_for('user.index'))
+    
+    if taken_seats:
+        flash(f'Ghế {", ".join(taken_seats)} đã được đặt, vui lòng chọn ghế khác!', 'error')
+        return redirect(request.referrer or url_for('user.index'))
+    
+    convert_holds(mongo.db, lt['maLichTrinh'], seat_list, owner)
+    waitlist.mark_booked(mongo.db, lt['maLichTrinh'], owner)
+    
+    # Success message
+    seat_text = ', '.join(seat_list)
+    flash(f'Đặt vé thành công! {len(tickets)} vé cho các ghế: {seat_text}', 'success')
+    return redirect(url_for('user.my_tickets'))
+
+@user_bp.route('/waitlist/<lich_trinh_id>', methods=['POST'])
+def join_waitlist(lich_trinh_id):
+    """Đăng ký chờ chuyến đã hết chỗ - được giữ chỗ tự động khi có ghế trống"""
+    if 'customer_id' not in session:
+        flash('Vui lòng đăng nhập để đăng ký chờ', 'warning')
+        return redirect(url_for('auth.login'))
+    
+    lt = mongo.db.LichTrinh.find_one({'_id': get_object_id(lich_trinh_id)}, {'maLichTrinh': 1})
+    if not lt:
+        flash('Lịch trình không tồn tại', 'error')
+        return redirect(request.referrer or url_for('user.index'))
+    
+    seat_count = min(max(request.form.get('so_ghe', 1, type=int) or 1, 1), 5)
+    try:
+        entry = waitlist.join(mongo.db, lt['maLichTrinh'], str(session['customer_id']), seat_count)
+    except waitlist.AlreadyWaiting:
+        flash('Bạn đã có trong danh sách chờ của chuyến này', 'info')
+        return redirect(url_for('user.my_tickets'))
+    except waitlist.TripClosed:
+        flash('Chuyến này không còn nhận đặt vé', 'warning')
+        return redirect(request.referrer or url_for('user.index'))
+    except waitlist.SeatsAvailable:
+        flash(f'Chuyến vẫn còn {seat_count} ghế trống - bạn có thể đặt vé ngay', 'info')
+        return redirect(url_for('user.booking', lich_trinh_id=lt['maLichTrinh']))
+    
+    flash(f'Đã đăng ký chờ {seat_count} ghế. Có {waitlist.ahead_of(mongo.db, entry)} người chờ trước bạn; '
+          f'khi có ghế trống, ghế sẽ được giữ cho bạn.', 'success')
+    return redirect(url_for('user.my_tickets'))
+
+@user_bp.route('/waitlist/<ma_lich_trinh>/leave', methods=['POST'])
+def leave_waitlist(ma_lich_trinh):
+    if 'customer_id' not in session:
+        return redirect(url_for('auth.login'))
+    if waitlist.leave(mongo.db, ma_lich_trinh, str(session['customer_id'])):
+        flash('Đã rời danh sách chờ', 'success')
+    return redirect(url_for('user.my_tickets'))
+
+@user_bp.route('/my-tickets/cancel/<ma_ve>', methods=['POST'])
+def cancel_my_ticket(ma_ve):
+    """Khách hàng hủy vé của mình - trả ghế về cho chuyến"""
+    if 'customer_id' not in session:
+        flash('Vui lòng đăng nhập để hủy vé', 'warning')
+        return redirect(url_for('auth.login'))
+    
+    ticket = cancel_ticket(mongo.db, {'maVe': ma_ve, **owner_filter(session['customer_id'], session.get('ma_khach'))})
+    if ticket:
+        flash(f'Đã hủy vé {ma_ve}', 'success')
+    else:
+        flash('Không tìm thấy vé hoặc vé đã được hủy', 'error')
+    return redirect(url_for('user.my_tickets'))
 
 @user_bp.route('/routes')
+@response_cache.cached(ttl=30, depends=('LichTrinh', 'TuyenDuong', 'GiaVe', 'XeKhach'))
 def routes():
     """Hiển thị tất cả tuyến đường và chuyến xe khả dụng"""
     try:
         current_time = datetime.now()
         today = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
         
-        # Lấy tất cả chuyến xe khả dụng
-        available_trips = list(mongo.db.LichTrinh.find({
-            'ngayDi': {'$gte': today},
-            'tinhTrang': {'$in': ['Sắp chạy', 'Đang chạy', 'Chưa khởi hành', 'Đang chờ']}
-        }).sort('ngayDi', 1))
+        # Chuyến xe khả dụng theo trang (keyset) - đã gắn xe, giá vé, ghế trống
+        page = paginate(
+            lambda page_query, sort, limit: search_trips(mongo.db, page_query, sort=sort, limit=limit),
+            {'ngayDi': {'$gte': today}, 'tinhTrang': {'$in': ACTIVE_TRIP_STATUSES}},
+            TRIP_PAGE_KEYS, request.args.get('cursor'), per_page=ROUTES_PAGE_SIZE
+        )
+        available_trips = page['items']
+        
+        # Thông tin tuyến trong TuyenDuong (nếu có) - một truy vấn cho mọi cặp điểm
+        route_pairs = {(trip.get('diemDi', ''), trip.get('diemDen', '')) for trip in available_trips}
+        tuyen_by_pair = {}
+        if route_pairs:
+            pair_filters = []
+            for diem_di, diem_den in route_pairs:
+                pair_filters.append({'diemDau': diem_di, 'diemCuoi': diem_den})
+                pair_filters.append({'diemDau': diem_den, 'diemCuoi': diem_di})
+            for tuyen in mongo.db.TuyenDuong.find({'$or': pair_filters}):
+                tuyen_by_pair.setdefault((tuyen.get('diemDau'), tuyen.get('diemCuoi')), tuyen)
         
         # Nhóm trips theo tuyến đường (diemDi → diemDen)
         routes_dict = {}
@@ -699,13 +773,7 @@ def routes():
             route_key = f"{diem_di}_{diem_den}"
             
             if route_key not in routes_dict:
-                # Tìm thông tin tuyến trong TuyenDuong (nếu có)
-                tuyen_info = mongo.db.TuyenDuong.find_one({
-                    '$or': [
-                        {'diemDau': diem_di, 'diemCuoi': diem_den},
-                        {'diemDau': diem_den, 'diemCuoi': diem_di}
-                    ]
-                })
+                tuyen_info = tuyen_by_pair.get((diem_di, diem_den)) or tuyen_by_pair.get((diem_den, diem_di))
                 
                 routes_dict[route_key] = {
                     'tuyen': tuyen_info if tuyen_info else {
@@ -717,26 +785,10 @@ def routes():
                     'trips': []
                 }
             
-            # Thông tin xe
-            xe = mongo.db.XeKhach.find_one({'maXeKhach': trip.get('maXe')})
-            trip['xe_info'] = xe if xe else {}
-            
-            # Giá vé
-            gia_ve = mongo.db.GiaVe.find_one({
-                'tinhTrang': {'$in': ['Hoạt động', 'Đang áp dụng']}
-            }) if xe else None
-            
-            # Fallback giá VIP30 nếu không tìm thấy
-            if not gia_ve and xe and xe.get('maLoai') == 'VIP30':
-                trip['gia_ve'] = 450000
-            else:
-                trip['gia_ve'] = gia_ve.get('giaVe', 350000) if gia_ve else 350000
-            
-            # Số ghế còn trống
-            booked_seats = mongo.db.VeXe.count_documents({'maLichTrinh': trip.get('maLichTrinh')})
-            total_seats = mongo.db.Ghe.count_documents({'maLichTrinh': trip.get('maLichTrinh')})
-            trip['ghe_trong'] = max(0, total_seats - booked_seats)
-            trip['total_seats'] = total_seats
+            # Giá vé - fallback giá VIP30 nếu không tìm thấy
+            if not trip.get('gia_ve'):
+                xe = trip.get('xe_info') or {}
+                trip['gia_ve'] = 450000 if xe.get('maLoai') == 'VIP30' else 350000
             
             routes_dict[route_key]['trips'].append(trip)
         
@@ -750,7 +802,10 @@ def routes():
             print(f"DEBUG: First route: {routes_with_trips[0]['tuyen'].get('tenTuyenDuong')}")
             print(f"DEBUG: First route trips count: {len(routes_with_trips[0]['trips'])}")
         
-        return render_template('user/routes.html', routes_with_trips=routes_with_trips)
+        return render_template('user/routes.html',
+                               routes_with_trips=routes_with_trips,
+                               next_cursor=page['next_cursor'],
+                               is_first_page=page['cursor'] is None)
         
     except Exception as e:
         print(f"Error in routes(): {e}")
@@ -760,11 +815,13 @@ def routes():
         return redirect(url_for('user.index'))
 
 @user_bp.route('/news')
+@response_cache.cached(ttl=300, depends=('TinTuc',))
 def news():
     tin_tuc = list(mongo.db.TinTuc.find())
     return render_template('user/news.html', tin_tuc=tin_tuc)
 
 @user_bp.route('/news/<news_id>')
+@response_cache.cached(ttl=300, depends=('TinTuc',))
 def news_detail(news_id):
     tin = mongo.db.TinTuc.find_one({'_id': get_object_id(news_id)})
     return render_template('user/news_detail.html', tin=tin)
@@ -0,0 +1,120 @@
+"""
+Tìm kiếm chuyến xe bằng một aggregation duy nhất.
+
+`search_trips` trả về lịch trình đã gắn sẵn thông tin xe (`xe_info`), giá vé
+(`gia_ve`, None nếu không có) và số ghế (`total_seats`, `ghe_trong`, đọc từ bộ
+đếm tongGhe/soGheDaDat - xem app/seats.py), thay cho việc gọi
+find_one/count_documents cho từng chuyến. Số round trip không phụ thuộc số
+chuyến tìm được. Chuyến có từ trước chưa có bộ đếm / bitmap (bitmapSanSang) được
+dựng một lần bằng app/seats.prepare_trips trước khi trả về.
+"""
+
+from app.normalize import prefix_match
+from app.occupancy import bitmap_ready
+
+# Trạng thái lịch trình còn bán vé
+ACTIVE_TRIP_STATUSES = ['Sắp chạy', 'Đang chạy', 'Chưa khởi hành', 'Đang chờ']
+
+# Trạng thái giá vé đang áp dụng
+ACTIVE_FARE_STATUSES = ['Hoạt động', 'Đang áp dụng']
+
+
+def route_query(diem_di, diem_den):
+    """Điều kiện tìm TuyenDuong - khớp tiền tố không dấu của điểm đầu/cuối, cả hai chiều"""
+    di_key, den_key = prefix_match(diem_di), prefix_match(diem_den)
+    return {
+        '$or': [
+            {'diemDau': diem_di, 'diemCuoi': diem_den},
+            {'diemDau': diem_den, 'diemCuoi': diem_di},
+            {'diemDauKey': di_key, 'diemCuoiKey': den_key},
+            {'diemDauKey': den_key, 'diemCuoiKey': di_key}
+        ]
+    }
+
+
+def find_route(db, diem_di, diem_den):
+    """Tìm tuyến đường phù hợp - hỗ trợ cả mã điểm và tên thành phố"""
+    return db.TuyenDuong.find_one(route_query(diem_di, diem_den))
+
+
+def route_match(diem_di, diem_den, tuyen_duong=None):
+    """Điều kiện $or khớp điểm đi/đến - cả chiều đi và chiều về"""
+    conditions = [
+        {'diemDi': diem_di, 'diemDen': diem_den},
+        {'diemDi': diem_den, 'diemDen': diem_di}
+    ]
+    if tuyen_duong:
+        conditions += [
+            {'diemDi': tuyen_duong.get('diemDau'), 'diemDen': tuyen_duong.get('diemCuoi')},
+            {'diemDi': tuyen_duong.get('diemCuoi'), 'diemDen': tuyen_duong.get('diemDau')}
+        ]
+    else:
+        # Không có trong TuyenDuong: khớp tiền tố không dấu, hỗ trợ tên thành phố
+        di_key, den_key = prefix_match(diem_di), prefix_match(diem_den)
+        conditions += [
+            {'diemDiKey': di_key, 'diemDenKey': den_key},
+            {'diemDiKey': den_key, 'diemDenKey': di_key}
+        ]
+    return conditions
+
+
+def trip_pipeline(query, fare_route=None, sort=None, limit=None):
+    """
+    Pipeline: $match lịch trình rồi $lookup XeKhach, GiaVe.
+
+    fare_route: mã tuyến dùng tra giá cho mọi chuyến; mặc định mỗi chuyến
+    tra theo "diemDi-diemDen" của chính nó.
+    """
+    fare_key = {'$literal': fare_route} if fare_route else {'$concat': [
+        {'$ifNull': ['$diemDi', '']}, '-', {'$ifNull': ['$diemDen', '']}
+    ]}
+
+    pipeline = [{'$match': query}, {'$sort': sort or {'ngayDi': 1}}]
+    if limit:
+        pipeline.append({'$limit': limit})
+
+    pipeline += [
+        {'$lookup': {
+            'from': 'XeKhach', 'localField': 'maXe', 'foreignField': 'maXeKhach', 'as': 'xe_info'
+        }},
+        {'$addFields': {'_fareKey': fare_key}},
+        {'$lookup': {
+            'from': 'GiaVe', 'localField': '_fareKey', 'foreignField': 'tuyen', 'as': '_giaVe'
+        }},
+        {'$addFields': {
+            'xe_info': {'$ifNull': [{'$arrayElemAt': ['$xe_info', 0]}, {}]},
+            'gia_ve': {'$arrayElemAt': [
+                {'$map': {
+                    'input': {'$filter': {
+                        'input': '$_giaVe', 'as': 'g',
+                        'cond': {'$in': ['$$g.tinhTrang', ACTIVE_FARE_STATUSES]}
+                    }},
+                    'as': 'g', 'in': '$$g.giaVe'
+                }}, 0
+            ]},
+            'total_seats': {'$ifNull': ['$tongGhe', 0]},
+            'booked_seats': {'$ifNull': ['$soGheDaDat', 0]},
+        }},
+        {'$addFields': {
+            'ghe_trong': {'$max': [0, {'$subtract': ['$total_seats', '$booked_seats']}]}
+        }},
+        {'$project': {'_fareKey': 0, '_giaVe': 0}},
+    ]
+    return pipeline
+
+
+def search_trips(db, query, fare_route=None, sort=None, limit=None):
+    """Chạy trip_pipeline và trả về danh sách lịch trình đã enrich"""
+    trips = list(db.LichTrinh.aggregate(trip_pipeline(query, fare_route, sort, limit)))
+    if all(bitmap_ready(trip) for trip in trips):
+        return trips
+
+    # Chuyến cũ: tongGhe/soGheDaDat chưa có hoặc chưa tính vé có từ trước
+    from app.seats import prepare_trips
+
+    trips = prepare_trips(db, trips)
+    for trip in trips:
+        trip['total_seats'] = trip.get('tongGhe') or 0
+        trip['booked_seats'] = trip.get('soGheDaDat') or 0
+        trip['ghe_trong'] = max(0, trip['total_seats'] - trip['booked_seats'])
+    return trips
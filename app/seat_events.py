@@ -0,0 +1,328 @@
+"""
+Đẩy thay đổi trạng thái ghế tới trang đặt vé qua Server-Sent Events.
+
+    GET /api/seats/<lich_trinh_id>/stream  (text/event-stream)
+
+Mỗi process giữ trạng thái ghế của các chuyến đang có người xem (ghế đã đặt,
+ghế đang giữ: người giữ + hạn). Đặt / hủy vé (app/seats.py) và giữ / trả chỗ
+(app/holds.py) gọi `seat_events.booked(...)` / `seat_events.held(...)`; chuyến
+không có ai xem thì bỏ qua ngay. Mỗi kết nối nhận:
+
+    event: snapshot   - toàn bộ ghế khi mới kết nối (hoặc sau khi bị tràn hàng đợi)
+    event: seats      - chỉ các ghế vừa đổi: {"seats": {"A01": "occupied", ...}}
+
+Trạng thái được tính theo người xem: ghế chính mình giữ hiện là available.
+
+Nhiều worker: nếu MongoDB chạy replica set, một thread theo dõi change stream
+của LichTrinh (bitGheDaDat / bitGheDangGiu - app/occupancy.py) và áp thay đổi
+từ process khác vào cùng trạng thái; thay đổi đã biết không sinh sự kiện lặp.
+MongoDB standalone không có change stream - khi đó chỉ có sự kiện trong process.
+Lỗi khác (mất kết nối, failover) thì thread mở lại stream sau một khoảng chờ
+tăng dần, tiếp tục từ resume token cuối cùng; trạng thái ở stats().
+
+Mỗi kết nối SSE giữ một request mở; chạy bằng `python run.py` (gevent nếu đã
+cài) để các stream là greenlet thay vì chiếm thread worker.
+"""
+
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo.errors import OperationFailure
+
+from app.occupancy import BOOKED_BITS, HELD_BITS, POSITIONS_FIELD, booked_seats, seats_in
+
+# Mã lỗi MongoDB: change stream chỉ có trên replica set; resume token quá cũ (oplog đã xoay vòng)
+CHANGE_STREAM_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = (280, 286)
+# Chờ giữa hai lần mở lại change stream (giây): gấp đôi sau mỗi lỗi, tối đa WATCH_MAX_BACKOFF
+WATCH_MIN_BACKOFF = 1
+WATCH_MAX_BACKOFF = 60
+
+
+class _TripState:
+    __slots__ = ('seats', 'booked', 'held', 'held_bits', 'subscribers')
+
+    def __init__(self, seats, booked, held, held_bits):
+        self.seats = list(seats)    # thứ tự hiển thị / snapshot
+        self.booked = set(booked)
+        self.held = dict(held)      # maGhe -> (nguoiGiu hoặc None, hetHan)
+        self.held_bits = set(held_bits)  # bitGheDangGiu lần cuối đọc từ document
+        self.subscribers = set()
+
+
+class Subscription:
+    def __init__(self, bus, ma_lich_trinh, owner, maxsize):
+        self.bus = bus
+        self.ma_lich_trinh = ma_lich_trinh
+        self.owner = owner
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def push(self, seats):
+        try:
+            self.queue.put_nowait(seats)
+        except queue.Full:
+            self.overflowed = True  # Client chậm: gửi lại snapshot thay cho các delta bị bỏ
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class SeatEventBus:
+    def __init__(self, heartbeat=15, queue_size=100, hold_seconds=600):
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self.hold_seconds = hold_seconds
+        self.change_stream = True
+        self._trips = {}  # maLichTrinh -> _TripState
+        self._lock = threading.Lock()
+        self._watcher = None
+        self.published = 0
+        self.watcher_state = 'off'   # off | running | retrying | unsupported
+        self.watcher_restarts = 0
+        self.watcher_error = None
+        self._resume_token = None
+
+    def init_app(self, app):
+        self.heartbeat = app.config.get('SEAT_EVENTS_HEARTBEAT', self.heartbeat)
+        self.queue_size = app.config.get('SEAT_EVENTS_QUEUE_SIZE', self.queue_size)
+        self.hold_seconds = app.config.get('SEAT_HOLD_SECONDS', self.hold_seconds)
+        self.change_stream = app.config.get('SEAT_EVENTS_CHANGE_STREAM', True)
+
+    # ---- Đăng ký người xem ----
+
+    def subscribe(self, db, trip, holds, owner=None):
+        """
+        Mở một subscription cho chuyến `trip` (document có các trường bitmap).
+        `holds` là giữ chỗ đang hiệu lực ({maGhe: document GiuCho}), dùng khi
+        chuyến chưa được theo dõi trong process này.
+        """
+        code = trip['maLichTrinh']
+        subscription = Subscription(self, code, owner, self.queue_size)
+        with self._lock:
+            state = self._trips.get(code)
+            if state is None:
+                held = {seat: (hold.get('nguoiGiu'), hold['hetHan']) for seat, hold in holds.items()}
+                state = self._trips[code] = _TripState(trip.get(POSITIONS_FIELD) or [], booked_seats(trip), held,
+                                                        seats_in(trip, HELD_BITS))
+            state.subscribers.add(subscription)
+        if self.change_stream:
+            self._ensure_watcher(db)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            state = self._trips.get(subscription.ma_lich_trinh)
+            if state is None:
+                return
+            state.subscribers.discard(subscription)
+            if not state.subscribers:
+                del self._trips[subscription.ma_lich_trinh]
+
+    # ---- Nguồn sự kiện ----
+
+    def _publish(self, ma_lich_trinh, update):
+        """Áp `update(state)` (trả về tập ghế thực sự đổi) và báo cho người xem"""
+        with self._lock:
+            state = self._trips.get(ma_lich_trinh)
+            if state is None:
+                return
+            changed = update(state)
+            if not changed:
+                return
+            for seat in changed:
+                if seat not in state.seats:
+                    state.seats.append(seat)
+            subscribers = list(state.subscribers)
+            self.published += 1
+        for subscription in subscribers:
+            subscription.push(changed)
+
+    def booked(self, ma_lich_trinh, seats, is_booked=True):
+        """Ghế có vé (is_booked) hoặc vừa được trả"""
+        def update(state):
+            changed = {seat for seat in seats if seat and (seat in state.booked) != is_booked}
+            if is_booked:
+                state.booked |= changed
+            else:
+                state.booked -= changed
+            return changed
+        self._publish(ma_lich_trinh, update)
+
+    def held(self, ma_lich_trinh, seats, owner=None, expires_at=None):
+        """Ghế được giữ (expires_at) hoặc được trả (expires_at = None)"""
+        def update(state):
+            changed = set()
+            for seat in seats:
+                if expires_at is None:
+                    if state.held.pop(seat, None) is not None:
+                        changed.add(seat)
+                else:
+                    current = state.held.get(seat)
+                    if current is None or current[0] != owner:
+                        changed.add(seat)
+                    state.held[seat] = (owner, expires_at)
+            return changed
+        self._publish(ma_lich_trinh, update)
+
+    def _apply_document(self, trip):
+        """Thay đổi từ change stream: so bitmap mới với trạng thái đang biết"""
+        booked = booked_seats(trip)
+        held = seats_in(trip, HELD_BITS)
+        expires_at = datetime.now() + timedelta(seconds=self.hold_seconds)
+
+        def update(state):
+            changed = booked ^ state.booked
+            state.booked = set(booked)
+            # Chỉ áp các bit vừa đổi: bit giữ chỗ đã hết hạn có thể còn bật rất lâu
+            for seat in state.held_bits - held:
+                if state.held.pop(seat, None) is not None:
+                    changed.add(seat)
+            for seat in held - state.held_bits:
+                if seat not in state.held:
+                    state.held[seat] = (None, expires_at)  # Không biết người giữ
+                    changed.add(seat)
+            state.held_bits = held
+            return changed
+        self._publish(trip.get('maLichTrinh'), update)
+
+    # ---- Change stream (nhiều process) ----
+
+    def _ensure_watcher(self, db):
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch, args=(db,), daemon=True)
+        self._watcher.start()
+
+    def _watch(self, db):
+        """Theo dõi change stream đến khi process dừng; lỗi thì mở lại từ resume token"""
+        backoff = WATCH_MIN_BACKOFF
+        while True:
+            try:
+                self._follow(db)
+                # Stream tự đóng (invalidate): token cũ không dùng lại được
+                self._resume_token = None
+                error = 'change stream closed'
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_UNSUPPORTED:
+                    # MongoDB standalone - chỉ dùng sự kiện trong process
+                    print(f"Seat change stream unavailable: {e}")
+                    self.watcher_state, self.watcher_error = 'unsupported', str(e)
+                    return
+                if e.code in CHANGE_STREAM_HISTORY_LOST:
+                    self._resume_token = None
+                error = str(e)
+            except Exception as e:
+                # Mất kết nối, failover, ... - không để thread dừng hẳn
+                error = str(e)
+            if self.watcher_state == 'running':
+                backoff = WATCH_MIN_BACKOFF
+            print(f"Seat change stream failed, retrying in {backoff}s: {error}")
+            self.watcher_state, self.watcher_error = 'retrying', error
+            self.watcher_restarts += 1
+            time.sleep(backoff)
+            backoff = min(backoff * 2, WATCH_MAX_BACKOFF)
+
+    def _follow(self, db):
+        """Đọc change stream từ resume token cuối cùng (ghi lại sau mỗi thay đổi)"""
+        pipeline = [{'$match': {'operationType': 'update'}}]
+        projection = {'maLichTrinh': 1, POSITIONS_FIELD: 1, BOOKED_BITS: 1, HELD_BITS: 1}
+        with db.LichTrinh.watch(pipeline, full_document='updateLookup', resume_after=self._resume_token) as stream:
+            self.watcher_state = 'running'
+            if self._resume_token is None and self.watcher_restarts:
+                # Không tiếp tục được từ token: đọc lại các chuyến đang xem để không sót thay đổi
+                with self._lock:
+                    codes = list(self._trips)
+                for trip in db.LichTrinh.find({'maLichTrinh': {'$in': codes}}, projection):
+                    self._apply_document(trip)
+            for change in stream:
+                self._resume_token = stream.resume_token
+                updated = change.get('updateDescription', {}).get('updatedFields', {})
+                # $bit trên từng word ghi 'bitGheDaDat.0', ... hoặc cả trường khi dựng lại
+                if not any(key.split('.')[0] in (BOOKED_BITS, HELD_BITS) for key in updated):
+                    continue
+                trip = change.get('fullDocument')
+                if trip and trip.get('maLichTrinh') in self._trips:
+                    self._apply_document({key: trip.get(key) for key in projection})
+
+    # ---- Định dạng SSE ----
+
+    def _statuses(self, state, seats, owner, now):
+        statuses = {}
+        for seat in seats:
+            if seat in state.booked:
+                statuses[seat] = 'occupied'
+            elif seat in state.held and state.held[seat][1] > now and (
+                    state.held[seat][0] is None or state.held[seat][0] != owner):
+                statuses[seat] = 'held'
+            else:
+                statuses[seat] = 'available'
+        return statuses
+
+    def _render(self, subscription, seats=None):
+        now = datetime.now()
+        with self._lock:
+            state = self._trips.get(subscription.ma_lich_trinh)
+            if state is None:
+                return {}
+            return self._statuses(state, state.seats if seats is None else seats, subscription.owner, now)
+
+    def _expired(self, subscription, since, now):
+        """Giữ chỗ hết hạn trong (since, now] - TTL không sinh sự kiện nên tự kiểm tra"""
+        with self._lock:
+            state = self._trips.get(subscription.ma_lich_trinh)
+            if state is None:
+                return set()
+            return {seat for seat, (_, expires_at) in state.held.items() if since < expires_at <= now}
+
+    @staticmethod
+    def _event(name, event_id, data):
+        return f"event: {name}\nid: {event_id}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def stream(self, subscription):
+        """Generator SSE cho một subscription; đóng subscription khi client ngắt"""
+        event_id = 0
+        try:
+            yield f"retry: {int(self.heartbeat * 1000)}\n\n"
+            yield self._event('snapshot', event_id, {'seats': self._render(subscription)})
+            last_check = datetime.now()
+            while True:
+                try:
+                    changed = subscription.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    changed = None
+                now = datetime.now()
+                expired = self._expired(subscription, last_check, now)
+                last_check = now
+                event_id += 1
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    with subscription.queue.mutex:
+                        subscription.queue.queue.clear()
+                    yield self._event('snapshot', event_id, {'seats': self._render(subscription)})
+                elif changed or expired:
+                    seats = (changed or set()) | expired
+                    yield self._event('seats', event_id, {'seats': self._render(subscription, seats)})
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            subscription.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'trips': len(self._trips),
+                'subscribers': sum(len(state.subscribers) for state in self._trips.values()),
+                'published': self.published,
+                'change_stream': self.watcher_state == 'running',
+                'change_stream_state': self.watcher_state,
+                'change_stream_restarts': self.watcher_restarts,
+                'change_stream_error': self.watcher_error,
+            }
+
+
+seat_events = SeatEventBus()
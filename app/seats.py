@@ -0,0 +1,369 @@
+"""
+Bộ đếm ghế lưu trực tiếp trên LichTrinh.
+
+    tongGhe     - tổng số ghế của chuyến (đặt khi tạo ghế)
+    soGheDaDat  - số vé còn hiệu lực (không tính vé đã hủy)
+
+Đặt vé / hủy vé cập nhật bằng $inc nên các trang danh sách đọc số ghế trống
+ngay trên document lịch trình. `reconcile_seat_counters` đếm lại từ Ghe/VeXe
+để sửa sai lệch (và backfill cho lịch trình / vé cũ):
+    python -m app.seats
+
+Vé còn hiệu lực có giuGhe = True; index unique một phần (maLichTrinh, maGhe,
+giuGhe) chỉ chứa các vé này nên hai vé không thể cùng giữ một ghế, còn vé đã
+hủy (giuGhe = False) không chặn ghế. `book_seats` ghi cả lô vé bằng một
+insert_many và xóa lại phần đã ghi nếu có ghế bị trùng.
+
+Vé có từ trước chưa có giuGhe nên index chưa chặn được ghế của chúng. Lần đầu
+một chuyến được đọc (tìm kiếm, danh sách, sơ đồ ghế) hay giữ chỗ / đặt vé,
+`prepare_trip(s)` ghi giuGhe cho vé cũ của chuyến và dựng lại bộ đếm + bitmap
+(bitmapSanSang) - không phải chờ ai chạy `python -m app.seats` thì ghế cũ mới
+được bảo vệ và số ghế trống mới đúng.
+
+Cùng update $inc soGheDaDat còn bật / tắt bit ghế trong bitGheDaDat
+(app/occupancy.py) để sơ đồ ghế chỉ cần đọc lịch trình. Ghế được trả báo cho
+danh sách chờ (app/waitlist.py).
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.holds import HOLD_COLLECTION
+from app.occupancy import (BITMAP_READY, BOOKED_BITS, OCCUPANCY_FIELDS, POSITIONS_FIELD, bit_update,
+                           bitmap_ready, booked_seats, invalid_seats, may_have_holds, register_seats, seat_positions,
+                           to_words)
+from app.search import ACTIVE_TRIP_STATUSES
+from app.seat_events import seat_events
+from app.ticket_schema import CANCELLED, STATUS_FIELD, canonical_fields, resolve_owners
+from app.waitlist import waitlist_worker
+
+CANCELLED_STATUS = 'Đã hủy'        # VeXe.tinhTrang (schema cũ)
+CANCELLED_STATE = 'DaHuy'          # VeXe.trangThai (schema mới)
+SEAT_CLAIM_FIELD = 'giuGhe'         # True khi vé đang giữ ghế (index unique một phần)
+DUPLICATE_KEY = 11000
+# Trường prepare_trip(s) đọc lại sau khi dựng bộ đếm / bitmap
+PREPARED_FIELDS = {**OCCUPANCY_FIELDS, 'tongGhe': 1, 'soGheDaDat': 1}
+
+
+def active_ticket_filter(ma_lich_trinh=None):
+    """Điều kiện vé còn giữ ghế"""
+    query = {'tinhTrang': {'$ne': CANCELLED_STATUS}, 'trangThai': {'$ne': CANCELLED_STATE}}
+    if ma_lich_trinh is not None:
+        query['maLichTrinh'] = ma_lich_trinh
+    return query
+
+
+def is_cancelled(ticket):
+    return ticket.get('tinhTrang') == CANCELLED_STATUS or ticket.get('trangThai') == CANCELLED_STATE
+
+
+def seat_claim(ticket):
+    """Giá trị giuGhe cần $set cùng dữ liệu vé"""
+    return {SEAT_CLAIM_FIELD: not is_cancelled(ticket)}
+
+
+def seats_left(trip):
+    """Số ghế trống đọc từ bộ đếm trên lịch trình"""
+    return max(0, (trip.get('tongGhe') or 0) - (trip.get('soGheDaDat') or 0))
+
+
+def set_total_seats(db, ma_lich_trinh, total, seat_numbers=None):
+    """
+    Ghi tongGhe; seat_numbers (theo thứ tự sơ đồ, khi vừa tạo ghế cho chuyến mới)
+    cấp sẵn vị trí bit cho ghế - chuyến mới chưa có vé nên bitmap rỗng là đúng.
+    """
+    fields = {'tongGhe': total}
+    if seat_numbers:
+        fields[BITMAP_READY] = True
+    db.LichTrinh.update_one({'maLichTrinh': ma_lich_trinh}, {'$set': fields})
+    register_seats(db, ma_lich_trinh, seat_numbers)
+
+
+def add_booked(db, ma_lich_trinh, seats, booked=True):
+    """
+    Ghi nhận (booked) hoặc trả lại các ghế `seats` (maGhe của từng vé): $inc
+    soGheDaDat và $bit bitGheDaDat trong cùng một update.
+    """
+    if not ma_lich_trinh or not seats:
+        return
+    positions = seat_positions(db, ma_lich_trinh, [seat for seat in seats if seat]).values()
+    update = {'$inc': {'soGheDaDat': len(seats) if booked else -len(seats)}}
+    update.update(bit_update(BOOKED_BITS, positions, booked))
+    db.LichTrinh.update_one({'maLichTrinh': ma_lich_trinh}, update)
+    seat_events.booked(ma_lich_trinh, seats, booked)
+    if not booked:
+        waitlist_worker.seats_freed(ma_lich_trinh)
+
+
+def ticket_changed(db, before, after):
+    """Cập nhật bộ đếm khi vé đổi trạng thái hoặc đổi chuyến (before/after có thể là None)"""
+    was_active = before is not None and not is_cancelled(before)
+    now_active = after is not None and not is_cancelled(after)
+    old_seat = (before.get('maLichTrinh'), before.get('maGhe')) if before else None
+    new_seat = (after.get('maLichTrinh'), after.get('maGhe')) if after else None
+
+    if was_active == now_active and old_seat == new_seat:
+        return
+    if was_active:
+        add_booked(db, old_seat[0], [old_seat[1]], booked=False)
+    if now_active:
+        add_booked(db, new_seat[0], [new_seat[1]])
+
+
+def cancel_ticket(db, ticket_filter):
+    """
+    Hủy một vé và trả ghế. Chỉ vé chưa hủy mới được cập nhật nên hủy lặp lại
+    không làm giảm bộ đếm hai lần. Trả về vé (trước khi hủy) hoặc None.
+    """
+    ticket = db.VeXe.find_one_and_update(
+        {**ticket_filter, **active_ticket_filter()},
+        {'$set': {'tinhTrang': CANCELLED_STATUS, 'trangThai': CANCELLED_STATE, STATUS_FIELD: CANCELLED,
+                  SEAT_CLAIM_FIELD: False}}
+    )
+    if ticket:
+        add_booked(db, ticket.get('maLichTrinh'), [ticket.get('maGhe')], booked=False)
+    return ticket
+
+
+def _insert_tickets(db, tickets):
+    """
+    Ghi vé bằng một insert_many không thứ tự. Trả về vị trí các vé bị index
+    unique từ chối (ghế đã có vé còn hiệu lực). Lỗi khác: xóa phần đã ghi rồi raise.
+    """
+    # Trường chuẩn khachHang / trangThaiVe (app/ticket_schema.py) ghi cùng trường cũ
+    owners = resolve_owners(db, tickets)
+    for ticket in tickets:
+        ticket.update(seat_claim(ticket))
+        ticket.update(canonical_fields(ticket, owners))
+    try:
+        db.VeXe.insert_many(tickets, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        failed = {error['index'] for error in errors}
+        if any(error.get('code') != DUPLICATE_KEY for error in errors):
+            _delete_inserted(db, tickets, failed)
+            raise
+        return failed
+    return set()
+
+
+def _delete_inserted(db, tickets, failed):
+    inserted = [ticket['_id'] for i, ticket in enumerate(tickets) if i not in failed and '_id' in ticket]
+    if inserted:
+        db.VeXe.delete_many({'_id': {'$in': inserted}})
+
+
+def _count_booked(db, tickets):
+    seats_by_trip = defaultdict(list)
+    for ticket in tickets:
+        if ticket[SEAT_CLAIM_FIELD]:
+            seats_by_trip[ticket.get('maLichTrinh')].append(ticket.get('maGhe'))
+    for ma_lich_trinh, seats in seats_by_trip.items():
+        add_booked(db, ma_lich_trinh, seats)
+
+
+def book_seats(db, tickets):
+    """
+    Ghi một lô vé bằng một insert_many không thứ tự. Ghế đã có vé còn hiệu lực
+    bị index unique từ chối (duplicate key); khi đó các vé khác của lô đã được
+    ghi sẽ bị xóa để lô không bị ghi dở. Trả về danh sách ghế bị trùng (rỗng
+    nếu thành công - bộ đếm soGheDaDat đã được cập nhật).
+    """
+    failed = _insert_tickets(db, tickets)
+    if failed:
+        _delete_inserted(db, tickets, failed)
+        return [tickets[i].get('maGhe') for i in sorted(failed)]
+    _count_booked(db, tickets)
+    return []
+
+
+def book_bulk(db, tickets, atomic=False, prepare=None):
+    """
+    Đặt nhiều vé trên nhiều chuyến (đại lý). Kiểm tra trước bằng một truy vấn
+    LichTrinh (bitmap ghế) và một truy vấn GiuCho cho cả tập chuyến, rồi ghi các
+    vé hợp lệ bằng một insert_many; index unique vẫn là chốt chặn cuối cùng nên
+    ghế không bao giờ bị bán hai lần. Trả về trạng thái từng vé theo thứ tự:
+        booked, taken (đã có vé), held (đang có người giữ chỗ), duplicate
+        (trùng trong cùng yêu cầu), trip_not_found, trip_closed, invalid_seat,
+        rolled_back (atomic: vé hợp lệ nhưng lô bị hủy)
+    atomic=True: chỉ ghi khi mọi vé hợp lệ, giống book_seats.
+    prepare(ticket, trip): bổ sung dữ liệu vé từ lịch trình (VD: giá) trước khi ghi.
+    """
+    codes = list({ticket.get('maLichTrinh') for ticket in tickets})
+    projection = {**OCCUPANCY_FIELDS, 'tinhTrang': 1, 'diemDi': 1, 'diemDen': 1}
+    trips = {trip['maLichTrinh']: prepare_trip(db, trip)
+             for trip in db.LichTrinh.find({'maLichTrinh': {'$in': codes}}, projection)}
+    held = set()
+    hold_trips = [code for code, trip in trips.items() if may_have_holds(trip)]
+    if hold_trips:
+        held = {(hold['maLichTrinh'], hold['maGhe']) for hold in db[HOLD_COLLECTION].find(
+            {'maLichTrinh': {'$in': hold_trips}, 'hetHan': {'$gt': datetime.now()}}, {'maLichTrinh': 1, 'maGhe': 1}
+        )}
+    booked = {code: booked_seats(trip) for code, trip in trips.items()}
+
+    statuses, seen, pending = [], set(), []
+    for i, ticket in enumerate(tickets):
+        code, seat = ticket.get('maLichTrinh'), ticket.get('maGhe')
+        trip = trips.get(code)
+        if trip is None:
+            status = 'trip_not_found'
+        elif trip.get('tinhTrang') not in ACTIVE_TRIP_STATUSES:
+            status = 'trip_closed'
+        elif not seat or invalid_seats(trip, [seat]):
+            status = 'invalid_seat'
+        elif (code, seat) in seen:
+            status = 'duplicate'
+        elif seat in booked[code]:
+            status = 'taken'
+        elif (code, seat) in held:
+            status = 'held'
+        else:
+            status = 'booked'
+            pending.append(i)
+        seen.add((code, seat))
+        statuses.append(status)
+
+    if atomic and len(pending) < len(tickets):
+        return [status if status != 'booked' else 'rolled_back' for status in statuses]
+
+    batch = [tickets[i] for i in pending]
+    if prepare:
+        for ticket in batch:
+            prepare(ticket, trips[ticket['maLichTrinh']])
+    failed = _insert_tickets(db, batch) if batch else set()
+    if failed and atomic:
+        _delete_inserted(db, batch, failed)
+        for j, i in enumerate(pending):
+            statuses[i] = 'taken' if j in failed else 'rolled_back'
+        return statuses
+    for j in failed:
+        statuses[pending[j]] = 'taken'  # Bị đặt mất giữa lúc kiểm tra và lúc ghi
+    _count_booked(db, [ticket for j, ticket in enumerate(batch) if j not in failed])
+    return statuses
+
+
+def prepare_trip(db, trip):
+    """
+    Chuyến chưa có bitmapSanSang: ghi giuGhe cho vé cũ của chuyến rồi dựng lại
+    bộ đếm / bitmap, trước khi bitmap và index unique được dùng để chặn ghế.
+    Mỗi chuyến chỉ chạy một lần. Trả về `trip` với các trường PREPARED_FIELDS mới.
+    """
+    if trip is None:
+        return None
+    return prepare_trips(db, [trip])[0]
+
+
+def prepare_trips(db, trips):
+    """
+    prepare_trip cho cả danh sách (tìm kiếm, danh sách chuyến, sơ đồ ghế): các
+    chuyến chưa sẵn sàng được chuẩn bị chung một lô, chuyến đã sẵn sàng không
+    tốn thêm truy vấn. Chuyến đọc từ kho lưu trữ (có ngayLuuTru) giữ nguyên.
+    """
+    codes = [trip.get('maLichTrinh') for trip in trips
+             if not bitmap_ready(trip) and trip.get('maLichTrinh') and 'ngayLuuTru' not in trip]
+    if not codes:
+        return trips
+    _, duplicates = backfill_seat_claims(db, {'maLichTrinh': {'$in': codes}})
+    for ticket_id in duplicates:
+        print(f"Ticket {ticket_id} holds a seat that another active ticket already holds")
+    reconcile_seat_counters(db, codes)
+    fresh = {trip['maLichTrinh']: trip for trip in db.LichTrinh.find({'maLichTrinh': {'$in': codes}}, PREPARED_FIELDS)}
+    return [{**trip, **fresh[trip['maLichTrinh']]} if trip.get('maLichTrinh') in fresh else trip for trip in trips]
+
+
+def backfill_seat_claims(db, query=None, batch_size=500):
+    """
+    Ghi giuGhe cho vé có sẵn (khớp `query`). Trả về (số vé đã cập nhật, danh sách
+    vé trùng ghế với một vé còn hiệu lực khác - cần xử lý tay).
+    """
+    updated, duplicates = 0, []
+
+    def flush(ticket_ids, batch):
+        try:
+            return db.VeXe.bulk_write(batch, ordered=False).modified_count
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                if error.get('code') != DUPLICATE_KEY:
+                    raise
+                duplicates.append(ticket_ids[error['index']])
+            return e.details.get('nModified', 0)
+
+    ticket_ids, batch = [], []
+    cursor = db.VeXe.find({**(query or {}), SEAT_CLAIM_FIELD: {'$exists': False}}, {'tinhTrang': 1, 'trangThai': 1})
+    for ticket in cursor:
+        ticket_ids.append(ticket['_id'])
+        batch.append(UpdateOne({'_id': ticket['_id']}, {'$set': seat_claim(ticket)}))
+        if len(batch) >= batch_size:
+            updated += flush(ticket_ids, batch)
+            ticket_ids, batch = [], []
+    if batch:
+        updated += flush(ticket_ids, batch)
+    return updated, duplicates
+
+
+def reconcile_seat_counters(db, trip_codes=None):
+    """
+    Đếm lại tongGhe/soGheDaDat, dựng lại viTriGhe (từ Ghe) và bitGheDaDat (từ VeXe),
+    chỉ ghi các lịch trình bị lệch
+    """
+    trip_query = {'maLichTrinh': {'$in': list(trip_codes)}} if trip_codes is not None else {}
+
+    # Ghế của chuyến theo thứ tự tạo - sơ đồ (viTriGhe) cho lịch trình cũ chưa có
+    layouts = {
+        row['_id']: row for row in db.Ghe.aggregate([
+            {'$match': trip_query}, {'$sort': {'_id': 1}},
+            {'$group': {'_id': '$maLichTrinh', 'count': {'$sum': 1}, 'seats': {'$push': '$soGhe'}}}
+        ])
+    }
+    booked = {
+        row['_id']: row for row in db.VeXe.aggregate([
+            {'$match': {**trip_query, **active_ticket_filter()}},
+            {'$group': {'_id': '$maLichTrinh', 'count': {'$sum': 1}, 'seats': {'$push': '$maGhe'}}}
+        ])
+    }
+
+    updates = []
+    projection = {'maLichTrinh': 1, 'tongGhe': 1, 'soGheDaDat': 1, POSITIONS_FIELD: 1, BOOKED_BITS: 1, BITMAP_READY: 1}
+    for trip in db.LichTrinh.find(trip_query, projection):
+        code = trip.get('maLichTrinh')
+        row = booked.get(code, {})
+        seats = [seat for seat in row.get('seats', []) if seat]
+        layout = layouts.get(code, {})
+        positions = list(trip.get(POSITIONS_FIELD) or [])
+        positions += [seat for seat in dict.fromkeys(layout.get('seats', []) + seats) if seat and seat not in positions]
+        index = {seat: i for i, seat in enumerate(positions)}
+        expected = {
+            'tongGhe': layout.get('count', 0),
+            'soGheDaDat': row.get('count', 0),
+            POSITIONS_FIELD: positions,
+            BOOKED_BITS: to_words(index[seat] for seat in seats),
+            BITMAP_READY: True,
+        }
+        current = {field: trip.get(field) for field in expected}
+        current[BOOKED_BITS] = {word: int(value) for word, value in (current[BOOKED_BITS] or {}).items() if value}
+        if current != expected:
+            # Chỉ ghi nếu bộ đếm / bitmap chưa bị cập nhật đồng thời kể từ lúc đọc
+            updates.append(UpdateOne(
+                {'_id': trip['_id'], **{field: trip.get(field) for field in expected}},
+                {'$set': expected}
+            ))
+
+    if updates:
+        db.LichTrinh.bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+if __name__ == '__main__':
+    from app import create_app, mongo
+
+    app = create_app()
+    with app.app_context():
+        claimed, duplicates = backfill_seat_claims(mongo.db)
+        print(f"Backfilled {SEAT_CLAIM_FIELD} on {claimed} tickets")
+        for ticket_id in duplicates:
+            print(f"  Ticket {ticket_id} holds a seat that another active ticket already holds")
+        fixed = reconcile_seat_counters(mongo.db)
+        print(f"Reconciled seat counters and bitmaps for {fixed} trips")
@@ -20,6 +20,7 @@ class SeatMap {
             await this.loadSeatsData();
             this.renderSeatMap();
             this.attachEventListeners();
+            this.connectStream();
         } catch (error) {
             this.showError('Không thể tải dữ liệu ghế: ' + error.message);
         }
@@ -107,6 +108,10 @@ class SeatMap {
                     <div class="legend-color legend-selected"></div>
                     <span>Đang chọn</span>
                 </div>
+                <div class="legend-item">
+                    <div class="legend-color legend-held"></div>
+                    <span>Đang được giữ</span>
+                </div>
                 <div class="legend-item">
                     <div class="legend-color legend-unavailable"></div>
                     <span>Không khả dụng</span>
@@ -190,6 +195,8 @@ class SeatMap {
     getSeatTooltip(seatNumber, seatInfo) {
         if (seatInfo.status === 'occupied') {
             return `${seatNumber} - Đã đặt\\nKhách: ${seatInfo.customerName || 'N/A'}\\nSĐT: ${seatInfo.customerPhone || 'N/A'}\\nNgày đặt: ${seatInfo.bookingDate || 'N/A'}`;
+        } else if (seatInfo.status === 'held') {
+            return `${seatNumber} - Khách khác đang giữ chỗ\nĐến: ${seatInfo.heldUntil || 'N/A'}`;
         } else if (seatInfo.status === 'available') {
             return `${seatNumber} - Ghế trống\\nLoại: ${seatInfo.seatType || 'Ghế thường'}`;
         } else {
@@ -454,6 +461,75 @@ class SeatMap {
         }
     }
     
+    markSeatsHeld(seatNumbers) {
+        // Ghế vừa bị khách khác giữ: bỏ chọn và khóa lại
+        seatNumbers.forEach(seatNumber => {
+            this.selectedSeats.delete(seatNumber);
+            if (this.seatsData[seatNumber]) {
+                this.seatsData[seatNumber].status = 'held';
+            }
+            const seatElement = this.container.querySelector(`[data-seat="${seatNumber}"]`);
+            if (seatElement) {
+                seatElement.classList.remove('seat-selected', 'seat-available');
+                seatElement.classList.add('seat-held');
+                seatElement.dataset.clickable = 'false';
+            }
+        });
+        
+        this.updateSelectedSeatInfo();
+        this.container.dispatchEvent(new CustomEvent('seatSelected', {
+            detail: {
+                selectedSeats: Array.from(this.selectedSeats),
+                seatCount: this.selectedSeats.size
+            }
+        }));
+    }
+    
+    connectStream() {
+        // Nhận thay đổi ghế qua SSE thay cho việc gọi lại /api/seats
+        if (!window.EventSource) return;
+        if (this.eventSource) this.eventSource.close();
+        
+        this.eventSource = new EventSource(`/api/seats/${this.tripId}/stream`);
+        const onSeats = event => this.applySeatStatuses(JSON.parse(event.data).seats || {});
+        this.eventSource.addEventListener('snapshot', onSeats);
+        this.eventSource.addEventListener('seats', onSeats);
+    }
+    
+    applySeatStatuses(statuses) {
+        const taken = [];
+        Object.entries(statuses).forEach(([seatNumber, status]) => {
+            const seatInfo = this.seatsData[seatNumber];
+            if (!seatInfo || seatInfo.status === status) return;
+            
+            if (this.selectedSeats.has(seatNumber)) {
+                // Ghế đang chọn: giữ chỗ của chính mình có thể hiện là 'held' qua process khác
+                if (status === 'occupied') taken.push(seatNumber);
+                return;
+            }
+            seatInfo.status = status;
+            
+            const seatElement = this.container.querySelector(`[data-seat="${seatNumber}"]`);
+            if (seatElement) {
+                seatElement.classList.remove('seat-available', 'seat-occupied', 'seat-held');
+                seatElement.classList.add(`seat-${status}`);
+                seatElement.dataset.clickable = String(status === 'available');
+                seatElement.title = this.getSeatTooltip(seatNumber, seatInfo);
+            }
+        });
+        
+        if (taken.length) {
+            this.markSeatsHeld(taken);
+            taken.forEach(seatNumber => {
+                const seatElement = this.container.querySelector(`[data-seat="${seatNumber}"]`);
+                this.seatsData[seatNumber].status = 'occupied';
+                if (seatElement) {
+                    seatElement.classList.replace('seat-held', 'seat-occupied');
+                }
+            });
+        }
+    }
+    
     refresh() {
         this.init();
     }
@@ -0,0 +1,135 @@
+"""
+Gợi ý tên trạm/địa điểm (autocomplete) từ prefix trie trong bộ nhớ.
+
+Nguồn: TuyenDuong.diemDau, TuyenDuong.diemCuoi, DiaDiem.tenDiaDiem. Tên được
+chuẩn hóa không dấu (app/normalize.py) và chèn vào trie từ đầu mỗi từ, nên
+"lat", "da lat" và "Đà L" đều gợi ý "Đà Lạt". Mỗi node giữ tập tên bên dưới
+nó: tra cứu chỉ đi theo tiền tố, không duyệt cây.
+
+Trie được dựng lần đầu khi có request; admin ghi TuyenDuong/DiaDiem gọi
+`station_index.replace(...)` để cập nhật từng tên. STATION_INDEX_TTL giới hạn
+độ cũ khi chạy nhiều worker (mỗi process có trie riêng).
+"""
+
+import heapq
+import threading
+import time
+
+from app.normalize import fold_text
+
+# Trường chứa tên trạm theo collection
+STATION_FIELDS = {
+    'TuyenDuong': ('diemDau', 'diemCuoi'),
+    'DiaDiem': ('tenDiaDiem',),
+}
+
+
+class _Node:
+    __slots__ = ('children', 'names')
+
+    def __init__(self):
+        self.children = {}
+        self.names = set()
+
+
+class StationIndex:
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._root = _Node()
+        self._refcounts = {}  # tên -> số document đang tham chiếu
+        self._sort_keys = {}  # tên -> tên không dấu (khóa sắp xếp)
+        self._built_at = None
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('STATION_INDEX_TTL', self.ttl)
+        self._built_at = None
+
+    @staticmethod
+    def _paths(name):
+        """Các chuỗi cần chèn: tên đã chuẩn hóa bắt đầu từ mỗi từ"""
+        words = fold_text(name).split()
+        return {' '.join(words[i:]) for i in range(len(words))}
+
+    def _insert(self, name):
+        for path in self._paths(name):
+            node = self._root
+            for char in path:
+                node = node.children.setdefault(char, _Node())
+                node.names.add(name)
+
+    def _remove(self, name):
+        for path in self._paths(name):
+            node = self._root
+            trail = []
+            for char in path:
+                child = node.children.get(char)
+                if child is None:
+                    break
+                trail.append((node, char, child))
+                child.names.discard(name)
+                node = child
+            # Dọn các node không còn tên nào
+            for parent, char, child in reversed(trail):
+                if not child.names and not child.children:
+                    del parent.children[char]
+
+    def add(self, name):
+        if not name:
+            return
+        with self._lock:
+            self._refcounts[name] = self._refcounts.get(name, 0) + 1
+            if self._refcounts[name] == 1:
+                self._sort_keys[name] = fold_text(name)
+                self._insert(name)
+
+    def remove(self, name):
+        if not name:
+            return
+        with self._lock:
+            count = self._refcounts.get(name, 0) - 1
+            if count > 0:
+                self._refcounts[name] = count
+            elif name in self._refcounts:
+                del self._refcounts[name]
+                del self._sort_keys[name]
+                self._remove(name)
+
+    def replace(self, collection_name, before=None, after=None):
+        """Cập nhật trie khi một document TuyenDuong/DiaDiem được thêm/sửa/xóa"""
+        if self._built_at is None:
+            return  # Chưa dựng - lần tra cứu đầu tiên sẽ đọc dữ liệu mới
+        for field in STATION_FIELDS.get(collection_name, ()):
+            if before:
+                self.remove(before.get(field))
+            if after:
+                self.add(after.get(field))
+
+    def rebuild(self, db):
+        with self._lock:
+            self._root, self._refcounts, self._sort_keys = _Node(), {}, {}
+            for collection_name, fields in STATION_FIELDS.items():
+                for doc in db[collection_name].find({}, {field: 1 for field in fields}):
+                    for field in fields:
+                        self.add(doc.get(field))
+            self._built_at = time.monotonic()
+
+    def _ensure_built(self, db):
+        if self._built_at is None or time.monotonic() - self._built_at > self.ttl:
+            self.rebuild(db)
+
+    def suggest(self, db, query, limit=10):
+        """Tên trạm có tiền tố (không dấu) khớp query, sắp xếp theo tên"""
+        self._ensure_built(db)
+        prefix = fold_text(query)
+        with self._lock:
+            node = self._root
+            for char in prefix:
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            names = node.names if prefix else self._refcounts.keys()
+            return heapq.nsmallest(limit, names, key=self._sort_keys.__getitem__)
+
+
+station_index = StationIndex()
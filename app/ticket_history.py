@@ -0,0 +1,113 @@
+"""
+Read model vé của khách cho my_tickets và trip_history.
+
+Một aggregation trên VeXe thay cho 3-4 find_one mỗi vé: lọc vé của khách, sắp
+theo ngayDat giảm dần, cắt trang rồi mới $lookup LichTrinh, XeKhach, Ghe và
+GiaVe (mỗi $lookup dùng index trên mã tương ứng) và $project xuống đúng các
+trường template dùng. Kết quả giữ hình dạng cũ: ticket['lich_trinh'],
+ticket['xe_info'], ticket['ghe_info'], ticket['gia_ve_info'].
+
+    page = ticket_history(mongo.db, owner_filter(customer_id, ma_khach), request.args.get('cursor'))
+    page['items'], page['next_cursor']
+
+Điều kiện chủ vé / trạng thái lấy từ app/ticket_schema.py (owner_filter,
+status_filter) - sau khi tắt dual-read, trang vé là một range scan trên index
+(khachHang, ngayDat, _id).
+
+trip_history đọc thêm vé của chuyến đã lưu trữ (archive=True, $unionWith
+VeXeLuuTru). Phân trang keyset theo (ngayDat, _id) - app/pagination.py. Vé cũ chỉ có ngayThem
+phải được ghi ngayDat trước, nếu không sẽ không ra sau trang đầu:
+    python -m app.ticket_history
+"""
+
+from pymongo import UpdateOne
+
+from app.archive import ARCHIVE_COLLECTIONS, union_pipeline
+from app.pagination import paginate
+
+# Vé mới đặt trước, _id để phân định cùng thời điểm
+TICKET_PAGE_KEYS = (('ngayDat', -1), ('_id', -1))
+TICKETS_PER_PAGE = 20
+
+# Trường template dùng (user/my_tickets.html, user/trip_history.html)
+TICKET_FIELDS = ('maVe', 'maGhe', 'maLichTrinh', 'tinhTrang', 'trangThai', 'ngayThem', 'ngayDat')
+TRIP_FIELDS = ('maLichTrinh', 'diemDi', 'diemDen', 'ngayDi', 'gioDi')
+VEHICLE_FIELDS = ('ten', 'bienSo')
+SEAT_FIELDS = ('soGhe',)
+FARE_FIELDS = ('giaVe',)
+
+def _lookup(collection_name, local_field, foreign_field, as_field, archive=False):
+    """$lookup lấy tối đa một document; archive: tìm cả trong kho lưu trữ (app/archive.py)"""
+    stages = [{'$lookup': {'from': collection_name, 'localField': local_field,
+                           'foreignField': foreign_field, 'as': as_field}}]
+    if archive:
+        stages += [
+            {'$lookup': {'from': ARCHIVE_COLLECTIONS[collection_name], 'localField': local_field,
+                         'foreignField': foreign_field, 'as': f'{as_field}_luuTru'}},
+            {'$addFields': {as_field: {'$concatArrays': [f'${as_field}', f'${as_field}_luuTru']}}},
+        ]
+    stages.append({'$addFields': {as_field: {'$slice': [f'${as_field}', 1]}}})
+    return stages
+
+
+def _pipeline(query, sort, limit, archive=False):
+    projection = {field: 1 for field in TICKET_FIELDS}
+    for as_field, fields in (('lich_trinh', TRIP_FIELDS), ('xe_info', VEHICLE_FIELDS),
+                             ('ghe_info', SEAT_FIELDS), ('gia_ve_info', FARE_FIELDS)):
+        projection.update({f'{as_field}.{field}': 1 for field in fields})
+    source = union_pipeline('VeXe', query) if archive else [{'$match': query}]
+    return source + [
+        {'$sort': sort},
+        {'$limit': limit},
+        *_lookup('LichTrinh', 'maLichTrinh', 'maLichTrinh', 'lich_trinh', archive),
+        {'$addFields': {'maXe': {'$arrayElemAt': ['$lich_trinh.maXe', 0]}}},
+        *_lookup('XeKhach', 'maXe', 'maXeKhach', 'xe_info'),
+        *_lookup('Ghe', 'maGhe', 'maGhe', 'ghe_info', archive),
+        *_lookup('GiaVe', 'maGiaVe', 'maGiaVe', 'gia_ve_info'),
+        {'$project': projection},
+    ]
+
+
+def _shape(ticket):
+    """Mảng $lookup (tối đa 1 phần tử) -> document như các view cũ dựng"""
+    trip = ticket.pop('lich_trinh', None) or []
+    if trip:
+        ticket['lich_trinh'] = trip[0]
+    for field in ('xe_info', 'ghe_info', 'gia_ve_info'):
+        found = ticket.get(field) or []
+        ticket[field] = found[0] if found else {}
+    return ticket
+
+
+def ticket_history(db, query, cursor=None, per_page=TICKETS_PER_PAGE, archive=False):
+    """
+    Một trang vé kèm thông tin chuyến, xe, ghế, giá - một aggregation cho cả trang.
+    archive: đọc cả vé của các chuyến đã lưu trữ (VeXeLuuTru).
+    """
+    def fetch(page_query, sort, limit):
+        return [_shape(ticket) for ticket in db.VeXe.aggregate(_pipeline(page_query, sort, limit, archive))]
+    return paginate(fetch, query, TICKET_PAGE_KEYS, cursor, per_page)
+
+
+def backfill_booking_dates(db, batch_size=500):
+    """Ghi ngayDat = ngayThem cho vé cũ thiếu ngayDat (hoặc ngayDat không phải ngày)"""
+    batch = []
+    count = 0
+    for ticket in db.VeXe.find({'ngayDat': {'$not': {'$type': 'date'}}}, {'ngayThem': 1}):
+        if ticket.get('ngayThem') is None:
+            continue
+        batch.append(UpdateOne({'_id': ticket['_id']}, {'$set': {'ngayDat': ticket['ngayThem']}}))
+        if len(batch) >= batch_size:
+            count += db.VeXe.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        count += db.VeXe.bulk_write(batch, ordered=False).modified_count
+    return count
+
+
+if __name__ == '__main__':
+    from app import create_app, mongo
+
+    app = create_app()
+    with app.app_context():
+        print(f"VeXe: set ngayDat on {backfill_booking_dates(mongo.db)} tickets")
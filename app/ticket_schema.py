@@ -0,0 +1,116 @@
+"""
+Schema chuẩn cho chủ vé và trạng thái vé trên VeXe.
+
+Vé cũ ghi chủ vé bằng maKhach (mã KH) hoặc maKhachHang (chuỗi hoặc ObjectId),
+trạng thái bằng tinhTrang (nhãn tiếng Việt) hoặc trangThai (mã). Schema chuẩn
+thêm hai trường, được ghi cùng các trường cũ:
+
+    khachHang   - _id KhachHang dạng chuỗi (None: vé không thuộc khách, VD vé đại lý)
+    trangThaiVe - daDat | daThanhToan | daHoanThanh | daHuy
+
+Vé có sẵn được backfill bằng migration 've_xe_schema_chuan' (app/migrations.py):
+    python -m app.migrations ve_xe_schema_chuan
+
+Trong lúc chuyển đổi (TICKET_SCHEMA_DUAL_READ = True) truy vấn đọc cả trường
+chuẩn lẫn trường cũ của những vé chưa được backfill. Tắt cờ sau khi migration
+xong thì vé của khách chỉ còn {khachHang, trangThaiVe}, dùng index
+(khachHang, ngayDat, _id).
+"""
+
+from flask import current_app
+
+from app.utils import get_object_id
+
+OWNER_FIELD = 'khachHang'
+STATUS_FIELD = 'trangThaiVe'
+
+BOOKED = 'daDat'
+PAID = 'daThanhToan'
+COMPLETED = 'daHoanThanh'
+CANCELLED = 'daHuy'
+TICKET_STATES = (BOOKED, PAID, COMPLETED, CANCELLED)
+
+# Nhãn / mã cũ -> trạng thái chuẩn
+LEGACY_STATUS = {'Chờ thanh toán': BOOKED, 'Đã đặt': BOOKED, 'Đã thanh toán': PAID,
+                 'Đã hoàn thành': COMPLETED, 'Đã hủy': CANCELLED}
+LEGACY_STATE = {'DaDat': BOOKED, 'DaThanhToan': PAID, 'DaHoanThanh': COMPLETED, 'DaHuy': CANCELLED}
+# Giá trị cũ tương ứng mỗi trạng thái chuẩn (dual-read)
+LEGACY_VALUES = {
+    state: ([label for label, value in LEGACY_STATUS.items() if value == state],
+            [code for code, value in LEGACY_STATE.items() if value == state])
+    for state in TICKET_STATES
+}
+# trip_history: vé đã đặt, đã thanh toán, đã hoàn thành
+HISTORY_STATES = (BOOKED, PAID, COMPLETED)
+
+
+def canonical_status(ticket):
+    """Trạng thái chuẩn từ tinhTrang / trangThai; hai trường lệch nhau thì lấy trạng thái đi xa hơn"""
+    states = {LEGACY_STATUS.get(ticket.get('tinhTrang')), LEGACY_STATE.get(ticket.get('trangThai'))} - {None}
+    if CANCELLED in states:
+        return CANCELLED
+    for state in (COMPLETED, PAID, BOOKED):
+        if state in states:
+            return state
+    return None
+
+
+def legacy_owner_id(ticket):
+    """_id khách lấy thẳng từ maKhachHang (không cần truy vấn); None nếu phải tra theo maKhach"""
+    value = ticket.get('maKhachHang')
+    if value and get_object_id(str(value)) is not None:
+        return str(value)
+    return None
+
+
+def resolve_owners(db, tickets):
+    """{maKhach: _id khách} cho các vé chỉ có maKhach - một $in cho cả lô"""
+    codes = {ticket['maKhach'] for ticket in tickets if ticket.get('maKhach') and not legacy_owner_id(ticket)}
+    if not codes:
+        return {}
+    return {customer['maKhach']: str(customer['_id'])
+            for customer in db.KhachHang.find({'maKhach': {'$in': list(codes)}}, {'maKhach': 1})}
+
+
+def canonical_fields(ticket, owners=None):
+    """Giá trị khachHang / trangThaiVe cần $set cùng dữ liệu vé"""
+    owner = legacy_owner_id(ticket) or (owners or {}).get(ticket.get('maKhach'))
+    return {OWNER_FIELD: owner, STATUS_FIELD: canonical_status(ticket)}
+
+
+def with_canonical_fields(db, ticket):
+    """canonical_fields cho một vé, tự tra khách theo maKhach nếu cần"""
+    return canonical_fields(ticket, resolve_owners(db, [ticket]))
+
+
+def dual_read():
+    return current_app.config.get('TICKET_SCHEMA_DUAL_READ', True)
+
+
+def owner_filter(customer_id, ma_khach=None):
+    """Vé của khách: khachHang, và (khi dual-read) các trường cũ của vé chưa backfill"""
+    canonical = {OWNER_FIELD: str(customer_id)}
+    if not dual_read():
+        return canonical
+    legacy = [{'maKhachHang': str(customer_id)}]
+    object_id = get_object_id(str(customer_id))
+    if object_id is not None:
+        legacy.append({'maKhachHang': object_id})
+    if ma_khach:
+        legacy.append({'maKhach': ma_khach})
+    return {'$or': [canonical] + [{**branch, OWNER_FIELD: {'$exists': False}} for branch in legacy]}
+
+
+def status_filter(states):
+    """Vé có trạng thái chuẩn thuộc `states` (khi dual-read: cả vé chưa backfill theo tinhTrang / trangThai)"""
+    states = list(states)
+    canonical = {STATUS_FIELD: {'$in': states}}
+    if not dual_read():
+        return canonical
+    labels = [label for state in states for label in LEGACY_VALUES[state][0]]
+    codes = [code for state in states for code in LEGACY_VALUES[state][1]]
+    return {'$or': [
+        canonical,
+        {STATUS_FIELD: {'$exists': False}, 'tinhTrang': {'$in': labels}},
+        {STATUS_FIELD: {'$exists': False}, 'trangThai': {'$in': codes}},
+    ]}
@@ -1,5 +1,6 @@
 from bson import ObjectId
 import re
+from app.normalize import VIETNAMESE_FOLD_TABLE
 
 def parse_json(data):
     if isinstance(data, list):
@@ -22,29 +23,8 @@ def vietnamese_to_css_class(text):
     if not text:
         return 'chua-xac-dinh'
     
-    # Dictionary để chuyển đổi ký tự tiếng Việt
-    vietnamese_chars = {
-        'à': 'a', 'á': 'a', 'ạ': 'a', 'ả': 'a', 'ã': 'a',
-        'â': 'a', 'ầ': 'a', 'ấ': 'a', 'ậ': 'a', 'ẩ': 'a', 'ẫ': 'a',
-        'ă': 'a', 'ằ': 'a', 'ắ': 'a', 'ặ': 'a', 'ẳ': 'a', 'ẵ': 'a',
-        'è': 'e', 'é': 'e', 'ẹ': 'e', 'ẻ': 'e', 'ẽ': 'e',
-        'ê': 'e', 'ề': 'e', 'ế': 'e', 'ệ': 'e', 'ể': 'e', 'ễ': 'e',
-        'ì': 'i', 'í': 'i', 'ị': 'i', 'ỉ': 'i', 'ĩ': 'i',
-        'ò': 'o', 'ó': 'o', 'ọ': 'o', 'ỏ': 'o', 'õ': 'o',
-        'ô': 'o', 'ồ': 'o', 'ố': 'o', 'ộ': 'o', 'ổ': 'o', 'ỗ': 'o',
-        'ơ': 'o', 'ờ': 'o', 'ớ': 'o', 'ợ': 'o', 'ở': 'o', 'ỡ': 'o',
-        'ù': 'u', 'ú': 'u', 'ụ': 'u', 'ủ': 'u', 'ũ': 'u',
-        'ư': 'u', 'ừ': 'u', 'ứ': 'u', 'ự': 'u', 'ử': 'u', 'ữ': 'u',
-        'ỳ': 'y', 'ý': 'y', 'ỵ': 'y', 'ỷ': 'y', 'ỹ': 'y',
-        'đ': 'd'
-    }
-    
-    # Chuyển về lowercase
-    result = text.lower()
-    
-    # Thay thế ký tự tiếng Việt
-    for vn_char, en_char in vietnamese_chars.items():
-        result = result.replace(vn_char, en_char)
+    # Chuyển về lowercase và bỏ dấu tiếng Việt
+    result = text.lower().translate(VIETNAMESE_FOLD_TABLE)
     
     # Thay thế space bằng dash
     result = result.replace(' ', '-')
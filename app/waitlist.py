@@ -0,0 +1,286 @@
+"""
+Danh sách chờ cho chuyến đã hết chỗ.
+
+Collection DanhSachCho, mỗi document là một khách đang chờ một chuyến:
+    maLichTrinh, nguoiCho (id khách), soGhe (số ghế cần, 1-5)
+    viTri      - thứ tự trong hàng đợi của chuyến (bộ đếm BoDem 'cho:<maLichTrinh>')
+    trangThai  - cho | dangXuLy | daGiu | daDat | huy | hetHan
+    ngayNhan   - lúc worker nhận lượt (dangXuLy)
+    gheGiu, hetHanGiu - ghế đã được giữ cho khách khi tới lượt
+
+Chỉ nhận đăng ký cho chuyến còn bán vé (chưa chạy) và không còn đủ ghế trống.
+
+Khi có ghế trống (hủy vé - app/seats.py, trả giữ chỗ trước hạn - app/holds.py
+gọi `waitlist_worker.seats_freed`), worker nền lấy người đứng đầu hàng bằng một
+find_one_and_update sắp theo viTri (index maLichTrinh + trangThai + viTri) rồi
+giữ chỗ cho họ trong WAITLIST_HOLD_SECONDS. Nhiều ghế trống cùng lúc thì đẩy
+liên tiếp nhiều người; không duyệt cả hàng đợi. Giữ chỗ hết hạn không sinh sự
+kiện nên worker quét các chuyến sắp chạy còn người chờ mỗi
+WAITLIST_SWEEP_SECONDS giây. Lượt dangXuLy quá WAITLIST_CLAIM_SECONDS (process
+nhận lượt bị dừng giữa chừng) được trả về hàng ở lần xử lý chuyến kế tiếp.
+
+Worker chỉ chạy trong process phục vụ (run.py gọi `waitlist_worker.start()`);
+CLI và các process khác chỉ ghi hàng chờ, lần quét kế tiếp sẽ xử lý.
+
+Thứ tự FIFO chặt: người đứng đầu cần nhiều ghế hơn số ghế trống thì những người
+sau cũng đợi.
+"""
+
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from app.holds import HOLD_COLLECTION, hold_seats
+from app.ids import COUNTER_COLLECTION
+from app.occupancy import OCCUPANCY_FIELDS, POSITIONS_FIELD, booked_seats
+from app.search import ACTIVE_TRIP_STATUSES
+
+WAITLIST_COLLECTION = 'DanhSachCho'
+WAITING = 'cho'
+CLAIMED = 'dangXuLy'
+PROMOTED = 'daGiu'
+BOOKED = 'daDat'
+LEFT = 'huy'
+EXPIRED = 'hetHan'
+DEFAULT_CLAIM_SECONDS = 60
+
+
+class AlreadyWaiting(Exception):
+    pass
+
+
+class TripClosed(Exception):
+    """Chuyến không còn bán vé (đã chạy, đã hủy, ...)"""
+
+
+class SeatsAvailable(Exception):
+    """Chuyến còn đủ ghế trống - đặt vé trực tiếp"""
+
+
+def _today():
+    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def upcoming_trip_filter():
+    """Chuyến còn bán vé và chưa qua ngày chạy"""
+    return {'tinhTrang': {'$in': ACTIVE_TRIP_STATUSES}, 'ngayDi': {'$gte': _today()}}
+
+
+def join(db, ma_lich_trinh, owner, seat_count=1):
+    """
+    Thêm khách vào cuối hàng đợi - trả về document. AlreadyWaiting nếu đang chờ
+    chuyến này, TripClosed nếu chuyến không còn bán vé, SeatsAvailable nếu còn đủ ghế.
+    """
+    if not db.LichTrinh.find_one({'maLichTrinh': ma_lich_trinh, **upcoming_trip_filter()}, {'_id': 1}):
+        raise TripClosed(ma_lich_trinh)
+    if len(_free_seats(db, ma_lich_trinh)) >= seat_count:
+        raise SeatsAvailable(ma_lich_trinh)
+    counter = db[COUNTER_COLLECTION].find_one_and_update(
+        {'_id': f'cho:{ma_lich_trinh}'}, {'$inc': {'giaTri': 1}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    entry = {
+        'maLichTrinh': ma_lich_trinh,
+        'nguoiCho': owner,
+        'soGhe': seat_count,
+        'viTri': counter['giaTri'],
+        'trangThai': WAITING,
+        'ngayThem': datetime.now(),
+    }
+    try:
+        db[WAITLIST_COLLECTION].insert_one(entry)
+    except DuplicateKeyError:
+        raise AlreadyWaiting(ma_lich_trinh)
+    return entry
+
+
+def leave(db, ma_lich_trinh, owner):
+    return db[WAITLIST_COLLECTION].update_one(
+        {'maLichTrinh': ma_lich_trinh, 'nguoiCho': owner, 'trangThai': {'$in': [WAITING, PROMOTED]}},
+        {'$set': {'trangThai': LEFT, 'ngayCapNhat': datetime.now()}}
+    ).modified_count > 0
+
+
+def ahead_of(db, entry):
+    """Số người đang chờ trước `entry` (đếm trên index, không đọc document)"""
+    return db[WAITLIST_COLLECTION].count_documents(
+        {'maLichTrinh': entry['maLichTrinh'], 'trangThai': WAITING, 'viTri': {'$lt': entry['viTri']}}
+    )
+
+
+def customer_entries(db, owner):
+    """Các lượt chờ còn hiệu lực của khách, kèm số người đứng trước"""
+    entries = list(db[WAITLIST_COLLECTION].find(
+        {'nguoiCho': owner, 'trangThai': {'$in': [WAITING, PROMOTED]}}
+    ).sort('ngayThem', -1))
+    now = datetime.now()
+    for entry in entries:
+        if entry['trangThai'] == WAITING:
+            entry['soNguoiTruoc'] = ahead_of(db, entry)
+        elif entry.get('hetHanGiu') and entry['hetHanGiu'] <= now:
+            entry['trangThai'] = EXPIRED
+    return entries
+
+
+def mark_booked(db, ma_lich_trinh, owner):
+    """Khách được đẩy lên đã đặt vé"""
+    db[WAITLIST_COLLECTION].update_many(
+        {'maLichTrinh': ma_lich_trinh, 'nguoiCho': owner, 'trangThai': PROMOTED},
+        {'$set': {'trangThai': BOOKED, 'ngayCapNhat': datetime.now()}}
+    )
+
+
+def _free_seats(db, ma_lich_trinh):
+    """Ghế trống theo thứ tự sơ đồ: chưa có vé và không có giữ chỗ còn hạn"""
+    from app.seats import prepare_trip
+    trip = prepare_trip(db, db.LichTrinh.find_one({'maLichTrinh': ma_lich_trinh}, OCCUPANCY_FIELDS))
+    if not trip:
+        return []
+    taken = booked_seats(trip)
+    taken |= {hold['maGhe'] for hold in db[HOLD_COLLECTION].find(
+        {'maLichTrinh': ma_lich_trinh, 'hetHan': {'$gt': datetime.now()}}, {'maGhe': 1}
+    )}
+    return [seat for seat in trip.get(POSITIONS_FIELD) or [] if seat not in taken]
+
+
+def promote(db, ma_lich_trinh, hold_seconds=900, claim_seconds=DEFAULT_CLAIM_SECONDS):
+    """Giữ chỗ cho những người đứng đầu hàng khi còn đủ ghế - trả về số người được đẩy lên"""
+    waitlist = db[WAITLIST_COLLECTION]
+    now = datetime.now()
+    # Lượt bị nhận bởi process đã dừng giữa chừng: trả về hàng, giữ nguyên viTri
+    waitlist.update_many(
+        {'maLichTrinh': ma_lich_trinh, 'trangThai': CLAIMED, '$or': [
+            {'ngayNhan': {'$lte': now - timedelta(seconds=claim_seconds)}}, {'ngayNhan': {'$exists': False}}
+        ]},
+        {'$set': {'trangThai': WAITING, 'ngayCapNhat': now}}
+    )
+    # Lượt đã được giữ chỗ nhưng không đặt vé kịp
+    waitlist.update_many(
+        {'maLichTrinh': ma_lich_trinh, 'trangThai': PROMOTED, 'hetHanGiu': {'$lte': now}},
+        {'$set': {'trangThai': EXPIRED, 'ngayCapNhat': now}}
+    )
+    if not waitlist.find_one({'maLichTrinh': ma_lich_trinh, 'trangThai': WAITING}, {'_id': 1}):
+        return 0
+
+    promoted = 0
+    free = _free_seats(db, ma_lich_trinh)
+    while free:
+        # Nhận người đứng đầu hàng - chỉ một worker nhận được
+        entry = waitlist.find_one_and_update(
+            {'maLichTrinh': ma_lich_trinh, 'trangThai': WAITING, 'soGhe': {'$lte': len(free)}},
+            {'$set': {'trangThai': CLAIMED, 'ngayNhan': datetime.now()}},
+            sort=[('viTri', ASCENDING)], return_document=ReturnDocument.AFTER
+        )
+        head = waitlist.find_one({'maLichTrinh': ma_lich_trinh, 'trangThai': WAITING},
+                                 {'viTri': 1}, sort=[('viTri', ASCENDING)])
+        if entry is None or (head and head['viTri'] < entry['viTri']):
+            # Người đứng trước cần nhiều ghế hơn số đang trống: giữ đúng thứ tự
+            if entry is not None:
+                waitlist.update_one({'_id': entry['_id'], 'trangThai': CLAIMED}, {'$set': {'trangThai': WAITING}})
+            break
+
+        seats = free[:entry.get('soGhe', 1)]
+        try:
+            expires_at, taken = hold_seats(db, ma_lich_trinh, seats, entry['nguoiCho'], hold_seconds)
+        except Exception:
+            # Không để lượt kẹt ở dangXuLy: trả về hàng, lần quét sau xử lý lại
+            waitlist.update_one({'_id': entry['_id'], 'trangThai': CLAIMED}, {'$set': {'trangThai': WAITING}})
+            raise
+        if taken:
+            # Ghế vừa bị người khác lấy: trả người này về hàng và tính lại ghế trống
+            waitlist.update_one({'_id': entry['_id'], 'trangThai': CLAIMED}, {'$set': {'trangThai': WAITING}})
+            free = _free_seats(db, ma_lich_trinh)
+            if set(taken) & set(free):
+                break  # Giữ chỗ chưa hết hạn nhưng chưa được TTL xóa: đợi lần quét sau
+            continue
+
+        waitlist.update_one({'_id': entry['_id']}, {'$set': {
+            'trangThai': PROMOTED, 'gheGiu': seats, 'hetHanGiu': expires_at, 'ngayCapNhat': datetime.now()
+        }})
+        free = free[len(seats):]
+        promoted += 1
+    return promoted
+
+
+class WaitlistWorker:
+    """Thread nền đẩy người chờ lên khi có ghế trống"""
+
+    def __init__(self, sweep_seconds=30, hold_seconds=900, claim_seconds=DEFAULT_CLAIM_SECONDS):
+        self.sweep_seconds = sweep_seconds
+        self.hold_seconds = hold_seconds
+        self.claim_seconds = claim_seconds
+        self.enabled = False
+        self._queue = queue.Queue()
+        self._thread = None
+        self._app = None
+        self.promoted = 0
+
+    def init_app(self, app):
+        self.sweep_seconds = app.config.get('WAITLIST_SWEEP_SECONDS', self.sweep_seconds)
+        self.hold_seconds = app.config.get('WAITLIST_HOLD_SECONDS', self.hold_seconds)
+        self.claim_seconds = app.config.get('WAITLIST_CLAIM_SECONDS', self.claim_seconds)
+        self._app = app
+        if app.config.get('WAITLIST_WORKER', False):
+            self.start()
+
+    def start(self):
+        """Chạy worker trong process này (run.py; một process cho cả hệ thống là đủ)"""
+        self.enabled = True
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def seats_freed(self, ma_lich_trinh):
+        """Có ghế vừa được trả - xử lý ở worker, không chặn request"""
+        if self.enabled and ma_lich_trinh:
+            self._queue.put(ma_lich_trinh)
+
+    def _promote(self, db, ma_lich_trinh):
+        try:
+            self.promoted += promote(db, ma_lich_trinh, self.hold_seconds, self.claim_seconds)
+        except Exception as e:
+            # Lỗi một chuyến không được dừng thread worker
+            print(f"Waitlist promotion failed for {ma_lich_trinh}: {e}")
+
+    def _sweep_codes(self, db):
+        """Chuyến sắp chạy còn người chờ (hoặc còn lượt dangXuLy có thể đã kẹt)"""
+        codes = db[WAITLIST_COLLECTION].distinct('maLichTrinh', {'trangThai': {'$in': [WAITING, CLAIMED]}})
+        if not codes:
+            return set()
+        return {trip['maLichTrinh'] for trip in db.LichTrinh.find(
+            {'maLichTrinh': {'$in': codes}, **upcoming_trip_filter()}, {'maLichTrinh': 1}
+        )}
+
+    def _run(self):
+        from app import mongo
+
+        with self._app.app_context():
+            next_sweep = time.monotonic() + self.sweep_seconds
+            while True:
+                try:
+                    code = self._queue.get(timeout=max(0, next_sweep - time.monotonic()))
+                except queue.Empty:
+                    code = None
+                codes = set()
+                if code is not None:
+                    # Gom các tín hiệu dồn dập (hủy hàng loạt trước giờ chạy) theo chuyến
+                    codes.add(code)
+                    while not self._queue.empty():
+                        codes.add(self._queue.get_nowait())
+                # Quét theo lịch cố định, kể cả khi hàng đợi sự kiện không lúc nào rảnh:
+                # giữ chỗ hết hạn không sinh sự kiện
+                if time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + self.sweep_seconds
+                    try:
+                        codes |= self._sweep_codes(mongo.db)
+                    except PyMongoError as e:
+                        print(f"Waitlist sweep failed: {e}")
+                for ma_lich_trinh in codes:
+                    self._promote(mongo.db, ma_lich_trinh)
+
+
+waitlist_worker = WaitlistWorker()
@@ -3,3 +3,62 @@ import os
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev_secret_key_123456'
     MONGO_URI = "mongodb://localhost:27017/quanly_xekhach"
+    # Tạo index khai báo trong app/indexes.py khi khởi động; chờ mongod tối đa
+    # ENSURE_INDEXES_TIMEOUT_MS (không có thì bỏ qua, tạo sau: python -m app.indexes --create)
+    ENSURE_INDEXES = True
+    ENSURE_INDEXES_TIMEOUT_MS = 2000
+    # Cache dữ liệu tham chiếu (app/cache.py): thời gian sống (giây) và số entry tối đa
+    REFERENCE_CACHE_TTL = 300
+    REFERENCE_CACHE_SIZE = 1000
+    # Trie gợi ý tên trạm (app/stations.py): dựng lại sau số giây này
+    STATION_INDEX_TTL = 600
+    # Cache response HTTP (app/http_cache.py): TTL mặc định (giây), số response tối đa
+    RESPONSE_CACHE_ENABLED = True
+    RESPONSE_CACHE_TTL = 60
+    RESPONSE_CACHE_SIZE = 500
+    # Tìm hành trình nối chuyến (app/connections.py)
+    CONNECTION_GRAPH_TTL = 600
+    CONNECTION_MIN_TRANSFER_MINUTES = 30
+    CONNECTION_MAX_WAIT_HOURS = 12
+    CONNECTION_HORIZON_DAYS = 30
+    # Giữ chỗ khi chọn ghế (app/holds.py): số giây trước khi ghế được trả lại
+    SEAT_HOLD_SECONDS = 600
+    # Stream SSE trạng thái ghế (app/seat_events.py): giây giữa hai heartbeat,
+    # số sự kiện chờ tối đa mỗi kết nối, theo dõi change stream khi có replica set
+    SEAT_EVENTS_HEARTBEAT = 15
+    SEAT_EVENTS_QUEUE_SIZE = 100
+    SEAT_EVENTS_CHANGE_STREAM = True
+    # Cấp mã (app/ids.py): số mã mỗi process lấy từ bộ đếm BoDem một lần
+    ID_BLOCK_SIZE = 100
+    # Đặt vé theo lô cho đại lý (/admin/api/agency-bookings): số ghế tối đa mỗi yêu cầu
+    AGENCY_BOOKING_MAX_ITEMS = 500
+    # Khóa idempotency cho POST đặt vé (app/idempotency.py): giữ response đã lưu
+    # trong IDEMPOTENCY_TTL giây; khóa đang xử lý quá IDEMPOTENCY_PENDING_SECONDS được nhận lại
+    IDEMPOTENCY_TTL = 86400
+    IDEMPOTENCY_PENDING_SECONDS = 60
+    # Danh sách chờ (app/waitlist.py): worker nền đẩy người chờ lên khi có ghế,
+    # giữ chỗ cho họ trong WAITLIST_HOLD_SECONDS, quét lại mỗi WAITLIST_SWEEP_SECONDS.
+    # run.py tự bật worker; True để create_app bật trong mọi process (VD: server WSGI khác)
+    WAITLIST_WORKER = False
+    WAITLIST_HOLD_SECONDS = 900
+    WAITLIST_SWEEP_SECONDS = 30
+    # Lượt đang xử lý (dangXuLy) quá số giây này được trả về hàng - process nhận lượt đã dừng
+    WAITLIST_CLAIM_SECONDS = 60
+    # Schema chuẩn VeXe (app/ticket_schema.py): đọc cả trường cũ của vé chưa backfill.
+    # Tắt sau khi `python -m app.migrations ve_xe_schema_chuan` chạy xong
+    TICKET_SCHEMA_DUAL_READ = True
+    # Lưu trữ chuyến đã kết thúc (app/archive.py): chuyến 'Đã hoàn thành' / 'Đã hủy' cũ hơn
+    # ARCHIVE_HORIZON_DAYS ngày được chuyển sang kho lưu trữ, mỗi lô ARCHIVE_BATCH_SIZE chuyến,
+    # thread nền chạy mỗi ARCHIVE_INTERVAL_HOURS giờ. Xóa dữ liệu khỏi collection nóng nên
+    # phải bật chủ động; hoặc chạy theo lịch bằng `python -m app.archive`
+    ARCHIVE_ENABLED = False
+    ARCHIVE_HORIZON_DAYS = 90
+    ARCHIVE_BATCH_SIZE = 50
+    ARCHIVE_INTERVAL_HOURS = 24
+    # Đo lệnh MongoDB theo request (app/profiler.py): header Server-Timing, cảnh báo khi
+    # một dạng truy vấn lặp từ DB_PROFILER_N_PLUS_ONE lần trong một request,
+    # thống kê DB_PROFILER_WINDOW request gần nhất mỗi endpoint ở /admin/api/perf
+    DB_PROFILER_ENABLED = True
+    DB_PROFILER_SERVER_TIMING = True
+    DB_PROFILER_N_PLUS_ONE = 5
+    DB_PROFILER_WINDOW = 200
@@ -0,0 +1,312 @@
+"""
+Đo tải luồng đặt vé trên MongoDB local: tìm chuyến → sơ đồ ghế → giữ chỗ → đặt vé.
+
+    python load_test.py                          # seed rồi chạy 200 khách, 20 luồng
+    python load_test.py --customers 1000 --concurrency 50 --hot-trips 2
+    python load_test.py --json baseline.json     # lưu kết quả để so sánh về sau
+
+Dùng database riêng (LOADTEST_MONGO_URI, mặc định .../quanly_xekhach_loadtest)
+và XÓA dữ liệu trong đó khi seed - tên database phải kết thúc bằng "_loadtest".
+Mỗi khách ảo là một Flask test client có session khách hàng riêng; các luồng
+chạy song song trên cùng app nên đo được tranh chấp ghế thật trên mongod.
+
+Báo cáo theo endpoint: số request, lỗi, request/giây, p50/p95/p99 (ms), số lệnh
+MongoDB trung bình mỗi request (đếm bằng pymongo CommandListener); cuối cùng là
+số ghế bị bán hai lần và số chuyến có bộ đếm ghế lệch với VeXe.
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from pymongo import monitoring
+
+from config import Config
+
+ROUTES = [('Hà Nội', 'Đà Lạt'), ('Sài Gòn', 'Đà Lạt'), ('Sài Gòn', 'Nha Trang'), ('Hà Nội', 'Hải Phòng')]
+SEAT_LAYOUT = 'SD_LT40'
+
+
+class LoadTestConfig(Config):
+    MONGO_URI = os.environ.get('LOADTEST_MONGO_URI', 'mongodb://localhost:27017/quanly_xekhach_loadtest')
+    TESTING = True
+    # Chỉ đo luồng request: tắt các thread nền
+    WAITLIST_WORKER = False
+    SEAT_EVENTS_CHANGE_STREAM = False
+    ARCHIVE_ENABLED = False
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Đếm lệnh MongoDB theo luồng - test client xử lý request ngay trên luồng gọi"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self):
+        self._local.count = 0
+
+    def stop(self):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = None
+        return count
+
+    def started(self, event):
+        if getattr(self._local, 'count', None) is not None:
+            self._local.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)  # endpoint -> [(giây, số lệnh Mongo, lỗi)]
+        self.bookings = defaultdict(int)
+
+    def add(self, endpoint, seconds, ops, error):
+        with self._lock:
+            self.samples[endpoint].append((seconds, ops, error))
+
+    def booking(self, outcome):
+        with self._lock:
+            self.bookings[outcome] += 1
+
+
+def percentile(values, pct):
+    """Percentile kiểu nearest-rank"""
+    if not values:
+        return 0
+    values = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(values) + 0.5)))
+    return values[min(rank, len(values)) - 1]
+
+
+def seed(db, trips, seats_per_trip, customers):
+    from app.normalize import place_keys
+
+    for name in ('TuyenDuong', 'XeKhach', 'LoaiXe', 'GiaVe', 'SoDoGhe', 'LichTrinh', 'Ghe', 'VeXe',
+                 'KhachHang', 'GiuCho', 'GiuChoThongKe', 'LichKhoiHanh', 'BoDem', 'KhoaIdempotency',
+                 'DanhSachCho'):
+        db[name].delete_many({})
+
+    seat_numbers = [f'A{i:02d}' for i in range(1, seats_per_trip + 1)]
+    db.LoaiXe.insert_one({'maLoaiXe': 'LT40', 'tenLoaiXe': 'Limousine 40'})
+    db.SoDoGhe.insert_one({
+        'maSoDo': SEAT_LAYOUT, 'maLoaiXe': 'LT40', 'tenSoDo': 'Load test', 'soTang': 1,
+        'danhSachGhe': [{'soGhe': seat, 'loaiGhe': 'Ghe', 'tang': 1} for seat in seat_numbers]
+    })
+    db.XeKhach.insert_many([
+        {'maXeKhach': f'XE{i:03d}', 'ten': f'Xe {i}', 'bienSo': f'51B-{i:05d}', 'maLoai': 'LT40',
+         'tinhTrang': 'Hoạt động'} for i in range(1, trips + 1)
+    ])
+    routes, fares = [], []
+    for i, (diem_dau, diem_cuoi) in enumerate(ROUTES, 1):
+        route = {'maTuyenDuong': f'TD{i:02d}', 'tenTuyenDuong': f'{diem_dau} - {diem_cuoi}',
+                 'diemDau': diem_dau, 'diemCuoi': diem_cuoi, 'doDai': 300, 'tinhTrang': 'Hoạt động'}
+        route.update(place_keys('TuyenDuong', route))
+        routes.append(route)
+        fares.append({'maGiaVe': f'GV{i:02d}', 'tuyen': route['maTuyenDuong'], 'maLoaiXe': 'LT40',
+                      'giaVe': 300000, 'tinhTrang': 'Hoạt động'})
+    db.TuyenDuong.insert_many(routes)
+    db.GiaVe.insert_many(fares)
+
+    day = (datetime.now() + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    trip_docs, seat_docs = [], []
+    for i in range(1, trips + 1):
+        diem_di, diem_den = ROUTES[(i - 1) % len(ROUTES)]
+        code = f'LT{i:04d}'
+        trip = {
+            'maLichTrinh': code, 'maXe': f'XE{i:03d}', 'diemDi': diem_di, 'diemDen': diem_den,
+            'gioDi': f'{6 + i % 16:02d}:00', 'ngayDi': day, 'tinhTrang': 'Sắp chạy', 'ngayThem': datetime.now(),
+            'tongGhe': seats_per_trip, 'soGheDaDat': 0, 'viTriGhe': seat_numbers, 'bitmapSanSang': True,
+        }
+        trip.update(place_keys('LichTrinh', trip))
+        trip_docs.append(trip)
+        seat_docs += [{'maGhe': f'GHE_{code}_{seat}', 'maLichTrinh': code, 'soGhe': seat, 'tinhTrang': 'Trống',
+                       'loaiGhe': 'Ghe', 'ngayTao': datetime.now()} for seat in seat_numbers]
+    db.LichTrinh.insert_many(trip_docs)
+    db.Ghe.insert_many(seat_docs)
+    db.KhachHang.insert_many([
+        {'maKhach': f'KH{i:04d}', 'ten': f'Khách {i}', 'dienThoai': f'09{i:08d}',
+         'email': f'khach{i}@loadtest.local', 'matKhau': 'x', 'ngayThem': datetime.now()}
+        for i in range(1, customers + 1)
+    ])
+    return day
+
+
+def timed(client, counter, stats, endpoint, send):
+    counter.start()
+    started = time.perf_counter()
+    error = False
+    try:
+        response = send(client)
+        error = response.status_code >= 500
+    except Exception as e:
+        print(f"{endpoint}: {e}")
+        response, error = None, True
+    stats.add(endpoint, time.perf_counter() - started, counter.stop(), error)
+    return response
+
+
+def run_customer(app, counter, stats, customer, trips, day, max_seats):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['customer_id'] = str(customer['_id'])
+        session['ma_khach'] = customer['maKhach']
+        session['role'] = 'CUSTOMER'
+
+    trip = random.choice(trips)
+    timed(client, counter, stats, 'search', lambda c: c.get('/search', query_string={
+        'diem_di': trip['diemDi'], 'diem_den': trip['diemDen'], 'ngay_di': day.strftime('%Y-%m-%d')
+    }))
+
+    trip_id = str(trip['_id'])
+    response = timed(client, counter, stats, 'seat_map', lambda c: c.get(f'/api/seats/{trip_id}'))
+    seats = (response.get_json(silent=True) or {}).get('seats', {}) if response is not None else {}
+    free = [seat for seat, info in seats.items() if info.get('status') == 'available']
+    if not free:
+        stats.booking('sold_out')
+        return
+    chosen = random.sample(free, min(len(free), random.randint(1, max_seats)))
+
+    response = timed(client, counter, stats, 'hold', lambda c: c.post(
+        f'/api/seats/{trip_id}/hold', json={'seats': chosen}
+    ))
+    if response is None or response.status_code != 200:
+        stats.booking('hold_conflict')
+        return
+
+    response = timed(client, counter, stats, 'confirm_booking', lambda c: c.post('/booking/confirm', data={
+        'lich_trinh_id': trip_id, 'selected_seats': ','.join(chosen), 'idempotency_key': uuid4().hex
+    }))
+    if response is not None and response.status_code == 302 and response.headers.get('Location', '').endswith('/my-tickets'):
+        stats.booking('booked')
+    else:
+        stats.booking('booking_refused')
+
+
+def integrity(db):
+    """Ghế bị bán hai lần và chuyến có bộ đếm lệch với VeXe"""
+    from app.seats import active_ticket_filter
+
+    double_booked = list(db.VeXe.aggregate([
+        {'$match': active_ticket_filter()},
+        {'$group': {'_id': {'maLichTrinh': '$maLichTrinh', 'maGhe': '$maGhe'}, 'soVe': {'$sum': 1}}},
+        {'$match': {'soVe': {'$gt': 1}}}
+    ]))
+    counts = {row['_id']: row['soVe'] for row in db.VeXe.aggregate([
+        {'$match': active_ticket_filter()}, {'$group': {'_id': '$maLichTrinh', 'soVe': {'$sum': 1}}}
+    ])}
+    drift = [trip['maLichTrinh'] for trip in db.LichTrinh.find({}, {'maLichTrinh': 1, 'soGheDaDat': 1})
+             if (trip.get('soGheDaDat') or 0) != counts.get(trip['maLichTrinh'], 0)]
+    return {
+        'double_booked_seats': sum(row['soVe'] - 1 for row in double_booked),
+        'double_booked': [row['_id'] for row in double_booked][:20],
+        'counter_drift_trips': drift[:20],
+        'tickets': sum(counts.values()),
+    }
+
+
+def report(stats, elapsed, checks):
+    endpoints = {}
+    for endpoint, samples in stats.samples.items():
+        latencies = [seconds * 1000 for seconds, _, _ in samples]
+        endpoints[endpoint] = {
+            'requests': len(samples),
+            'errors': sum(1 for _, _, error in samples if error),
+            'rps': round(len(samples) / elapsed, 1) if elapsed else 0,
+            'p50_ms': round(percentile(latencies, 50), 1),
+            'p95_ms': round(percentile(latencies, 95), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+            'mongo_ops_per_request': round(sum(ops for _, ops, _ in samples) / len(samples), 1),
+        }
+    total = sum(info['requests'] for info in endpoints.values())
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'requests': total,
+        'rps': round(total / elapsed, 1) if elapsed else 0,
+        'endpoints': endpoints,
+        'bookings': dict(stats.bookings),
+        **checks,
+    }
+
+
+def print_report(result):
+    print(f"\n{result['requests']} requests in {result['elapsed_s']}s - {result['rps']} req/s")
+    print(f"{'endpoint':<18}{'req':>7}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'mongo/req':>11}")
+    for endpoint, info in result['endpoints'].items():
+        print(f"{endpoint:<18}{info['requests']:>7}{info['errors']:>6}{info['rps']:>9}"
+              f"{info['p50_ms']:>9}{info['p95_ms']:>9}{info['p99_ms']:>9}{info['mongo_ops_per_request']:>11}")
+    print(f"Bookings: {result['bookings']}")
+    print(f"Tickets: {result['tickets']}")
+    status = '✅' if not result['double_booked_seats'] else '❌'
+    print(f"{status} Double-booked seats: {result['double_booked_seats']}")
+    if result['counter_drift_trips']:
+        print(f"⚠️ Seat counters out of sync: {', '.join(result['counter_drift_trips'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the booking flow against a local mongod')
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--trips', type=int, default=20)
+    parser.add_argument('--seats', type=int, default=40)
+    parser.add_argument('--hot-trips', type=int, default=0,
+                        help='chỉ đặt trên N chuyến đầu để tăng tranh chấp ghế (0 = mọi chuyến)')
+    parser.add_argument('--max-seats', type=int, default=3, help='số ghế tối đa mỗi khách đặt (≤ 5)')
+    parser.add_argument('--no-seed', action='store_true', help='dùng dữ liệu đã seed')
+    parser.add_argument('--json', help='ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    # Listener phải đăng ký trước khi tạo MongoClient
+    counter = CommandCounter()
+    monitoring.register(counter)
+
+    from app import create_app, mongo
+
+    app = create_app(LoadTestConfig)
+    with app.app_context():
+        db = mongo.db
+        if not db.name.endswith('_loadtest'):
+            raise SystemExit(f"Refusing to seed database '{db.name}' - name must end with _loadtest")
+        if args.no_seed:
+            day = db.LichTrinh.find_one(sort=[('ngayDi', 1)])['ngayDi']
+        else:
+            day = seed(db, args.trips, args.seats, args.customers)
+            print(f"Seeded {args.trips} trips x {args.seats} seats, {args.customers} customers")
+        trips = list(db.LichTrinh.find({}, {'diemDi': 1, 'diemDen': 1}).sort('maLichTrinh', 1))
+        if args.hot_trips:
+            trips = trips[:args.hot_trips]
+        customers = list(db.KhachHang.find({}, {'maKhach': 1}).limit(args.customers))
+
+    stats = Stats()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(run_customer, app, counter, stats, customer, trips, day, min(args.max_seats, 5))
+                   for customer in customers]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        result = report(stats, elapsed, integrity(mongo.db))
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2, default=str)
+        print(f"Saved {args.json}")
+
+
+if __name__ == '__main__':
+    main()
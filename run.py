@@ -1,6 +1,30 @@
+# gevent (nếu đã cài): mỗi request - kể cả stream SSE ghế đang mở - là một
+# greenlet, nên hàng nghìn kết nối không chiếm hết thread worker.
+try:
+    from gevent import monkey
+    monkey.patch_all()
+except ImportError:
+    monkey = None
+
+import os
+
 from app import create_app
 
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    from app.waitlist import waitlist_worker
+
+    use_gevent = monkey is not None and os.environ.get('FLASK_DEBUG') != '1'
+    # Worker danh sách chờ chỉ chạy trong process phục vụ, không chạy trong CLI.
+    # app.run(debug=True) bật reloader: process cha chỉ theo dõi file và khởi
+    # động lại process con (WERKZEUG_RUN_MAIN=true) - chỉ process con chạy worker
+    if use_gevent or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        waitlist_worker.start()
+
+    if use_gevent:
+        from gevent.pywsgi import WSGIServer
+        print("Serving on http://127.0.0.1:5000 (gevent)")
+        WSGIServer(('127.0.0.1', 5000), app).serve_forever()
+    else:
+        app.run(debug=True, threaded=True)
@@ -0,0 +1,146 @@
+"""
+Fixture chung cho các test đo truy vấn trên mongod local.
+
+Database riêng (QUERY_BUDGET_MONGO_URI, mặc định .../quanly_xekhach_budget_loadtest)
+bị XÓA và seed lại bằng load_test.seed. Không kết nối được mongod thì các test
+cần database được skip (QUERY_BUDGET_REQUIRE_MONGO=1: báo lỗi); test không cần
+database (VD: route nào cũng được đo hoặc bỏ qua) vẫn chạy.
+
+    pytest                              # so với tests/query_budgets.json
+    pytest --record-budgets             # ghi lại tests/query_budgets.json theo số đo được
+"""
+
+import os
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from app.occupancy import BOOKED_BITS, POSITIONS_FIELD, to_words
+from load_test import LoadTestConfig, seed
+
+MONGO_URI = os.environ.get('QUERY_BUDGET_MONGO_URI', 'mongodb://localhost:27017/quanly_xekhach_budget_loadtest')
+# Bật trên máy build: thiếu mongod là lỗi, không skip âm thầm
+REQUIRE_MONGO = os.environ.get('QUERY_BUDGET_REQUIRE_MONGO') == '1'
+
+
+class BudgetConfig(LoadTestConfig):
+    MONGO_URI = MONGO_URI
+    # Index tạo một lần trong fixture `budget_env`, không tạo khi dựng app cho test không cần DB
+    ENSURE_INDEXES = False
+    # Đo đúng số truy vấn của view, không phải cache response
+    RESPONSE_CACHE_ENABLED = False
+    DB_PROFILER_ENABLED = True
+    DB_PROFILER_SERVER_TIMING = False
+
+
+def pytest_addoption(parser):
+    parser.addoption('--record-budgets', action='store_true',
+                     help='ghi tests/query_budgets.json theo số đo được trên mongod local')
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    measurements = getattr(config, '_budget_measurements', None)
+    if not config.getoption('--record-budgets') or not measurements:
+        return
+    terminalreporter.section('query budgets recorded to tests/query_budgets.json')
+    for endpoint, measurement in sorted(measurements.items()):
+        terminalreporter.write_line(f"{endpoint:<36} {measurement.commands:>4} commands "
+                                    f"{measurement.docs_examined:>6} docs examined")
+
+
+@pytest.fixture(scope='session')
+def app():
+    """App cấu hình cho database đo - chưa kết nối mongod"""
+    from app import create_app
+    return create_app(BudgetConfig)
+
+
+def _mongod_available():
+    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command('ping')
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+
+class BudgetEnv:
+    """App + database đã seed, ba test client (khách, admin, chưa đăng nhập) và tham số URL"""
+
+    def __init__(self, app, db, clients, params):
+        self.app = app
+        self.db = db
+        self.clients = clients
+        self.params = params
+
+
+def _setup(db, customer_client):
+    """Dữ liệu thêm cho các route cần: vé của khách, chuyến hết chỗ, tin tức, tài khoản admin, đại lý"""
+    trip = db.LichTrinh.find_one(sort=[('maLichTrinh', 1)])
+    customer_client.post('/booking/confirm', data={
+        'lich_trinh_id': str(trip['_id']), 'selected_seats': 'A01,A02,A03', 'idempotency_key': uuid4().hex
+    })
+    for collection_name in ('TinTuc', 'TaiKhoan', 'DaiLy'):
+        db[collection_name].delete_many({})
+    agency_id = db.DaiLy.insert_one({'tenDaiLy': 'Đại lý thử', 'diaChi': 'Đà Lạt',
+                                     'soDienThoai': '0900000000'}).inserted_id
+    news_id = db.TinTuc.insert_one({'maTinTuc': 'TT01', 'tieuDe': 'Tin thử', 'noiDung': '...',
+                                    'ngayDang': datetime.now()}).inserted_id
+    account_id = db.TaiKhoan.insert_one({'ten': 'budget_admin', 'matKhau': 'x', 'maLoai': 'ADMIN',
+                                         'role': 'ADMIN', 'ngayTao': datetime.now()}).inserted_id
+    ticket = db.VeXe.find_one({'maLichTrinh': trip['maLichTrinh']}, sort=[('maVe', 1)])
+    assert ticket is not None, 'setup booking did not create tickets'
+    # Chuyến hết chỗ cho danh sách chờ: bật bit mọi ghế (danh sách chờ chỉ đọc bitmap)
+    sold_out = db.LichTrinh.find_one({'maLichTrinh': {'$ne': trip['maLichTrinh']}}, sort=[('maLichTrinh', -1)])
+    db.LichTrinh.update_one({'_id': sold_out['_id']}, {'$set': {
+        BOOKED_BITS: to_words(range(len(sold_out[POSITIONS_FIELD]))),
+        'soGheDaDat': sold_out['tongGhe'],
+    }})
+    return {
+        'lich_trinh_id': str(trip['_id']),
+        'ma_lich_trinh': trip['maLichTrinh'],
+        'trip_id': trip['maLichTrinh'],
+        'ma_ve': ticket['maVe'],
+        'route_id': 'TD01',
+        'vehicle_id': trip['maXe'],
+        'collection_name': 'VeXe',
+        'item_id': str(ticket['_id']),
+        'news_id': str(news_id),
+        'account_id': str(account_id),
+        'agency_id': str(agency_id),
+        'sold_out_id': str(sold_out['_id']),
+        'sold_out_code': sold_out['maLichTrinh'],
+    }
+
+
+@pytest.fixture(scope='session')
+def budget_env(app):
+    """Seed database đo (skip nếu không có mongod) và đăng nhập các test client"""
+    if not _mongod_available():
+        if REQUIRE_MONGO:
+            pytest.fail(f'no mongod reachable at {MONGO_URI} (QUERY_BUDGET_REQUIRE_MONGO is set)')
+        pytest.skip(f'no mongod reachable at {MONGO_URI}')
+    from app import mongo
+    from app.indexes import ensure_indexes
+
+    with app.app_context():
+        db = mongo.db
+        if not db.name.endswith('_loadtest'):
+            pytest.fail(f"Refusing to seed database '{db.name}' - name must end with _loadtest")
+        seed(db, trips=20, seats_per_trip=40, customers=20)
+        ensure_indexes(db)
+        customer = db.KhachHang.find_one({'maKhach': 'KH0001'})
+
+    clients = {name: app.test_client() for name in ('customer', 'admin', 'anonymous')}
+    with clients['customer'].session_transaction() as session:
+        session.update({'customer_id': str(customer['_id']), 'ma_khach': customer['maKhach'], 'role': 'CUSTOMER'})
+    with app.app_context():
+        params = _setup(mongo.db, clients['customer'])
+    with clients['admin'].session_transaction() as session:
+        session.update({'user_id': params['account_id'], 'role': 'ADMIN', 'username': 'budget_admin'})
+    return BudgetEnv(app, db, clients, params)
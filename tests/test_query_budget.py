@@ -0,0 +1,253 @@
+"""
+Ngân sách truy vấn theo endpoint: chặn N+1 quay lại.
+
+Gọi mọi route GET của user_bp, admin_bp, auth_bp một lượt để làm nóng cache
+tham chiếu rồi đo lượt thứ hai, sau đó đo các POST trong SCENARIOS (giữ chỗ,
+đặt vé, hủy vé, danh sách chờ, ...). Mỗi request đo số lệnh MongoDB
+(app/profiler.py) và số document mongod đọc (docsExamined trong system.profile
+- bật profiling level 2 trên database đo). Request phải trả đúng status và không
+flash lỗi: route hỏng sớm gửi ít truy vấn, không được tính là đạt ngân sách.
+
+Ngân sách là số đo được, không phải số ước lượng: `pytest --record-budgets`
+trên mongod ghi tests/query_budgets.json (commit file này). Route chưa có số đo
+vẫn phải đúng status và không có mẫu N+1 (cùng dạng truy vấn lặp từ
+DB_PROFILER_N_PLUS_ONE lần - app/profiler.py); phần so ngân sách được skip.
+"""
+
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+from flask import url_for
+
+from app.profiler import db_profiler
+
+BLUEPRINTS = ('user', 'admin', 'auth')
+
+# Route được đo: GET gọi theo url_map, POST theo scenarios()
+MEASURED = {
+    # user_bp
+    'user.index', 'user.get_stations', 'user.get_available_dates', 'user.search', 'user.booking_demo',
+    'user.booking', 'user.profile', 'user.my_tickets', 'user.trip_history', 'user.update_profile',
+    'user.get_seats_api', 'user.hold_seats_api', 'user.confirm_booking', 'user.join_waitlist',
+    'user.leave_waitlist', 'user.cancel_my_ticket', 'user.routes', 'user.news', 'user.news_detail',
+    # admin_bp
+    'admin.admin_index', 'admin.api_test', 'admin.dashboard', 'admin.admin_users', 'admin.admin_routes',
+    'admin.api_stats', 'admin.api_cache_stats', 'admin.api_response_cache_stats', 'admin.api_seat_events_stats',
+    'admin.api_perf', 'admin.get_route_info', 'admin.get_vehicle_info', 'admin.list_items', 'admin.add_item',
+    'admin.edit_item', 'admin.trip_detail', 'admin.seat_map', 'admin.revenue_report', 'admin.get_seat_data',
+    'admin.create_trip', 'admin.trip_list', 'admin.access_denied', 'admin.accounts', 'admin.add_account',
+    'admin.edit_account', 'admin.permissions', 'admin.statistics', 'admin.seat_holds', 'admin.api_seat_holds',
+    'admin.api_agency_bookings',
+    # auth_bp
+    'auth.login', 'auth.register',
+}
+
+# endpoint -> [số lệnh MongoDB tối đa, số document đọc tối đa] trên bộ dữ liệu seed
+# (20 chuyến x 40 ghế, 20 khách), ghi bởi `pytest --record-budgets` trên mongod
+BUDGET_FILE = Path(__file__).with_name('query_budgets.json')
+
+
+def load_budgets():
+    if not BUDGET_FILE.exists():
+        return {}
+    with BUDGET_FILE.open(encoding='utf-8') as f:
+        return {endpoint: tuple(budget) for endpoint, budget in json.load(f).items()}
+
+
+def save_budgets(measurements):
+    budgets = {endpoint: [m.commands, m.docs_examined] for endpoint, m in sorted(measurements.items())}
+    with BUDGET_FILE.open('w', encoding='utf-8') as f:
+        json.dump(budgets, f, indent=4, ensure_ascii=False)
+        f.write('\n')
+
+
+# Route không đo được trong một lượt chạy - kèm lý do
+SKIPPED = {
+    'user.seat_stream': 'SSE: response không kết thúc',
+    'admin.delete_item': 'GET cũng xóa dữ liệu',
+    'admin.delete_account': 'xóa tài khoản dùng cho các route khác',
+    'admin.create_sample_users': 'tạo tài khoản mẫu cố định',
+    'admin.add_user': 'tạo tài khoản - không thuộc luồng đọc',
+    'admin.seat_map_add_vehicle': 'ghi cấu hình xe / sơ đồ ghế',
+    'admin.seat_map_edit_vehicle': 'ghi cấu hình xe / sơ đồ ghế',
+    'admin.seat_map_delete_vehicle': 'ghi cấu hình xe / sơ đồ ghế',
+    'admin.seat_map_save_layout': 'ghi cấu hình xe / sơ đồ ghế',
+    'auth.logout': 'xóa session của client đo',
+}
+
+# Status của các GET không trả 200
+GET_STATUS = {
+    'admin.admin_index': 302,
+    'admin.admin_routes': 302,
+}
+
+
+def scenarios(params):
+    """POST cần đo, theo thứ tự: (endpoint, client, url, dữ liệu gửi, status mong đợi)"""
+    trip_id = params['lich_trinh_id']
+    profile = {'ten': 'Khách 1', 'dienThoai': '0900000001', 'email': 'khach1@loadtest.local',
+               'diaChi': 'Đà Lạt', 'soCmnd': '000000000001'}
+    return [
+        ('user.hold_seats_api', 'customer', f'/api/seats/{trip_id}/hold', {'json': {'seats': ['A10', 'A11']}}, 200),
+        ('user.confirm_booking', 'customer', '/booking/confirm',
+         {'data': {'lich_trinh_id': trip_id, 'selected_seats': 'A10,A11', 'idempotency_key': uuid4().hex}}, 302),
+        ('user.join_waitlist', 'customer', f"/waitlist/{params['sold_out_id']}", {'data': {'so_ghe': 1}}, 302),
+        ('user.leave_waitlist', 'customer', f"/waitlist/{params['sold_out_code']}/leave", {}, 302),
+        ('user.cancel_my_ticket', 'customer', f"/my-tickets/cancel/{params['ma_ve']}", {}, 302),
+        ('user.update_profile', 'customer', '/profile/update', {'data': profile}, 302),
+        ('admin.api_agency_bookings', 'admin', '/admin/api/agency-bookings',
+         {'json': {'maDaiLy': params['agency_id'],
+                   'items': [{'maLichTrinh': params['ma_lich_trinh'], 'maGhe': 'A20'}]}}, 200),
+        ('auth.login', 'anonymous', '/auth/login',
+         {'data': {'username': 'khach1@loadtest.local', 'password': 'x'}}, 302),
+    ]
+
+
+class Measurement:
+    def __init__(self, method, url, status, expected_status, profile, docs_examined, flashes):
+        self.method = method
+        self.url = url
+        self.status = status
+        self.expected_status = expected_status
+        self.commands = profile['commands']
+        self.shapes = profile['shapes']
+        self.n_plus_one = profile.get('n_plus_one') or {}
+        self.docs_examined = docs_examined
+        self.errors = [message for category, message in flashes if category in ('error', 'danger')]
+
+    def describe(self):
+        lines = [f"{self.method} {self.url} -> {self.status}, {self.commands} commands, "
+                 f"{self.docs_examined} docs examined"]
+        lines += [f"  flash error: {message}" for message in self.errors]
+        lines += [f"  {count:>4}x {shape}" for shape, count in sorted(self.shapes.items(), key=lambda item: -item[1])]
+        return '\n'.join(lines)
+
+
+class DocsExamined:
+    """docsExamined của các lệnh mongod ghi vào system.profile kể từ lần đọc trước"""
+
+    def __init__(self, db):
+        self.db = db
+        db.command('profile', 2)
+        self._since = datetime.now(timezone.utc)
+
+    def take(self):
+        total = 0
+        latest = self._since
+        for entry in self.db['system.profile'].find({'ts': {'$gt': self._since}}, {'ts': 1, 'docsExamined': 1, 'ns': 1}):
+            if '.system.' not in entry.get('ns', ''):
+                total += entry.get('docsExamined', 0)
+            latest = max(latest, entry['ts'].replace(tzinfo=timezone.utc))
+        self._since = latest
+        return total
+
+    def close(self):
+        self.db.command('profile', 0)
+
+
+def blueprint_endpoints(app):
+    return {rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint.split('.', 1)[0] in BLUEPRINTS}
+
+
+def shadowed_endpoints(app):
+    """Endpoint mà URL bị route khác đăng ký trước phục vụ: {endpoint: endpoint thực sự chạy}"""
+    adapter = app.url_map.bind('localhost')
+    shadowed = {}
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint.split('.', 1)[0] not in BLUEPRINTS or rule.arguments:
+            continue
+        method = 'GET' if 'GET' in rule.methods else 'POST'
+        matched, _ = adapter.match(rule.rule, method=method)
+        if matched != rule.endpoint:
+            shadowed[rule.endpoint] = matched
+    return shadowed
+
+
+def get_routes(app, params):
+    """(endpoint, url) cho mọi route GET có ngân sách"""
+    routes = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint not in MEASURED or 'GET' not in rule.methods:
+            continue
+        with app.test_request_context():
+            routes.append((rule.endpoint, url_for(rule.endpoint, **{arg: params[arg] for arg in rule.arguments})))
+    return routes
+
+
+def client_for(endpoint):
+    return {'user': 'customer', 'admin': 'admin', 'auth': 'anonymous'}[endpoint.split('.', 1)[0]]
+
+
+def _measure(client, docs, method, url, expected_status, **kwargs):
+    response = client.open(url, method=method, **kwargs)
+    profile = db_profiler.last_request() or {'commands': 0, 'shapes': {}, 'n_plus_one': {}}
+    with client.session_transaction() as session:
+        flashes = session.pop('_flashes', [])
+    return Measurement(method, url, response.status_code, expected_status, profile, docs.take(), flashes)
+
+
+@pytest.fixture(scope='session')
+def measurements(budget_env, request):
+    """Đo một lượt mọi route trong MEASURED (GET rồi các POST theo thứ tự scenarios())"""
+    routes = get_routes(budget_env.app, budget_env.params)
+    # Lượt làm nóng: cache tham chiếu, trie trạm, đồ thị nối chuyến
+    for endpoint, url in routes:
+        budget_env.clients[client_for(endpoint)].get(url)
+        with budget_env.clients[client_for(endpoint)].session_transaction() as session:
+            session.pop('_flashes', None)
+
+    results = {}
+    docs = DocsExamined(budget_env.db)
+    try:
+        for endpoint, url in routes:
+            results[endpoint] = _measure(budget_env.clients[client_for(endpoint)], docs, 'GET', url,
+                                         GET_STATUS.get(endpoint, 200))
+        for endpoint, client, url, kwargs, status in scenarios(budget_env.params):
+            results[endpoint] = _measure(budget_env.clients[client], docs, 'POST', url, status, **kwargs)
+    finally:
+        docs.close()
+    if request.config.getoption('--record-budgets'):
+        save_budgets(results)
+        request.config._budget_measurements = results
+    return results
+
+
+def test_every_route_is_measured_or_skipped(app):
+    unreachable = shadowed_endpoints(app)
+    missing = sorted(blueprint_endpoints(app) - MEASURED - set(SKIPPED) - set(unreachable))
+    assert not missing, f"Routes that are never measured (add to MEASURED or SKIPPED): {missing}"
+    stale = sorted((MEASURED | set(load_budgets())) - blueprint_endpoints(app))
+    assert not stale, f"Measured routes that no longer exist: {stale}"
+
+
+def test_every_measured_post_has_a_scenario(app):
+    posts_only = {rule.endpoint for rule in app.url_map.iter_rules()
+                  if rule.endpoint in MEASURED and 'GET' not in rule.methods}
+    driven = {endpoint for endpoint, *_ in scenarios({key: '' for key in (
+        'lich_trinh_id', 'ma_lich_trinh', 'ma_ve', 'agency_id', 'sold_out_id', 'sold_out_code')})}
+    assert not posts_only - driven, f"POST routes without a scenario: {sorted(posts_only - driven)}"
+
+
+@pytest.mark.parametrize('endpoint', sorted(MEASURED))
+def test_query_budget(endpoint, measurements, request):
+    measurement = measurements.get(endpoint)
+    assert measurement is not None, f"{endpoint} was not called: add it to scenarios()"
+    assert measurement.status < 500, f"{endpoint} failed:\n{measurement.describe()}"
+    assert measurement.status == measurement.expected_status, \
+        f"{endpoint} returned {measurement.status}, expected {measurement.expected_status}:\n{measurement.describe()}"
+    assert not measurement.errors, f"{endpoint} flashed an error:\n{measurement.describe()}"
+    assert not measurement.n_plus_one, f"{endpoint} repeats a query shape (N+1):\n{measurement.describe()}"
+
+    if request.config.getoption('--record-budgets'):
+        return
+    budget = load_budgets().get(endpoint)
+    if budget is None:
+        pytest.skip(f'no recorded budget for {endpoint}: run pytest --record-budgets against a mongod')
+    max_commands, max_docs = budget
+    assert measurement.commands <= max_commands, \
+        f"{endpoint}: {measurement.commands} commands > budget {max_commands}:\n{measurement.describe()}"
+    assert measurement.docs_examined <= max_docs, \
+        f"{endpoint}: {measurement.docs_examined} docs examined > budget {max_docs}:\n{measurement.describe()}"
@@ -0,0 +1,43 @@
+"""search_trips: một aggregation cho mọi kết quả, không truy vấn thêm theo từng chuyến"""
+
+import pytest
+
+from app.profiler import db_profiler
+from app.search import search_trips
+
+
+@pytest.mark.parametrize('query', [
+    {'maLichTrinh': 'LT0002'},
+    {'maLichTrinh': {'$in': ['LT0002', 'LT0003', 'LT0004']}},
+    {},
+], ids=['one-trip', 'three-trips', 'all-trips'])
+def test_search_trips_is_one_aggregate(budget_env, query):
+    db = budget_env.db
+    expected = db.LichTrinh.count_documents(query)
+    assert expected > 0
+
+    with db_profiler.track() as record:
+        trips = search_trips(db, query, fare_route='TD01')
+
+    assert len(trips) == expected
+    assert record.commands == 1, dict(record.shapes)
+    assert next(iter(record.shapes)).startswith('aggregate LichTrinh')
+
+
+def test_search_trips_enriches_trips(budget_env):
+    db = budget_env.db
+    trip = db.LichTrinh.find_one({'maLichTrinh': 'LT0002'})
+
+    [result] = search_trips(db, {'maLichTrinh': 'LT0002'}, fare_route='TD01')
+
+    assert result['xe_info']['maXeKhach'] == trip['maXe']
+    assert result['gia_ve'] == 300000
+    assert result['total_seats'] == trip['tongGhe']
+    assert result['ghe_trong'] == trip['tongGhe'] - trip['soGheDaDat']
+    assert '_fareKey' not in result and '_giaVe' not in result
+
+
+def test_search_trips_without_fare(budget_env):
+    # Không có GiaVe cho "diemDi-diemDen": gia_ve là None, chuyến vẫn được trả về
+    [result] = search_trips(budget_env.db, {'maLichTrinh': 'LT0002'})
+    assert result['gia_ve'] is None